@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Disk Monitoring Agent (Python) - Incremental folder size tracking
+Reports the same number as disk_agent.sh (du -sk of MONITOR_PATH) without
+walking the whole tree every run: the entries of each directory are cached
+on disk and a directory is only read again when its mtime/inode changed.
+The cached files are still stat'ed every run, since writing to a file in
+place does not change its directory; only listing unchanged directories is
+skipped. A full scan runs every AGENT_FULL_SCAN_EVERY runs.
+
+Reports go through an on-disk spool (spool.py): they keep their
+measurement time and are sent as gzip-compressed batches, so reports made
+while the central server is unreachable are delivered on the next run.
+
+With --watch the agent keeps running and, on Linux, uses inotify to mark
+changed directories between runs (in-place writes included), so the files
+of unchanged directories are not stat'ed at all.
+
+Usage:
+    python3 disk_agent.py                 # one run (cron), report to CENTRAL_SERVER_URL
+    python3 disk_agent.py --print         # only print the size
+    python3 disk_agent.py --full          # ignore the cache for this run
+    python3 disk_agent.py --watch 3600    # report every hour, inotify between runs
+"""
+import argparse
+import ctypes
+import json
+import os
+import select
+import struct
+import sys
+import time
+
+# spool.py ships next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from spool import Spool, batch_url, post_batch  # noqa: E402
+
+# ==================== Configuration (same variables as disk_agent.sh) ====================
+
+CENTRAL_SERVER_URL = os.environ.get('CENTRAL_SERVER_URL', 'http://YOUR_CENTRAL_SERVER_IP:5100/api/report')
+API_TOKEN = os.environ.get('API_TOKEN', 'your-api-token-from-central-server')
+SITE = os.environ.get('SITE', 'Site_A')
+SUB_SITE = os.environ.get('SUB_SITE', 'SubSite_1')
+SERVER_TYPE = os.environ.get('SERVER_TYPE', 'log_server')
+MONITOR_PATH = os.environ.get('MONITOR_PATH', '/data')
+
+# Where the per-directory size cache is kept
+AGENT_CACHE_DIR = os.environ.get('AGENT_CACHE_DIR', '/var/tmp/loghive-agent')
+# Every Nth run ignores the cache (0 = never)
+AGENT_FULL_SCAN_EVERY = int(os.environ.get('AGENT_FULL_SCAN_EVERY', 24))
+# Reports not yet accepted by the central server
+SPOOL_FILE = os.environ.get('SPOOL_FILE', os.path.join(AGENT_CACHE_DIR, 'spool.ndjson'))
+
+CACHE_VERSION = 3
+# A directory modified this close to its scan may change again within the
+# same timestamp tick, so its mtime is not trusted next run (like git's racy index)
+RACY_NS = 2 * 10 ** 9
+
+
+# ==================== Incremental du ====================
+
+class DirSizer:
+    """du -sk of one tree, reading only directories that changed.
+
+    Cache entry per directory: its inode and mtime, the names of its
+    single-link files, hard-linked files and subdirectories, and the bytes
+    of its single-link files. Sizes are st_blocks * 512 of every entry
+    including the directories, hard links counted once, symlinks not
+    followed - as du does.
+
+    stat_files: re-stat the files of unchanged directories. Only turn it off
+    when something else (inotify) invalidates a directory whose files changed.
+    """
+
+    def __init__(self, root, cache_path=None, stat_files=True, full_every=AGENT_FULL_SCAN_EVERY):
+        self.root = os.path.abspath(root)
+        self.cache_path = cache_path
+        self.stat_files = stat_files
+        self.full_every = full_every
+        self.dirs = {}
+        self.inodes = set()  # (dev, ino) of the hard-linked files seen last run
+        self.runs = 0
+        self.dirty = set()
+        self.invalid = False
+        self.before_read = None  # callback(path) before a directory is read (inotify watch)
+        self.stats = {}
+
+    def load(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cache.get('version') == CACHE_VERSION and cache.get('root') == self.root:
+            self.dirs = cache['dirs']
+            self.inodes = set(map(tuple, cache['inodes']))
+            self.runs = cache['runs']
+
+    def save(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'root': self.root, 'runs': self.runs,
+                       'inodes': sorted(self.inodes), 'dirs': self.dirs}, f)
+        os.replace(tmp, self.cache_path)
+
+    def invalidate(self, path=None):
+        """Re-read `path` on the next run (everything when path is None)"""
+        if path is None:
+            self.invalid = True
+        else:
+            self.dirty.add(path)
+
+    def _read_dir(self, path, st, now_ns, links):
+        """Read a directory; returns (entry, bytes of its single-link files) or (None, 0)"""
+        if self.before_read:
+            self.before_read(path)
+        size, files, linked, dirs = 0, [], [], []
+        try:
+            it = os.scandir(path)
+        except OSError:
+            return None, 0
+        statted = 0
+        with it:
+            for de in it:
+                try:
+                    if de.is_dir(follow_symlinks=False):
+                        dirs.append(de.name)
+                        continue
+                    fst = de.stat(follow_symlinks=False)
+                except OSError:
+                    continue  # removed while reading
+                statted += 1
+                if fst.st_nlink > 1:
+                    linked.append(de.name)
+                    links[(fst.st_dev, fst.st_ino)] = fst.st_blocks * 512
+                else:
+                    files.append(de.name)
+                    size += fst.st_blocks * 512
+        self.stats['files_statted'] += statted
+        racy = st.st_mtime_ns >= now_ns - RACY_NS
+        entry = {'ino': st.st_ino, 'mtime': None if racy else st.st_mtime_ns,
+                 'bytes': size, 'files': files, 'links': linked, 'dirs': dirs}
+        return entry, size
+
+    def _restat(self, path, entry, links):
+        """Bytes of the single-link files of a reused entry"""
+        if self.stat_files:
+            size, files = 0, []
+            for name in entry['files']:
+                try:
+                    fst = os.lstat(os.path.join(path, name))
+                except OSError:
+                    continue
+                self.stats['files_statted'] += 1
+                if fst.st_nlink > 1:
+                    # Linked from another directory since: counted once, below
+                    entry['links'].append(name)
+                    continue
+                files.append(name)
+                size += fst.st_blocks * 512
+            entry['files'], entry['bytes'] = files, size
+        for name in entry['links']:
+            try:
+                fst = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue
+            self.stats['files_statted'] += 1
+            links[(fst.st_dev, fst.st_ino)] = fst.st_blocks * 512
+        return entry['bytes']
+
+    def _walk(self, full, now_ns):
+        """Returns (bytes, {(dev, ino): bytes} of hard-linked files, cache entries)"""
+        total = 0
+        links = {}
+        dirs = {}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            total += st.st_blocks * 512
+            entry = None if full or path in self.dirty else self.dirs.get(path)
+            if entry and entry['ino'] == st.st_ino and entry['mtime'] == st.st_mtime_ns:
+                self.stats['dirs_reused'] += 1
+                total += self._restat(path, entry, links)
+            else:
+                self.stats['dirs_read'] += 1
+                entry, files = self._read_dir(path, st, now_ns, links)
+                if entry is None:
+                    continue  # unreadable: du counts the directory itself only
+                total += files
+            dirs[path] = entry
+            stack.extend(os.path.join(path, name) for name in entry['dirs'])
+        return total, links, dirs
+
+    def size_kb(self, full=False):
+        """Disk usage of the tree in KiB, rounded up like du -sk"""
+        now_ns = time.time_ns()
+        full = full or self.invalid or (self.full_every and self.runs % self.full_every == 0)
+        self.stats = {'dirs_read': 0, 'dirs_reused': 0, 'files_statted': 0, 'full': bool(full)}
+
+        total, links, dirs = self._walk(full, now_ns)
+        if not full and not links.keys() <= self.inodes:
+            # A new hard link: its other name may sit in a reused directory,
+            # already counted there as a single-link file. Count everything again.
+            self.stats['full'] = True
+            total, links, dirs = self._walk(True, now_ns)
+
+        self.dirs = dirs
+        self.inodes = set(links)
+        self.dirty.clear()
+        self.invalid = False
+        self.runs += 1
+        return -(-(total + sum(links.values())) // 1024)
+
+def size_mb(size_kb):
+    """KiB -> MB truncated to 2 decimals, like `echo "scale=2; kb / 1024" | bc`"""
+    return size_kb * 100 // 1024 / 100
+
+
+def cache_path_for(root):
+    name = os.path.abspath(root).strip('/').replace('/', '_') or 'root'
+    return os.path.join(AGENT_CACHE_DIR, f'{name}.json')
+
+
+# ==================== inotify (Linux, optional) ====================
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Directory watches through libc's inotify calls (no extra packages)"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}  # watch descriptor -> directory
+        self.watched = set()
+
+    def watch(self, path):
+        if path in self.watched:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+        self.paths[wd] = path
+        self.watched.add(path)
+
+    def read(self, timeout):
+        """Directories with changes within timeout seconds; None in the list
+        means events were lost and everything must be re-read"""
+        ready, _, _ = select.select([self.fd], [], [], max(0, timeout))
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.append(None)
+                continue
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.paths[wd]
+                self.watched.discard(path)
+            changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+# ==================== Report ====================
+
+def log(message):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def send_report(spool, mb):
+    """Spool the report, then send everything pending. True when nothing is left."""
+    spool.append({
+        'site': SITE,
+        'sub_site': SUB_SITE,
+        'server_type': SERVER_TYPE,
+        'path': MONITOR_PATH,
+        'size_mb': mb,
+        'recorded_at': int(time.time()),
+    })
+    url = batch_url(CENTRAL_SERVER_URL)
+    statuses = []
+
+    def send(lines):
+        statuses.append(post_batch(url, API_TOKEN, lines))
+        return statuses[-1]
+    result = spool.drain(send)
+    if result is None:
+        log("Report spooled, another run is sending the spool")
+        return True
+    delivered, left = result
+    if spool.dropped:
+        log(f"Spool full, dropped {spool.dropped} oldest reports")
+        spool.dropped = 0
+    if left:
+        log(f"Report failed (HTTP {statuses[-1] or 'unreachable'}), {left} reports spooled for the next run")
+        return False
+    log(f"Report successful: {mb:.2f} MB" + (f" ({delivered - 1} spooled reports caught up)" if delivered > 1 else ""))
+    return True
+
+
+def measure(sizer, full=False):
+    start = time.perf_counter()
+    mb = size_mb(sizer.size_kb(full))
+    sizer.save()
+    s = sizer.stats
+    log(f"Folder Size: {mb:.2f} MB ({'full scan, ' if s['full'] else ''}{s['dirs_read']} dirs read, "
+        f"{s['dirs_reused']} reused, {s['files_statted']} files stat'ed in {time.perf_counter() - start:.2f}s)")
+    return mb
+
+
+def watch(sizer, interval, spool):
+    """Report every interval seconds; inotify marks changed directories in between"""
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError) as e:
+        log(f"inotify not available ({e}), using the mtime cache only")
+        inotify = None
+    if inotify:
+        def before_read(path):
+            try:
+                inotify.watch(path)
+            except OSError as e:
+                # e.g. fs.inotify.max_user_watches reached: fall back to the mtime cache
+                log(f"Stopping inotify: {e}")
+                sizer.before_read = None
+        sizer.before_read = before_read
+        # Every directory must be read once to get its watch
+        sizer.invalidate()
+
+    while True:
+        deadline = time.monotonic() + interval
+        # While inotify reports every change, unchanged directories need no stat
+        sizer.stat_files = sizer.before_read is None
+        mb = measure(sizer)
+        if spool:
+            send_report(spool, mb)
+        while (remaining := deadline - time.monotonic()) > 0:
+            if sizer.before_read is None:
+                time.sleep(remaining)
+                break
+            for path in inotify.read(remaining):
+                sizer.invalidate(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LogHive disk agent (incremental folder size)')
+    parser.add_argument('--print', action='store_true', help='only print the size, do not report')
+    parser.add_argument('--full', action='store_true', help='ignore the size cache for this run')
+    parser.add_argument('--watch', type=int, metavar='SECONDS', help='keep running, report every SECONDS')
+    parser.add_argument('--cache', default=None, help='size cache file (default: under AGENT_CACHE_DIR)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(MONITOR_PATH):
+        log(f"Error: Path {MONITOR_PATH} does not exist")
+        return 1
+    print("========================================")
+    print("Disk Monitoring Agent (Python) - Folder Size Tracking")
+    print(f"Site: {SITE} / {SUB_SITE}")
+    print(f"Server Type: {SERVER_TYPE}")
+    print(f"Monitor Path: {MONITOR_PATH}")
+    print("========================================", flush=True)
+
+    sizer = DirSizer(MONITOR_PATH, args.cache or cache_path_for(MONITOR_PATH))
+    sizer.load()
+    if args.watch:
+        watch(sizer, args.watch, None if args.print else Spool(SPOOL_FILE))
+        return 0
+    mb = measure(sizer, full=args.full)
+    if args.print:
+        return 0
+    return 0 if send_report(Spool(SPOOL_FILE), mb) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
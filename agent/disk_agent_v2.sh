@@ -2,6 +2,8 @@
 # Disk Monitoring Agent - Collect folder size and report to central server
 # Deploy on VMs at each site and execute periodically via cron
 # Version: 2.0 - Added SSH tunnel support for restricted networks
+# Version: 2.1 - Reports are spooled on disk and sent in gzip batches, so
+#                none are lost while the server or the tunnel is down
 
 # ==================== Configuration (Please modify the following settings) ====================
 # These can be set via environment variables (for Docker) or edited directly (for cron)
@@ -32,6 +34,16 @@ SERVER_TYPE="${SERVER_TYPE:-log_server}"  # Server type: log_server, backup_log_
 # Monitor path
 MONITOR_PATH="${MONITOR_PATH:-/data}"
 
+# Spool: reports wait here (one JSON line each) until the server accepted them
+SPOOL_FILE="${SPOOL_FILE:-/var/tmp/loghive-agent/spool.ndjson}"
+SPOOL_BATCH_SIZE=${SPOOL_BATCH_SIZE:-500}          # reports per upload
+SPOOL_MAX_ATTEMPTS=${SPOOL_MAX_ATTEMPTS:-5}        # failed uploads before waiting for the next run
+SPOOL_BASE_DELAY=${SPOOL_BASE_DELAY:-2}            # backoff: random 0..min(max, base * 2^attempt) s
+SPOOL_MAX_DELAY=${SPOOL_MAX_DELAY:-60}
+SPOOL_CATCHUP_JITTER=${SPOOL_CATCHUP_JITTER:-30}   # random wait before sending a backlog
+SPOOL_MAX_LINES=${SPOOL_MAX_LINES:-100000}         # oldest reports are dropped beyond this
+SPOOL_COMPACT_BYTES=${SPOOL_COMPACT_BYTES:-1048576} # delivered lines are cut off once half the file and this large
+
 # ==================== SSH Tunnel Functions ====================
 
 # Setup SSH tunnel
@@ -111,7 +123,130 @@ get_folder_size_mb() {
     fi
 }
 
-# Send data to central server
+# ==================== Spool ====================
+# Same files as agent/spool.py: delivered lines are skipped through
+# "${SPOOL_FILE}.offset" ("<byte offset> <pending lines>") and only cut off
+# the spool once they are half of it, so a batch costs neither a rewrite
+# of the file nor a line count.
+
+# Run a command holding the spool lock (appends and removals never overlap)
+with_spool_lock() {
+    (
+        flock 9
+        "$@"
+    ) 9>"${SPOOL_FILE}.lock"
+}
+
+# Load SPOOL_OFFSET and SPOOL_PENDING (lock held). Without a usable offset
+# file (first run, or a truncated spool) the lines are counted.
+spool_state() {
+    local size
+    SPOOL_OFFSET=0
+    SPOOL_PENDING=0
+    [ -f "$SPOOL_FILE" ] || return 0
+    size=$(wc -c < "$SPOOL_FILE")
+    if read -r SPOOL_OFFSET SPOOL_PENDING 2>/dev/null < "${SPOOL_FILE}.offset" \
+        && [ "$SPOOL_OFFSET" -ge 0 ] 2>/dev/null && [ "$SPOOL_PENDING" -ge 0 ] 2>/dev/null \
+        && [ "$SPOOL_OFFSET" -le "$size" ] \
+        && { [ "$SPOOL_OFFSET" -eq 0 ] || [ -z "$(tail -c +"$SPOOL_OFFSET" "$SPOOL_FILE" | head -c 1 | tr -d '\n')" ]; }; then
+        return 0
+    fi
+    SPOOL_OFFSET=0
+    SPOOL_PENDING=$(wc -l < "$SPOOL_FILE")
+}
+
+# Commit the offset (lock held)
+spool_save() {
+    printf '%s %s\n' "$1" "$2" > "${SPOOL_FILE}.offset.$$" && mv "${SPOOL_FILE}.offset.$$" "${SPOOL_FILE}.offset"
+}
+
+# Bytes of the N oldest pending lines
+spool_bytes() {
+    tail -c +"$((SPOOL_OFFSET + 1))" "$SPOOL_FILE" | head -n "$1" | wc -c
+}
+
+# Cut the delivered lines off the spool once they are at least half of it
+# and $1 bytes (lock held); updates SPOOL_OFFSET
+spool_compact() {
+    local size
+    size=$(wc -c < "$SPOOL_FILE")
+    if [ "$SPOOL_OFFSET" -ge "$size" ]; then
+        : > "$SPOOL_FILE"
+        SPOOL_OFFSET=0
+    elif [ "$SPOOL_OFFSET" -ge "$1" ] && [ $((SPOOL_OFFSET * 2)) -ge "$size" ]; then
+        tail -c +"$((SPOOL_OFFSET + 1))" "$SPOOL_FILE" > "${SPOOL_FILE}.tmp" && mv "${SPOOL_FILE}.tmp" "$SPOOL_FILE"
+        SPOOL_OFFSET=0
+    fi
+}
+
+# Append one report with its measurement time
+spool_append() {
+    local size_mb=$1 excess
+    spool_state
+    printf '{"site":"%s","sub_site":"%s","server_type":"%s","path":"%s","size_mb":%s,"recorded_at":%s}\n' \
+        "$SITE" "$SUB_SITE" "$SERVER_TYPE" "$MONITOR_PATH" "$size_mb" "$(date +%s)" >> "$SPOOL_FILE"
+    SPOOL_PENDING=$((SPOOL_PENDING + 1))
+    if [ "$SPOOL_PENDING" -gt "$SPOOL_MAX_LINES" ]; then
+        excess=$((SPOOL_PENDING - SPOOL_MAX_LINES))
+        echo "[WARN] Spool full, dropping ${excess} oldest reports"
+        SPOOL_OFFSET=$((SPOOL_OFFSET + $(spool_bytes "$excess")))
+        SPOOL_PENDING=$SPOOL_MAX_LINES
+        spool_compact 0
+    fi
+    spool_save "$SPOOL_OFFSET" "$SPOOL_PENDING"
+}
+
+# Print the N oldest pending reports (lock held)
+spool_head() {
+    spool_state
+    [ -f "$SPOOL_FILE" ] && tail -c +"$((SPOOL_OFFSET + 1))" "$SPOOL_FILE" | head -n "$1"
+}
+
+# Mark the N oldest reports delivered (lock held)
+spool_remove() {
+    local count=$1
+    spool_state
+    SPOOL_OFFSET=$((SPOOL_OFFSET + $(spool_bytes "$count")))
+    SPOOL_PENDING=$((SPOOL_PENDING > count ? SPOOL_PENDING - count : 0))
+    spool_compact "$SPOOL_COMPACT_BYTES"
+    spool_save "$SPOOL_OFFSET" "$SPOOL_PENDING"
+}
+
+# Print the number of pending reports (lock held)
+spool_pending() {
+    spool_state
+    echo "$SPOOL_PENDING"
+}
+
+# Random integer in [0, max]
+jitter() {
+    echo $(( RANDOM % ($1 + 1) ))
+}
+
+# POST a batch file as gzip-compressed NDJSON; prints the HTTP status
+# (503 when some reports did not fit the server's ingest queue)
+post_batch() {
+    local batch_file=$1
+    local batch_url="${2}/batch"
+    local response http_code
+    response=$(gzip -c "$batch_file" | curl -s -w "\n%{http_code}" -X POST "$batch_url" \
+        -H "Content-Type: application/x-ndjson" \
+        -H "Content-Encoding: gzip" \
+        -H "X-API-Token: ${API_TOKEN}" \
+        --data-binary @- \
+        --connect-timeout 10 \
+        --max-time 60)
+    http_code=$(echo "$response" | tail -n1)
+    if [ "$http_code" = "202" ] && echo "$response" | grep -q "Ingest queue full"; then
+        http_code=503
+    fi
+    echo "$http_code"
+}
+
+# Send data to central server: spool the report, then send everything pending
+# oldest first. A batch is removed once the server answered 200/202, or 400
+# (every report in it invalid). The server ignores reports it already stored,
+# so resending a batch after a lost response is harmless.
 send_report() {
     local size_mb=$1
     local api_url="$CENTRAL_SERVER_URL"
@@ -121,35 +256,55 @@ send_report() {
         api_url="http://localhost:${SSH_LOCAL_PORT}/api/report"
     fi
     
-    local json_data
-    json_data=$(cat <<EOF
-{
-    "token": "${API_TOKEN}",
-    "site": "${SITE}",
-    "sub_site": "${SUB_SITE}",
-    "server_type": "${SERVER_TYPE}",
-    "path": "${MONITOR_PATH}",
-    "size_mb": ${size_mb}
-}
-EOF
-)
-    
-    # Send POST request
-    response=$(curl -s -w "\n%{http_code}" -X POST "$api_url" \
-        -H "Content-Type: application/json" \
-        -d "$json_data" \
-        --connect-timeout 10 \
-        --max-time 30)
+    mkdir -p "$(dirname "$SPOOL_FILE")"
+    with_spool_lock spool_append "$size_mb"
     
-    # Parse response
-    http_code=$(echo "$response" | tail -n1)
-    body=$(echo "$response" | sed '$d')
+    # Only one run sends the spool at a time
+    exec 8>"${SPOOL_FILE}.drain"
+    if ! flock -n 8; then
+        echo "[$(date '+%Y-%m-%d %H:%M:%S')] Report spooled, another run is sending the spool"
+        return 0
+    fi
+    
+    local batch_file="${SPOOL_FILE}.batch"
+    local attempt=0 delivered=0 count http_code delay
+    with_spool_lock spool_head "$SPOOL_BATCH_SIZE" > "$batch_file"
+    count=$(wc -l < "$batch_file")
+    if [ "$count" -gt 1 ]; then
+        # Catching up after an outage: do not resend at the same moment as every other agent
+        sleep "$(jitter "$SPOOL_CATCHUP_JITTER")"
+    fi
+    
+    while [ "$count" -gt 0 ]; do
+        http_code=$(post_batch "$batch_file" "$api_url")
+        case "$http_code" in
+            200|202|400)
+                with_spool_lock spool_remove "$count"
+                delivered=$((delivered + count))
+                attempt=0
+                with_spool_lock spool_head "$SPOOL_BATCH_SIZE" > "$batch_file"
+                count=$(wc -l < "$batch_file")
+                continue
+                ;;
+        esac
+        attempt=$((attempt + 1))
+        if [ "$http_code" = "401" ] || [ "$attempt" -ge "$SPOOL_MAX_ATTEMPTS" ]; then
+            break
+        fi
+        delay=$(( SPOOL_BASE_DELAY << attempt ))
+        [ "$delay" -gt "$SPOOL_MAX_DELAY" ] && delay=$SPOOL_MAX_DELAY
+        sleep "$(jitter "$delay")"
+    done
+    rm -f "$batch_file"
+    flock -u 8
     
-    if [ "$http_code" = "200" ]; then
-        echo "[$(date '+%Y-%m-%d %H:%M:%S')] Report successful: ${size_mb} MB"
+    local left
+    left=$(with_spool_lock spool_pending)
+    if [ "$left" -eq 0 ]; then
+        echo "[$(date '+%Y-%m-%d %H:%M:%S')] Report successful: ${size_mb} MB (${delivered} reports sent)"
         return 0
     else
-        echo "[$(date '+%Y-%m-%d %H:%M:%S')] Report failed (HTTP ${http_code}): ${body}"
+        echo "[$(date '+%Y-%m-%d %H:%M:%S')] Report failed (HTTP ${http_code}), ${left} reports spooled for the next run"
         return 1
     fi
 }
@@ -1,6 +1,8 @@
 #!/bin/bash
 # Agent Container Entrypoint
 # Starts file_generator.sh in background + disk_agent.sh in foreground loop
+# (AGENT_MODE=python: disk_agent.py --watch, incremental sizing via inotify;
+#  AGENT_MODE=relay: run the site relay instead of an agent)
 
 set -e
 
@@ -17,8 +19,13 @@ echo "Monitor Path: ${MONITOR_PATH:-/data}"
 echo "Report Interval: ${REPORT_INTERVAL}s"
 echo "File Gen Interval: ${FILE_GEN_INTERVAL:-86400}s"
 echo "Max Size: ${MAX_SIZE_MB:-500}MB"
+echo "Agent Mode: ${AGENT_MODE:-shell}"
 echo "========================================"
 
+if [ "${AGENT_MODE:-shell}" = "relay" ]; then
+    exec python3 "${SCRIPT_DIR}/relay.py"
+fi
+
 # Ensure data directory exists
 mkdir -p "${MONITOR_PATH:-/data}"
 
@@ -30,6 +37,14 @@ FILE_GEN_PID=$!
 cleanup() { kill "$FILE_GEN_PID" 2>/dev/null; exit 0; }
 trap cleanup SIGTERM SIGINT
 
+if [ "${AGENT_MODE:-shell}" = "python" ]; then
+    python3 "${SCRIPT_DIR}/disk_agent.py" --watch "$REPORT_INTERVAL" &
+    AGENT_PID=$!
+    trap 'kill "$FILE_GEN_PID" "$AGENT_PID" 2>/dev/null; exit 0' SIGTERM SIGINT
+    wait "$AGENT_PID"
+    exit $?
+fi
+
 # Run disk agent in a loop
 while true; do
     "${SCRIPT_DIR}/disk_agent.sh"
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Site relay - fans in the agents of one site and forwards their reports in batches
+
+Agents at a site point CENTRAL_SERVER_URL at the relay instead of the central
+server. The relay accepts /api/report and /api/report/batch like the central
+server does, stamps each report with its receipt time (unless it carries
+recorded_at), appends it to an on-disk spool (spool.py) and answers at
+once. A forwarder thread sends the spool every RELAY_FLUSH_INTERVAL seconds
+(sooner when RELAY_BATCH_SIZE reports are waiting) as gzip-compressed
+batches over one keep-alive connection - or one SSH tunnel - to the central
+server. While the central server is unreachable reports stay in the spool.
+
+N agent connections (and N SSH tunnels) per site become one.
+
+Endpoints:
+    POST /api/report          same body as the central server
+    POST /api/report/batch    JSON array / envelope or NDJSON, optionally gzip
+    GET  /metrics             relay queue metrics (Prometheus text format)
+    GET  /health              200 with the spool depth
+
+Usage:
+    UPSTREAM_URL=http://central:5100/api/report API_TOKEN=... python3 relay.py
+"""
+import gzip
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# spool.py ships next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from spool import Spool  # noqa: E402
+
+# ==================== Configuration ====================
+
+RELAY_HOST = os.environ.get('RELAY_HOST', '0.0.0.0')
+RELAY_PORT = int(os.environ.get('RELAY_PORT', 5101))
+# Central server /api/report URL (batches go to .../batch)
+UPSTREAM_URL = os.environ.get('UPSTREAM_URL', 'http://YOUR_CENTRAL_SERVER_IP:5100/api/report')
+# Agents authenticate with it, and the relay uses it upstream
+API_TOKEN = os.environ.get('API_TOKEN', 'your-api-token-from-central-server')
+RELAY_SPOOL_FILE = os.environ.get('RELAY_SPOOL_FILE', '/var/tmp/loghive-relay/spool.ndjson')
+RELAY_FLUSH_INTERVAL = float(os.environ.get('RELAY_FLUSH_INTERVAL', 60))
+RELAY_BATCH_SIZE = int(os.environ.get('RELAY_BATCH_SIZE', 1000))
+RELAY_SPOOL_MAX_BYTES = int(os.environ.get('RELAY_SPOOL_MAX_BYTES', 256 * 1024 * 1024))
+# Largest agent request body (after gzip decoding)
+RELAY_MAX_BODY_BYTES = int(os.environ.get('RELAY_MAX_BODY_BYTES', 8 * 1024 * 1024))
+# Same check as the central server: a recorded_at further ahead of the
+# relay's clock than this is rejected
+REPORT_MAX_FUTURE_SECONDS = int(os.environ.get('REPORT_MAX_FUTURE_SECONDS', 300))
+
+# Same variables as disk_agent_v2.sh: with CONNECTION_METHOD=ssh_tunnel the
+# relay keeps one `ssh -N -L` tunnel open and sends through localhost
+CONNECTION_METHOD = os.environ.get('CONNECTION_METHOD', 'direct')
+SSH_TUNNEL_HOST = os.environ.get('SSH_TUNNEL_HOST', 'YOUR_SSH_HOST_IP')
+SSH_TUNNEL_USER = os.environ.get('SSH_TUNNEL_USER', 'your_ssh_username')
+SSH_TUNNEL_PORT = int(os.environ.get('SSH_TUNNEL_PORT', 22))
+SSH_LOCAL_PORT = int(os.environ.get('SSH_LOCAL_PORT', 15100))
+DASHBOARD_PORT = int(os.environ.get('DASHBOARD_PORT', 5100))
+
+REPORT_FIELDS = ['site', 'sub_site', 'server_type', 'path', 'size_mb']
+
+
+def log(message):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+# ==================== Metrics ====================
+
+class Metrics:
+    """Relay counters, rendered in the Prometheus text format"""
+
+    COUNTERS = {
+        'loghive_relay_reports_received_total': 'Reports accepted from agents',
+        'loghive_relay_reports_rejected_total': 'Reports rejected (invalid or wrong token)',
+        'loghive_relay_reports_forwarded_total': 'Reports delivered to the central server',
+        'loghive_relay_reports_dropped_total': 'Oldest reports dropped because the spool was full',
+        'loghive_relay_batches_forwarded_total': 'Batches delivered to the central server',
+        'loghive_relay_upstream_failures_total': 'Failed batch uploads (unreachable or error status)',
+        'loghive_relay_upstream_connects_total': 'Connections opened to the central server',
+    }
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.values = dict.fromkeys(self.COUNTERS, 0)
+        self.last_forward = 0
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.values[name] += amount
+
+    def render(self):
+        try:
+            spool_bytes = os.path.getsize(self.spool.path)
+        except OSError:
+            spool_bytes = 0
+        gauges = {
+            'loghive_relay_spool_reports': ('Reports waiting in the spool', len(self.spool)),
+            'loghive_relay_spool_bytes': ('Size of the spool file', spool_bytes),
+            'loghive_relay_last_forward_timestamp_seconds': (
+                'Time of the last delivered batch (0: none yet)', self.last_forward),
+        }
+        out = []
+        with self.lock:
+            for name, help_text in self.COUNTERS.items():
+                out += [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {self.values[name]}']
+        for name, (help_text, value) in gauges.items():
+            out += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(out) + '\n'
+
+
+# ==================== Upstream ====================
+
+class SSHTunnel:
+    """One `ssh -N -L` for the whole site, restarted when it exits"""
+
+    def __init__(self):
+        self.proc = None
+
+    def ensure(self):
+        if self.proc and self.proc.poll() is None:
+            return
+        log(f"Opening SSH tunnel to {SSH_TUNNEL_HOST}")
+        self.proc = subprocess.Popen([
+            'ssh', '-N', '-o', 'ExitOnForwardFailure=yes', '-o', 'ServerAliveInterval=30',
+            '-L', f'{SSH_LOCAL_PORT}:localhost:{DASHBOARD_PORT}',
+            '-p', str(SSH_TUNNEL_PORT), f'{SSH_TUNNEL_USER}@{SSH_TUNNEL_HOST}',
+        ])
+        time.sleep(2)
+
+    def close(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+
+
+class Upstream:
+    """Keep-alive HTTP connection to the central server's batch endpoint"""
+
+    def __init__(self, url, token, metrics, tunnel=None, timeout=60):
+        if tunnel:
+            url = f'http://localhost:{SSH_LOCAL_PORT}/api/report'
+        parts = urllib.parse.urlsplit(url.rstrip('/') + '/batch')
+        self.https = parts.scheme == 'https'
+        self.host = parts.netloc
+        self.path = parts.path
+        self.token = token
+        self.metrics = metrics
+        self.tunnel = tunnel
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self):
+        if self.tunnel:
+            self.tunnel.ensure()
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, timeout=self.timeout)
+        self.metrics.inc('loghive_relay_upstream_connects_total')
+
+    def send(self, lines):
+        """POST one batch; returns the HTTP status or None (see spool.post_batch)"""
+        body = gzip.compress(b''.join(lines))
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip', 'X-API-Token': self.token}
+        # A kept-alive connection the server already closed fails on first use:
+        # reconnect once before counting a failure
+        for retry in (False, True):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request('POST', self.path, body, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                status = response.status
+                if response.will_close:
+                    self.close()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if retry:
+                    log(f"Upstream unreachable: {e}")
+                    self.metrics.inc('loghive_relay_upstream_failures_total')
+                    return None
+        if status == 202 and b'Ingest queue full' in data:
+            status = 503
+        if status in (200, 202):
+            self.metrics.inc('loghive_relay_batches_forwarded_total')
+            self.metrics.inc('loghive_relay_reports_forwarded_total', len(lines))
+            self.metrics.last_forward = int(time.time())
+        else:
+            log(f"Upstream answered HTTP {status}: {data[:200].decode(errors='replace')}")
+            self.metrics.inc('loghive_relay_upstream_failures_total')
+        return status
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Forwarder(threading.Thread):
+    """Drains the spool every interval, or as soon as a batch is full"""
+
+    def __init__(self, spool, upstream, interval, batch_size):
+        super().__init__(name='relay-forwarder', daemon=True)
+        self.spool = spool
+        self.upstream = upstream
+        self.interval = interval
+        self.batch_size = batch_size
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        # Backoff sleep between failed uploads; ends early on shutdown
+        self.sleep = self.stopping.wait
+        self.pending = 0  # reports received since the last drain
+        self.lock = threading.Lock()  # pending is updated by every handler thread
+
+    def notify(self, count):
+        with self.lock:
+            self.pending += count
+            full = self.pending >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wake.wait(self.interval)
+            with self.lock:
+                self.wake.clear()
+                self.pending = 0
+            self.flush()
+
+    def flush(self):
+        # Agents are already spread out, so no catch-up jitter
+        result = self.spool.drain(self.upstream.send, batch_size=self.batch_size,
+                                  catchup_jitter=0, sleep=self.sleep)
+        if self.spool.dropped:
+            self.upstream.metrics.inc('loghive_relay_reports_dropped_total', self.spool.dropped)
+            log(f"Spool full, dropped {self.spool.dropped} oldest reports")
+            self.spool.dropped = 0
+        if result and result[1]:
+            log(f"{result[1]} reports spooled until the central server is reachable")
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+
+
+# ==================== Agent-facing server ====================
+
+def to_epoch(value):
+    """Epoch number or 'YYYY-MM-DD HH:MM:SS' / ISO 8601 string (naive: UTC) to
+    epoch seconds, as the central server's models.to_epoch"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def validate(item, token):
+    """Spool line for one agent report, or raises ValueError with the reason"""
+    if not isinstance(item, dict):
+        raise ValueError('Invalid report')
+    if token is None and item.get('token') != API_TOKEN:
+        raise ValueError('Invalid token')
+    for field in REPORT_FIELDS:
+        if field not in item:
+            raise ValueError(f'Missing field: {field}')
+    try:
+        size_mb = float(item['size_mb'])
+    except (ValueError, TypeError):
+        raise ValueError('Invalid size_mb value') from None
+    now = int(time.time())
+    recorded_at = item.get('recorded_at')
+    if recorded_at is None:
+        # Receipt time, so batching delay does not shift the sample
+        recorded_at = now
+    else:
+        try:
+            recorded_at = to_epoch(recorded_at)
+        except (ValueError, TypeError, AttributeError, OverflowError):
+            raise ValueError('Invalid recorded_at value') from None
+        if recorded_at > now + REPORT_MAX_FUTURE_SECONDS:
+            raise ValueError('recorded_at is in the future')
+    report = {field: item[field] for field in REPORT_FIELDS}
+    report['size_mb'] = size_mb
+    report['recorded_at'] = recorded_at
+    return json.dumps(report, separators=(',', ':')).encode() + b'\n'
+
+
+class BodyTooLarge(ValueError):
+    def __init__(self):
+        super().__init__(f'Body too large (max {RELAY_MAX_BODY_BYTES} bytes)')
+
+
+class RelayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'LogHiveRelay/1.0'
+    relay = None  # set by serve(): object with spool, metrics, forwarder
+
+    def log_message(self, format, *args):
+        pass  # one line per agent report would drown the relay log
+
+    def _reply(self, status, payload, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        """Request body, gzip-decoded and at most RELAY_MAX_BODY_BYTES.
+        Raises ValueError, BodyTooLarge over the limit; a body that is not
+        read to its end closes the connection."""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            raise ValueError('Invalid Content-Length') from None
+        if length > RELAY_MAX_BODY_BYTES:
+            # Unread, the body would be parsed as the next request on this connection
+            self.close_connection = True
+            raise BodyTooLarge()
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            # Bounded, so a small gzip bomb cannot exhaust memory
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                data = decoder.decompress(data, RELAY_MAX_BODY_BYTES + 1)
+            except zlib.error:
+                raise ValueError('Invalid gzip body') from None
+            if len(data) > RELAY_MAX_BODY_BYTES:
+                raise BodyTooLarge()
+        return data
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.relay.metrics.render().encode(), 'text/plain; version=0.0.4')
+        elif self.path == '/health':
+            self._reply(200, {'status': 'ok', 'spooled': len(self.relay.spool)})
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        try:
+            data = self._body()
+        except BodyTooLarge as e:
+            return self._reply(413, {'error': str(e)})
+        except (ValueError, OSError, EOFError) as e:
+            return self._reply(400, {'error': str(e) or 'Invalid body'})
+        if self.path == '/api/report':
+            return self._report(data)
+        if self.path == '/api/report/batch':
+            return self._batch(data)
+        self._reply(404, {'error': 'Not found'})
+
+    def _accept(self, lines, rejected):
+        metrics = self.relay.metrics
+        if lines:
+            self.relay.spool.append_many(lines)
+            metrics.inc('loghive_relay_reports_received_total', len(lines))
+            self.relay.forwarder.notify(len(lines))
+        if rejected:
+            metrics.inc('loghive_relay_reports_rejected_total', rejected)
+
+    def _report(self, data):
+        try:
+            item = json.loads(data)
+        except ValueError:
+            item = None
+        if not isinstance(item, dict) or item.get('token') != API_TOKEN:
+            self._accept([], 1)
+            return self._reply(401, {'error': 'Invalid token'})
+        try:
+            line = validate(item, API_TOKEN)
+        except ValueError as e:
+            self._accept([], 1)
+            return self._reply(400, {'error': str(e)})
+        self._accept([line], 0)
+        # 200, not 202: disk_agent.sh treats anything else as a failure
+        self._reply(200, {'success': True, 'message': 'Data queued'})
+
+    def _batch(self, data):
+        token = self.headers.get('X-API-Token')
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type in ('application/x-ndjson', 'application/jsonl'):
+            items = []
+            for raw in data.splitlines():
+                if raw.strip():
+                    try:
+                        items.append(json.loads(raw))
+                    except ValueError:
+                        items.append(None)
+        else:
+            try:
+                items = json.loads(data)
+            except ValueError:
+                items = None
+            if isinstance(items, dict):
+                token = token or items.get('token')
+                items = items.get('reports')
+        if token is not None and token != API_TOKEN:
+            return self._reply(401, {'error': 'Invalid token'})
+        if not isinstance(items, list) or not items:
+            return self._reply(400, {'error': 'No reports'})
+
+        lines, results = [], []
+        for index, item in enumerate(items):
+            try:
+                lines.append(validate(item, token))
+                results.append({'index': index, 'success': True})
+            except ValueError as e:
+                results.append({'index': index, 'success': False, 'error': str(e)})
+        self._accept(lines, len(items) - len(lines))
+        payload = {'success': bool(lines), 'accepted': len(lines), 'rejected': len(items) - len(lines),
+                   'results': results}
+        self._reply(200 if lines else 400, payload)
+
+
+class Relay:
+    def __init__(self, spool_file=RELAY_SPOOL_FILE, upstream_url=UPSTREAM_URL,
+                 interval=RELAY_FLUSH_INTERVAL, batch_size=RELAY_BATCH_SIZE):
+        self.spool = Spool(spool_file, max_bytes=RELAY_SPOOL_MAX_BYTES)
+        self.metrics = Metrics(self.spool)
+        self.tunnel = SSHTunnel() if CONNECTION_METHOD == 'ssh_tunnel' else None
+        self.upstream = Upstream(upstream_url, API_TOKEN, self.metrics, self.tunnel)
+        self.forwarder = Forwarder(self.spool, self.upstream, interval, batch_size)
+
+    def serve(self, host=RELAY_HOST, port=RELAY_PORT):
+        handler = type('Handler', (RelayHandler,), {'relay': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.forwarder.start()
+        return self.server
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.forwarder.stop()
+        self.forwarder.join()
+        self.forwarder.flush()  # last attempt, whatever is left stays spooled
+        self.upstream.close()
+        if self.tunnel:
+            self.tunnel.close()
+
+
+def main():
+    relay = Relay()
+    server = relay.serve()
+    print("========================================")
+    print("LogHive Site Relay")
+    print(f"Listening: {RELAY_HOST}:{RELAY_PORT}")
+    print(f"Upstream: {UPSTREAM_URL} ({CONNECTION_METHOD})")
+    print(f"Flush: every {RELAY_FLUSH_INTERVAL:g}s or {RELAY_BATCH_SIZE} reports")
+    print(f"Spool: {RELAY_SPOOL_FILE} ({len(relay.spool)} reports pending)")
+    print("========================================", flush=True)
+
+    def stop(signum, frame):
+        threading.Thread(target=relay.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
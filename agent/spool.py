@@ -0,0 +1,266 @@
+"""
+Agent-side spool - reports wait on disk until the central server took them
+
+Each report is appended as one JSON line, with the recorded_at of the
+measurement, to a spool file. drain() sends the oldest lines as a
+gzip-compressed NDJSON batch to /api/report/batch and marks them delivered
+once the server answered; when a send fails it retries with
+exponential backoff and full jitter, then gives up until the next run. The
+lines stay in the file, so nothing is lost while the server or the SSH
+tunnel is down, and after an outage the backlog is caught up in a few
+requests instead of one POST per sample.
+
+Delivered lines are skipped through a committed read offset kept next to
+the spool (path + '.offset', with the number of pending lines), and only cut
+off the file once they make up half of it. Catching up a long backlog thus
+reads and rewrites the file a few times instead of once per batch.
+
+The server stores a sample with the same series, recorded_at and size once,
+so a batch that was stored but whose response was lost can be sent again
+(as it is when the offset file is lost).
+
+Usage (from another agent script):
+    spool = Spool('/var/tmp/loghive-agent/spool.ndjson')
+    spool.append({'site': ..., 'size_mb': 12.5, 'recorded_at': int(time.time())})
+    spool.drain(lambda body: post_batch(batch_url(CENTRAL_SERVER_URL), API_TOKEN, body))
+"""
+import fcntl
+import gzip
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+# Reports per upload (the server accepts up to BATCH_MAX_REPORTS, default 5000)
+SPOOL_BATCH_SIZE = int(os.environ.get('SPOOL_BATCH_SIZE', 500))
+# Failed sends per drain before waiting for the next run
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('SPOOL_MAX_ATTEMPTS', 5))
+# Backoff: random delay up to min(SPOOL_MAX_DELAY, SPOOL_BASE_DELAY * 2^attempt)
+SPOOL_BASE_DELAY = float(os.environ.get('SPOOL_BASE_DELAY', 2))
+SPOOL_MAX_DELAY = float(os.environ.get('SPOOL_MAX_DELAY', 60))
+# Random wait before catching up a backlog, so agents do not all resend at once
+SPOOL_CATCHUP_JITTER = float(os.environ.get('SPOOL_CATCHUP_JITTER', 30))
+# Oldest reports are dropped beyond this size of pending reports (the file
+# itself may grow to twice that before dropped lines are cut off)
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', 16 * 1024 * 1024))
+# Delivered lines are cut off the file once they are half of it and this large
+SPOOL_COMPACT_BYTES = int(os.environ.get('SPOOL_COMPACT_BYTES', 1024 * 1024))
+
+# Responses after which a batch is removed from the spool. 400 means every
+# report in it was invalid: resending would never succeed.
+DONE_STATUSES = (200, 202, 400)
+
+
+class Spool:
+    """Append-only file of pending reports (one JSON object per line).
+    The offset file holds the byte offset of the oldest pending line and
+    the number of pending lines."""
+
+    def __init__(self, path, max_bytes=SPOOL_MAX_BYTES, compact_bytes=SPOOL_COMPACT_BYTES):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self.max_bytes = max_bytes
+        self.compact_bytes = compact_bytes
+        self.dropped = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @contextmanager
+    def _lock(self, suffix='.lock', blocking=True):
+        """flock on a side file; yields False when non-blocking and already held"""
+        with open(self.path + suffix, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _state(self):
+        """(offset, pending lines) (lock held). Without a usable offset file
+        (first run, or a spool written by another agent) the lines are counted."""
+        try:
+            with open(self.offset_path) as f:
+                offset, count = map(int, f.read().split())
+            with open(self.path, 'rb') as f:
+                if offset > os.fstat(f.fileno()).st_size:
+                    raise ValueError('spool was truncated')
+                if offset:
+                    f.seek(offset - 1)
+                    if f.read(1) != b'\n':
+                        raise ValueError('offset is not at a line start')
+            return offset, count
+        except (OSError, ValueError):
+            pass
+        count = 0
+        try:
+            with open(self.path, 'rb') as f:
+                count = sum(1 for line in f if line.endswith(b'\n'))
+        except FileNotFoundError:
+            pass
+        return 0, count
+
+    def _save(self, offset, count):
+        """Commit the offset (lock held). Not fsync'ed: losing it only
+        resends delivered lines, which the server ignores."""
+        tmp = f'{self.offset_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(f'{offset} {count}\n')
+        os.replace(tmp, self.offset_path)
+
+    def append(self, report):
+        self.append_many([json.dumps(report, separators=(',', ':')).encode() + b'\n'])
+
+    def append_many(self, lines):
+        """Append already encoded report lines (bytes ending in newline)"""
+        with self._lock():
+            offset, count = self._state()
+            with open(self.path, 'ab') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            count += len(lines)
+            if size - offset > self.max_bytes:
+                offset, count = self._skip(offset, count, size - offset - self.max_bytes)
+            self._save(offset, count)
+
+    def _skip(self, offset, count, excess):
+        """Drop the oldest whole pending lines covering `excess` bytes (lock held)"""
+        dropped = 0
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while excess > 0:
+                line = f.readline()
+                if not line:
+                    break
+                excess -= len(line)
+                dropped += 1
+            offset = f.tell()
+        self.dropped += dropped
+        return self._compact(offset, min_bytes=0), count - dropped
+
+    def _compact(self, offset, min_bytes=None):
+        """Cut the delivered lines before `offset` off the file once they are
+        at least half of it and min_bytes (default compact_bytes) (lock held).
+        Returns the new offset."""
+        min_bytes = self.compact_bytes if min_bytes is None else min_bytes
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset >= size:
+                os.truncate(self.path, 0)
+                return 0
+            if offset < min_bytes or offset * 2 < size:
+                return offset
+            f.seek(offset)
+            self._rewrite(f)
+        return 0
+
+    def _rewrite(self, f):
+        """Replace the spool with the rest of the open file f (lock held)"""
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as out:
+            while True:
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    break
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, self.path)
+
+    def peek(self, count):
+        """Up to `count` oldest lines"""
+        lines = []
+        with self._lock():
+            offset, _ = self._state()
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break  # partial line of an interrupted append
+                        lines.append(line)
+                        if len(lines) >= count:
+                            break
+            except FileNotFoundError:
+                pass
+        return lines
+
+    def remove(self, count):
+        """Mark the `count` oldest lines delivered"""
+        with self._lock():
+            offset, pending = self._state()
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                for _ in range(count):
+                    f.readline()
+                offset = f.tell()
+            self._save(self._compact(offset), max(pending - count, 0))
+
+    def __len__(self):
+        with self._lock():
+            return self._state()[1]
+
+    def drain(self, send, batch_size=SPOOL_BATCH_SIZE, max_attempts=SPOOL_MAX_ATTEMPTS,
+              base_delay=SPOOL_BASE_DELAY, max_delay=SPOOL_MAX_DELAY,
+              catchup_jitter=SPOOL_CATCHUP_JITTER, sleep=time.sleep):
+        """Send pending reports, oldest first, batch by batch.
+
+        send(lines) posts one batch and returns the HTTP status (None when the
+        server could not be reached). Returns (reports delivered, reports left),
+        or None when another process is already draining this spool.
+        """
+        with self._lock('.drain', blocking=False) as locked:
+            if not locked:
+                return None
+            delivered = 0
+            attempt = 0
+            lines = self.peek(batch_size)
+            if len(lines) > 1 and catchup_jitter > 0:
+                sleep(random.uniform(0, catchup_jitter))
+            while lines:
+                status = send(lines)
+                if status in DONE_STATUSES:
+                    self.remove(len(lines))
+                    delivered += len(lines)
+                    attempt = 0
+                    lines = self.peek(batch_size)
+                    continue
+                attempt += 1
+                if status == 401 or attempt >= max_attempts:
+                    break  # a wrong token will not fix itself; wait for the next run
+                sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            return delivered, len(self)
+
+
+def batch_url(report_url):
+    """/api/report/batch next to the configured /api/report URL"""
+    return report_url.rstrip('/') + '/batch'
+
+
+def post_batch(url, token, lines, timeout=30):
+    """POST spooled report lines as gzip-compressed NDJSON.
+    Returns the HTTP status, or None when the server was not reachable.
+    A 202 in which some reports did not fit the server's ingest queue is
+    returned as 503, so the whole batch is sent again (duplicates are ignored)."""
+    request = urllib.request.Request(url, data=gzip.compress(b''.join(lines)), headers={
+        'Content-Type': 'application/x-ndjson',
+        'Content-Encoding': 'gzip',
+        'X-API-Token': token,
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+    if status == 202 and b'Ingest queue full' in body:
+        return 503
+    return status
@@ -1,17 +1,40 @@
 ﻿# LogHive - Main Flask Application
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import init_db, User, DiskUsage
-from config import SECRET_KEY, SESSION_LIFETIME, API_TOKEN, SITES_CONFIG, ENVIRONMENT, PORT
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import init_db, to_epoch, User, DiskUsage
+from ingest import IngestQueue, ingest_queue_depth
+from stream import ChangeFeed, StreamFull, event_stream
+from auth import TokenBucket, HashPool, PoolBusy, login_attempts_counter
+from bulkload import bulk_load, demo_rows, demo_row_count, DEMO_FLEET, DEMO_MAX_SERVERS, DEMO_MAX_ROWS
+from instrumentation import timed, response_serialize_seconds, ServerLabels, ReportAgeCollector
+from serialize import negotiate, encode, compress
+from config import (
+    SECRET_KEY, SESSION_LIFETIME, API_TOKEN, SITES_CONFIG, ENVIRONMENT, PORT, BATCH_MAX_REPORTS,
+    BATCH_MAX_BYTES, REPORT_MAX_FUTURE_SECONDS,
+    INGEST_MODE, INGEST_QUEUE_MAXSIZE, INGEST_FLUSH_BATCH_SIZE, INGEST_FLUSH_INTERVAL_MS,
+    HISTORY_MAX_POINTS, STREAM_POLL_INTERVAL_MS, STREAM_KEEPALIVE_SECONDS, STREAM_MAX_SECONDS,
+    STREAM_MAX_SUBSCRIBERS,
+    LOGIN_MAX_FAILURES, LOGIN_FAILURE_WINDOW_SECONDS, LOGIN_HASH_WORKERS, LOGIN_HASH_MAX_PENDING, TRUSTED_PROXIES,
+    DETAILED_METRICS, METRICS_MAX_SERIES, RESPONSE_COMPRESSION, RESPONSE_COMPRESS_MIN_BYTES
+)
 
 # Prometheus metrics
 from prometheus_flask_exporter import PrometheusMetrics
-from prometheus_client import Counter
+from prometheus_client import Counter, REGISTRY
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME
+if TRUSTED_PROXIES:
+    # request.remote_addr becomes the client's address instead of nginx's
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES,
+                            x_host=TRUSTED_PROXIES)
 
 # Initialize Prometheus metrics
 metrics = PrometheusMetrics(app)
@@ -22,6 +45,21 @@ agent_reports_counter = Counter(
     'Total number of agent disk usage reports received',
     ['site', 'sub_site', 'server_type']
 )
+# Label values come from agents, so they are checked against SITES_CONFIG
+report_labels = ServerLabels('loghive_agent_reports_total', SITES_CONFIG, METRICS_MAX_SERIES)
+
+
+def _report_times():
+    """Last report time of every server in both environments (scrape time)"""
+    for environment in ('production', 'test'):
+        for row in DiskUsage.get_report_times(environment):
+            yield (environment, *row)
+
+
+if DETAILED_METRICS:
+    REGISTRY.register(ReportAgeCollector(
+        _report_times, ServerLabels('loghive_series_last_report_age_seconds', SITES_CONFIG, METRICS_MAX_SERIES)
+    ))
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -29,28 +67,27 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = None  # Don't flash message on redirect
 
-# Track last data update time for smart polling
-last_report_time = datetime.now().isoformat()
-
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Get user environment from session
+    # In-memory lookup; ids are "environment:id" (see User.get_id)
+    env, sep, raw_id = user_id.partition(':')
+    if sep:
+        return User.get_by_id(raw_id, env)
+    # Sessions from before qualified ids: session environment first, then the other
     user_env = session.get('user_environment', 'production')
-    # Load user from the correct database
-    conn_env = user_env
-    for env in [conn_env, 'test' if conn_env == 'production' else 'production']:
-        from models import get_db_connection
-        conn = get_db_connection(env)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, username, environment FROM users WHERE id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            return User(row['id'], row['username'], row['environment'])
+    for env in [user_env, 'test' if user_env == 'production' else 'production']:
+        user = User.get_by_id(user_id, env)
+        if user:
+            return user
     return None
 
 
+# Failed logins per client IP and per username, and the password hash pool
+login_failures = TokenBucket(LOGIN_MAX_FAILURES, LOGIN_FAILURE_WINDOW_SECONDS)
+login_hash_pool = HashPool(workers=LOGIN_HASH_WORKERS, max_pending=LOGIN_HASH_MAX_PENDING)
+
+
 # ==================== Web Routes ====================
 
 @app.route('/')
@@ -70,15 +107,33 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username', '')
         password = request.form.get('password', '')
+        keys = [('ip', request.remote_addr), ('user', username)]
+        
+        # Checked before any hash is computed
+        if not all(login_failures.allowed(key) for key in keys):
+            login_attempts_counter.labels(result='rate_limited').inc()
+            flash('登入失敗次數過多，請稍後再試', 'error')
+            retry_after = max(login_failures.retry_after(key) for key in keys)
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
+        try:
+            user = login_hash_pool.run(User.verify_password, username, password)
+        except PoolBusy:
+            login_attempts_counter.labels(result='busy').inc()
+            flash('系統忙碌中，請稍後再試', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
         
-        user = User.verify_password(username, password)
         if user:
+            login_attempts_counter.labels(result='success').inc()
             # Store user environment in session
             session['user_environment'] = user.environment
             login_user(user, remember=True)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('index'))
         else:
+            login_attempts_counter.labels(result='failure').inc()
+            for key in keys:
+                login_failures.consume(key)
             flash('帳號或密碼錯誤', 'error')
     
     return render_template('login.html')
@@ -95,6 +150,76 @@ def logout():
 
 # ==================== API Routes ====================
 
+REPORT_FIELDS = ['site', 'sub_site', 'server_type', 'path', 'size_mb']
+
+
+def _validate_report(data):
+    """Validate one agent report. Returns (report, None) or (None, error message)"""
+    if not isinstance(data, dict):
+        return None, 'Invalid report'
+    for field in REPORT_FIELDS:
+        if field not in data:
+            return None, f'Missing field: {field}'
+    
+    try:
+        size_mb = float(data['size_mb'])
+    except (ValueError, TypeError):
+        return None, 'Invalid size_mb value'
+    
+    report = {
+        'site': data['site'],
+        'sub_site': data['sub_site'],
+        'server_type': data['server_type'],
+        'path': data['path'],
+        'size_mb': size_mb
+    }
+    
+    # Optional sample time (epoch seconds or ISO 8601), sent by agents that
+    # spooled reports during an outage. The same sample sent twice is stored once.
+    if data.get('recorded_at') is not None:
+        try:
+            recorded_at = to_epoch(data['recorded_at'])
+        except (ValueError, TypeError, AttributeError, OverflowError):
+            return None, 'Invalid recorded_at value'
+        if recorded_at > time.time() + REPORT_MAX_FUTURE_SECONDS:
+            return None, 'recorded_at is in the future'
+        report['recorded_at'] = recorded_at
+    
+    return report, None
+
+
+def _count_reports(reports):
+    """Increment the Prometheus counter for accepted reports"""
+    counts = {}
+    for report in reports:
+        key = (report['site'], report['sub_site'], report['server_type'])
+        counts[key] = counts.get(key, 0) + 1
+    for key, count in counts.items():
+        agent_reports_counter.labels(*report_labels(*key, count=count)).inc(count)
+
+
+def _write_reports(reports):
+    """Store a batch of validated reports (used by the write-behind queue)"""
+    DiskUsage.record_many(reports)
+
+
+# Write-behind queue, only used when INGEST_MODE == 'queue'
+ingest_queue = IngestQueue(
+    _write_reports,
+    maxsize=INGEST_QUEUE_MAXSIZE,
+    batch_size=INGEST_FLUSH_BATCH_SIZE,
+    interval_ms=INGEST_FLUSH_INTERVAL_MS
+)
+ingest_queue_depth.set_function(ingest_queue.qsize)
+
+
+def _queue_full_response(payload):
+    response = jsonify(payload)
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 @app.route('/api/report', methods=['POST'])
 def api_report():
     """
@@ -106,7 +231,8 @@ def api_report():
         "sub_site": "WMX",
         "server_type": "log_server",
         "path": "/data",
-        "size_mb": 1024.5
+        "size_mb": 1024.5,
+        "recorded_at": 1718000000    (optional, epoch seconds or ISO 8601)
     }
     """
     data = request.get_json()
@@ -115,44 +241,183 @@ def api_report():
     if not data or data.get('token') != API_TOKEN:
         return jsonify({'error': 'Invalid token'}), 401
     
-    # Validate required fields
-    required = ['site', 'sub_site', 'server_type', 'path', 'size_mb']
-    for field in required:
-        if field not in data:
-            return jsonify({'error': f'Missing field: {field}'}), 400
+    report, error = _validate_report(data)
+    if error:
+        return jsonify({'error': error}), 400
     
-    try:
-        size_mb = float(data['size_mb'])
-    except (ValueError, TypeError):
-        return jsonify({'error': 'Invalid size_mb value'}), 400
+    if INGEST_MODE == 'queue':
+        # Stamp receipt time so the flush delay does not shift the sample time
+        report.setdefault('received_at', int(time.time()))
+        if not ingest_queue.submit(report):
+            return _queue_full_response({'error': 'Ingest queue full, retry later'})
+        _count_reports([report])
+        return jsonify({'success': True, 'message': 'Data queued'}), 202
     
     # Record the data
-    DiskUsage.record(
-        site=data['site'],
-        sub_site=data['sub_site'],
-        server_type=data['server_type'],
-        path=data['path'],
-        size_mb=size_mb
-    )
+    if not DiskUsage.record(**report):
+        return jsonify({'success': True, 'message': 'Duplicate report ignored', 'duplicate': True})
+    _count_reports([report])
+    
+    return jsonify({'success': True, 'message': 'Data recorded'})
+
+
+def _batch_body():
+    """Raw batch body, decoded when sent with Content-Encoding: gzip.
+    Returns (bytes, None) or (None, (error message, status code))."""
+    data = request.get_data()
+    encoding = request.headers.get('Content-Encoding', '').lower()
+    if encoding in ('', 'identity'):
+        return data, None
+    if encoding != 'gzip':
+        return None, (f'Unsupported Content-Encoding: {encoding}', 415)
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decoder.decompress(data, BATCH_MAX_BYTES + 1)
+    except zlib.error:
+        return None, ('Invalid gzip body', 400)
+    if len(data) > BATCH_MAX_BYTES:
+        return None, (f'Body too large (max {BATCH_MAX_BYTES} bytes)', 413)
+    return data, None
+
+
+def _parse_batch_body(data):
+    """Parse a batch body. Returns (batch token, list of items); an item that is
+    not valid JSON (NDJSON lines only) is returned as an Exception instance."""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in data.decode('utf-8', 'replace').splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return None, items
     
-    # Increment Prometheus counter
-    agent_reports_counter.labels(
-        site=data['site'],
-        sub_site=data['sub_site'],
-        server_type=data['server_type']
-    ).inc()
+    try:
+        data = json.loads(data)
+    except ValueError:
+        return None, None
+    if isinstance(data, dict):
+        return data.get('token'), data.get('reports')
+    return None, data
+
+
+@app.route('/api/report/batch', methods=['POST'])
+def api_report_batch():
+    """
+    Receive many disk usage reports in one request (from one agent or a site relay)
+    Accepted bodies:
+    - JSON envelope: {"token": "api-token", "reports": [{...}, {...}]}
+    - JSON array of reports
+    - NDJSON (Content-Type: application/x-ndjson), one report per line
+    Any of them may be gzip-compressed (Content-Encoding: gzip).
+    The batch token comes from the envelope or the X-API-Token header; without
+    one, each report must carry its own "token" like a single /api/report.
+    Valid reports are stored in one transaction; results are returned per item.
+    Reports carrying recorded_at that were already stored count as duplicates,
+    so an agent may safely resend a batch it got no answer for.
+    """
+    body, error = _batch_body()
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    batch_token, items = _parse_batch_body(body)
+    batch_token = request.headers.get('X-API-Token', batch_token)
     
-    # Update last report time for smart polling
-    global last_report_time
-    last_report_time = datetime.now().isoformat()
+    if batch_token is not None and batch_token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No reports'}), 400
+    if len(items) > BATCH_MAX_REPORTS:
+        return jsonify({'error': f'Too many reports (max {BATCH_MAX_REPORTS})'}), 413
     
-    return jsonify({'success': True, 'message': 'Data recorded'})
+    results = []
+    accepted = []
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            report, error = None, 'Invalid JSON'
+        elif batch_token is None and (not isinstance(item, dict) or item.get('token') != API_TOKEN):
+            report, error = None, 'Invalid token'
+        else:
+            report, error = _validate_report(item)
+        
+        if error:
+            results.append({'index': index, 'success': False, 'error': error})
+        else:
+            results.append({'index': index, 'success': True})
+            accepted.append((index, report))
+    
+    reports = [report for _, report in accepted]
+    status = 200
+    duplicates = 0
+    if INGEST_MODE == 'queue' and reports:
+        received = int(time.time())
+        for report in reports:
+            report.setdefault('received_at', received)
+        # Backpressure: reports that do not fit in the queue are rejected
+        queued = ingest_queue.submit_many(reports)
+        for index, _ in accepted[queued:]:
+            results[index] = {'index': index, 'success': False, 'error': 'Ingest queue full'}
+        reports = reports[:queued]
+        _count_reports(reports)
+        status = 202
+    elif reports:
+        stored = []
+        duplicates = len(reports) - DiskUsage.record_many(reports, stored_reports=stored)
+        # Like /api/report, resent duplicates are not counted again
+        _count_reports(stored)
+    
+    payload = {
+        'success': bool(reports),
+        'accepted': len(reports),
+        'rejected': len(items) - len(reports),
+        'duplicates': duplicates,
+        'results': results
+    }
+    if not reports:
+        if accepted:
+            return _queue_full_response(payload)
+        return jsonify(payload), 400
+    return jsonify(payload), status
 
 
 @app.route('/api/last-update')
 def api_last_update():
-    """Get last data update timestamp for smart polling"""
-    return jsonify({'last_update': last_report_time})
+    """Get last data update timestamp and version for smart polling.
+    Read from the database so every worker gives the same answer.
+    """
+    user_env = current_user.environment if current_user.is_authenticated else 'production'
+    version, updated_at = DiskUsage.get_version(user_env)
+    return jsonify({
+        'last_update': datetime.fromtimestamp(updated_at, timezone.utc).isoformat() if updated_at else None,
+        'version': version
+    })
+
+
+change_feed = ChangeFeed(interval_ms=STREAM_POLL_INTERVAL_MS, max_subscribers=STREAM_MAX_SUBSCRIBERS)
+
+
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """Server-Sent Events: one 'update' event (summary entry) per changed server"""
+    user_env = current_user.environment if current_user.is_authenticated else 'production'
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    try:
+        q = change_feed.subscribe(user_env)
+    except StreamFull:
+        # EventSource gives up on a non-200 answer; the dashboard polls instead
+        return jsonify({'error': 'Too many open streams'}), 503, {'Retry-After': str(STREAM_MAX_SECONDS)}
+    response = Response(
+        event_stream(change_feed, user_env, last_event_id,
+                     keepalive=STREAM_KEEPALIVE_SECONDS, max_seconds=STREAM_MAX_SECONDS, q=q),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # The generator only unsubscribes once started; a client gone before that
+    # must not keep its slot
+    response.call_on_close(lambda: change_feed.unsubscribe(q))
+    return response
 
 
 @app.route('/api/sites')
@@ -162,38 +427,87 @@ def api_sites():
     return jsonify(SITES_CONFIG)
 
 
+def _encode_response(data, media_type, encoding):
+    """Serialized (and, above RESPONSE_COMPRESS_MIN_BYTES, compressed) body.
+    Returns (body, content coding or None)."""
+    body = encode(data, media_type)
+    if encoding and len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+        return compress(body, encoding), encoding
+    return body, None
+
+
+def _conditional_json(user_env, build, site='', sub_site='', server_type=''):
+    """JSON response validated by the data version of one server (or the whole
+    environment). Replies 304 without calling build() when the client's
+    If-None-Match / If-Modified-Since is still current.
+    Clients may ask for MessagePack (Accept: application/msgpack) and a
+    compressed body (Accept-Encoding: br / gzip); each variant has its own ETag.
+    """
+    version, updated_at = DiskUsage.get_version(user_env, site, sub_site, server_type)
+    media_type, encoding = negotiate(request.accept_mimetypes, request.accept_encodings,
+                                     RESPONSE_COMPRESSION)
+    # Month growth and day-relative ranges also change when the UTC date does
+    etag = f"{user_env}-{version}-{time.strftime('%Y%m%d', time.gmtime())}"
+    if media_type != 'application/json':
+        etag += '-msgpack'
+    if encoding:
+        etag += f'-{encoding}'
+    last_modified = datetime.fromtimestamp(updated_at, timezone.utc) if updated_at else None
+    
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        data = build()
+        body, encoding = timed(response_serialize_seconds, _encode_response, data, media_type, encoding)
+        response = app.response_class(body, mimetype=media_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    if last_modified:
+        response.last_modified = last_modified
+    # Per-user data: browsers may keep it but must revalidate every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _columnar_format():
+    """?format=columnar -> True, ?format=rows (default) -> False, else None"""
+    return {'rows': False, 'columnar': True}.get(request.args.get('format', 'rows'))
+
+
 @app.route('/api/summary')
 @login_required
 def api_summary():
-    """Get summary of all sites with latest data and growth"""
+    """Get summary of all sites with latest data and growth
+    (?format=columnar: one array per field, recorded_at as epoch seconds)"""
     user_env = current_user.environment if current_user.is_authenticated else 'production'
-    summary = DiskUsage.get_all_sites_summary(user_env)
-    
-    # Enrich with growth data and log download URL
-    for item in summary:
-        item['growth_30d'] = DiskUsage.get_30day_growth(
-            item['site'], item['sub_site'], item['server_type'], user_env
-        )
-        monthly = DiskUsage.get_monthly_growth(
-            item['site'], item['sub_site'], item['server_type'], user_env
-        )
-        if monthly:
-            avg_growth = sum(m['growth_mb'] for m in monthly) / len(monthly)
-            item['monthly_avg_growth'] = round(avg_growth, 2)
-        else:
-            item['monthly_avg_growth'] = 0
-    
-    return jsonify(summary)
+    columnar = _columnar_format()
+    if columnar is None:
+        return jsonify({'error': 'format must be rows or columnar'}), 400
+    return _conditional_json(user_env, lambda: DiskUsage.get_summary_with_growth(user_env, columnar=columnar))
 
 
 @app.route('/api/history/<site>/<sub_site>/<server_type>')
 @login_required
 def api_history(site, sub_site, server_type):
-    """Get disk usage history for a specific server"""
+    """Get disk usage history for a specific server
+    (?format=columnar: {"recorded_at": [epoch, ...], "size_mb": [...]})"""
     user_env = current_user.environment if current_user.is_authenticated else 'production'
     days = request.args.get('days', 30, type=int)
-    history = DiskUsage.get_history(site, sub_site, server_type, days, user_env)
-    return jsonify(history)
+    points = request.args.get('points', type=int)
+    if points is not None:
+        points = max(3, min(points, HISTORY_MAX_POINTS))
+    columnar = _columnar_format()
+    if columnar is None:
+        return jsonify({'error': 'format must be rows or columnar'}), 400
+    return _conditional_json(
+        user_env,
+        lambda: DiskUsage.get_history(site, sub_site, server_type, days, user_env, points=points,
+                                      columnar=columnar),
+        site, sub_site, server_type
+    )
 
 
 @app.route('/api/monthly/<site>/<sub_site>/<server_type>')
@@ -201,8 +515,11 @@ def api_history(site, sub_site, server_type):
 def api_monthly(site, sub_site, server_type):
     """Get monthly growth statistics"""
     user_env = current_user.environment if current_user.is_authenticated else 'production'
-    data = DiskUsage.get_monthly_growth(site, sub_site, server_type, user_env)
-    return jsonify(data)
+    return _conditional_json(
+        user_env,
+        lambda: DiskUsage.get_monthly_growth(site, sub_site, server_type, user_env),
+        site, sub_site, server_type
+    )
 
 
 @app.route('/api/month-production/<site>/<sub_site>/<server_type>')
@@ -210,8 +527,11 @@ def api_monthly(site, sub_site, server_type):
 def api_month_production(site, sub_site, server_type):
     """Get current and previous month production"""
     user_env = current_user.environment if current_user.is_authenticated else 'production'
-    data = DiskUsage.get_current_and_previous_month_growth(site, sub_site, server_type, user_env)
-    return jsonify(data)
+    return _conditional_json(
+        user_env,
+        lambda: DiskUsage.get_current_and_previous_month_growth(site, sub_site, server_type, user_env),
+        site, sub_site, server_type
+    )
 
 
 # ==================== Demo Data Route (for testing) ====================
@@ -229,65 +549,27 @@ def api_demo_seed():
             'message': 'Demo data seeding is only available for test accounts'
         }), 403
     
-    import random
-    from datetime import datetime, timedelta
-    
-    # First, clear existing demo data
-    from models import get_db_connection
-    conn = get_db_connection(user_env)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM disk_usage')
-    conn.commit()
-    conn.close()
-    
-    # Define servers with varying data density for Dynamic Rendering testing
-    # Most servers have 60 days (dense), some have fewer days (sparse) to show data points
-    sites = [
-        ('Site_A', 'SubSite_1', 'log_server', 60),
-        ('Site_A', 'SubSite_1', 'backup_server', 60),
-        ('Site_A', 'SubSite_2', 'log_server', 60),
-        ('Site_A', 'SubSite_2', 'backup_server', 10),     # Sparse: 10 days
-        ('Site_A', 'SubSite_4', 'log_server', 60),
-        ('Site_A', 'SubSite_4', 'backup_server', 7),      # Sparse: 7 days
-        ('Site_A', 'SubSite_6', 'log_server', 60),
-        ('Site_A', 'SubSite_6', 'backup_server', 60),
-        ('Site_B', 'SubSite_3', 'log_server', 60),
-        ('Site_B', 'SubSite_3', 'backup_log_server', 15), # Sparse: 15 days
-        ('Site_B', 'SubSite_5', 'log_server', 60),
-        ('Site_B', 'SubSite_5', 'backup_log_server', 60),
-        ('Site_B', 'SubSite_6', 'log_server', 60),
-        ('Site_B', 'SubSite_6', 'backup_log_server', 60),
-        ('Site_B', 'SubSite_Lab', 'log_server', 5),       # Sparse: 5 days
-        ('Site_B', 'SubSite_Lab', 'backup_log_server', 60),
-        ('Site_B', 'SubSite_4', 'log_server', 60),
-        ('Site_B', 'SubSite_4', 'backup_log_server', 20), # Sparse: 20 days
-    ]
-    
-    now = datetime.now()
-    
-    # Generate data with per-server day counts for Dynamic Rendering testing
-    for site, sub_site, server_type, num_days in sites:
-        base_size = random.randint(500, 2000)  # Starting size in MB
-        for day in range(num_days, -1, -1):
-            # Add some random growth each day (0-50 MB)
-            base_size += random.randint(0, 50)
-            record_time = now - timedelta(days=day)
-            
-            # Insert with specific timestamp
-            conn = get_db_connection(user_env)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO disk_usage (site, sub_site, server_type, path, size_mb, recorded_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (site, sub_site, server_type, '/data', base_size, record_time.isoformat()))
-            conn.commit()
-            conn.close()
+    # Optional ?servers=&days=&interval= (seconds) for larger demo fleets
+    servers = request.args.get('servers', len(DEMO_FLEET), type=int)
+    days = request.args.get('days', 60, type=int)
+    interval = request.args.get('interval', 86400, type=int)
+    if not (1 <= servers <= DEMO_MAX_SERVERS and 1 <= days <= 366 and 60 <= interval <= 86400):
+        return jsonify({
+            'success': False,
+            'error': f'servers 1-{DEMO_MAX_SERVERS}, days 1-366, interval 60-86400'
+        }), 400
+    if demo_row_count(servers, days, interval) > DEMO_MAX_ROWS:
+        return jsonify({
+            'success': False,
+            'error': f'At most {DEMO_MAX_ROWS} demo rows (servers × days × 86400 / interval); '
+                     'use tools/bulk_load.py for larger loads'
+        }), 400
     
-    # Update last report time so the auto-update indicator shows "剛剛更新"
-    global last_report_time
-    last_report_time = datetime.now().isoformat()
+    # Replaces the existing data in one transaction; the rollup rebuild also
+    # bumps the data version, so the auto-update indicator shows "剛剛更新"
+    rows = bulk_load(demo_rows(servers, days, interval), user_env, replace=True)
     
-    return jsonify({'success': True, 'message': 'Demo data seeded'})
+    return jsonify({'success': True, 'message': 'Demo data seeded', 'rows': rows})
 
 
 
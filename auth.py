@@ -0,0 +1,92 @@
+# Login throttling for LogHive: failed-attempt rate limits and a bounded hash pool
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from prometheus_client import Counter
+
+login_attempts_counter = Counter(
+    'loghive_login_attempts_total',
+    'Login attempts by outcome',
+    ['result']  # success, failure, rate_limited, busy
+)
+
+
+class TokenBucket:
+    """In-memory token buckets, one per key (IP address, username, ...).
+
+    Each bucket holds up to `capacity` tokens and regains capacity tokens
+    every `period` seconds. Callers check allowed() before doing work and
+    consume() only for failures, so successful logins are never limited.
+    """
+
+    def __init__(self, capacity, period, max_keys=10000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, last update)
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def allowed(self, key):
+        with self._lock:
+            return self._tokens(key, time.monotonic()) >= 1
+
+    def consume(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (max(self._tokens(key, now) - 1, 0), now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+
+    def retry_after(self, key):
+        """Seconds until key has a token again"""
+        with self._lock:
+            missing = 1 - self._tokens(key, time.monotonic())
+        return max(0, int(missing / self.rate) + 1) if missing > 0 else 0
+
+    def _prune(self, now):
+        # Refilled buckets carry no state; drop them first, then the oldest
+        for key in [k for k in self._buckets if self._tokens(k, now) >= self.capacity]:
+            del self._buckets[key]
+        if len(self._buckets) > self.max_keys:
+            oldest = sorted(self._buckets, key=lambda k: self._buckets[k][1])
+            for key in oldest[:len(self._buckets) - self.max_keys]:
+                del self._buckets[key]
+
+
+class PoolBusy(Exception):
+    """Raised when the hash pool already has max_pending verifications"""
+
+
+class HashPool:
+    """Runs password hash checks on a few dedicated threads.
+
+    At most `workers` hashes are computed at once and at most `max_pending`
+    hashes may be queued or running; beyond that run() raises PoolBusy right
+    away, so a login burst cannot tie up every worker thread on CPU-bound
+    hashing. A hash that timed out keeps its slot until it has finished.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=10):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()  # only succeeds while still queued
+            raise PoolBusy()
@@ -0,0 +1 @@
+# LogHive benchmarks - run from the project root, e.g. `python -m benchmarks.bench_summary`
@@ -0,0 +1,138 @@
+"""
+Benchmark the Python agent's incremental folder size against `du -sk`.
+
+A synthetic tree is filled by running agent/file_generator.sh (with no
+pause between files) in every leaf directory for --fill-seconds, then aged
+by two days. Measured:
+
+  du -sk              what disk_agent.sh runs every time
+  agent full scan     first run, empty cache
+  agent unchanged     incremental run, nothing changed (files still stat'ed)
+  agent changed       after file_generator.sh added files to --changed directories
+  agent --watch       inotify-driven run after appending to an old file (no stat
+                      of unchanged directories)
+
+Every agent result is checked against du. The page cache is warm for all
+runs, so the gap is smaller than on a cold production tree.
+
+    python -m benchmarks.bench_agent --dirs 200 --fill-seconds 5
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'agent'))
+import disk_agent  # noqa: E402
+
+GENERATOR = os.path.join(os.path.dirname(__file__), '..', 'agent', 'file_generator.sh')
+
+
+def run_generators(directories, seconds, max_kb, jobs):
+    """Run file_generator.sh in each directory for `seconds`, `jobs` at a time"""
+    env = dict(os.environ, FILE_GEN_INTERVAL='0', MIN_FILE_KB='1', MAX_FILE_KB=str(max_kb),
+               MAX_SIZE_MB='1000000')
+    for i in range(0, len(directories), jobs):
+        procs = [subprocess.Popen(['bash', GENERATOR], env=dict(env, DATA_DIR=d),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for d in directories[i:i + jobs]]
+        time.sleep(seconds)
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+def age_tree(root, seconds):
+    past = time.time() - seconds
+    for path, dirs, files in os.walk(root):
+        for name in files:
+            os.utime(os.path.join(path, name), (past, past))
+        os.utime(path, (past, past))
+
+
+def du_kb(root):
+    return int(subprocess.check_output(['du', '-sk', root]).split()[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dirs', type=int, default=200, help='leaf directories (20 per parent)')
+    parser.add_argument('--fill-seconds', type=float, default=5, help='generator run time per batch of leaves')
+    parser.add_argument('--jobs', type=int, default=50, help='generators running at once')
+    parser.add_argument('--max-kb', type=int, default=16, help='MAX_FILE_KB for the generator')
+    parser.add_argument('--changed', type=int, default=3, help='directories changed before the last run')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='loghive-agent-bench-')
+    cache = os.path.join(root + '-cache', 'sizes.json')
+    try:
+        leaves = [os.path.join(root, f'app_{i // 20}', f'logs_{i}') for i in range(args.dirs)]
+        for leaf in leaves:
+            os.makedirs(leaf)
+        print(f"Filling {args.dirs} directories with file_generator.sh...")
+        run_generators(leaves, args.fill_seconds, args.max_kb, args.jobs)
+        age_tree(root, 2 * 86400)
+        files = sum(len(names) for _, _, names in os.walk(root))
+        print(f"{files} files, {du_kb(root)} KB\n")
+
+        results = []
+
+        def agent_run(sizer):
+            results.append(sizer.size_kb())
+            sizer.save()
+            return sizer.stats
+
+        def report(name, ms, stats=''):
+            expected = du_kb(root)
+            assert set(results) == {expected}, (name, results, expected)
+            results.clear()
+            print(f"{name:<28} {ms:9.1f} ms  {stats}".rstrip())
+
+        print(f"{'du -sk':<28} {timeit(lambda: du_kb(root)):9.1f} ms")
+
+        def full():
+            if os.path.exists(cache):
+                os.remove(cache)
+            return agent_run(disk_agent.DirSizer(root, cache, full_every=0))
+        report('agent full scan', timeit(full))
+
+        def incremental():
+            sizer = disk_agent.DirSizer(root, cache, full_every=0)
+            sizer.load()
+            incremental.stats = agent_run(sizer)
+        report('agent unchanged', timeit(incremental), incremental.stats)
+
+        run_generators(leaves[:args.changed], 1, args.max_kb, args.jobs)
+        time.sleep(disk_agent.RACY_NS / 10 ** 9)
+        report('agent changed', timeit(incremental, repeat=1), incremental.stats)
+
+        # --watch: an in-place write to an old file only shows up through inotify
+        sizer = disk_agent.DirSizer(root, None, stat_files=False, full_every=0)
+        inotify = disk_agent.Inotify()
+        sizer.before_read = inotify.watch
+        sizer.size_kb()
+        time.sleep(disk_agent.RACY_NS / 10 ** 9)
+        sizer.size_kb()
+        results.clear()
+        with open(os.path.join(leaves[-1], sorted(os.listdir(leaves[-1]))[0]), 'ab') as f:
+            f.write(os.urandom(8192))
+
+        def watched():
+            for path in inotify.read(0):
+                sizer.invalidate(path)
+            watched.stats = agent_run(sizer)
+        report('agent --watch, old file', timeit(watched, repeat=1), watched.stats)
+        inotify.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(root + '-cache', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Measure deadband storage: stored rows, database size and query results with
+every report stored as its own row versus unchanged reports collapsed into runs.
+
+The synthetic fleet reports at --interval (the agents' default is hourly):
+
+  log      grows during working hours, unchanged at night and on weekends
+  backup   one nightly backup, a weekly prune, unchanged in between
+  archive  unchanged for weeks, a monthly move-in
+
+Every report goes through DiskUsage.record_many in per-interval batches, as
+the ingest queue delivers them. History, growth and summary results of both
+runs are compared; with the default tolerance of 0 they must be identical
+apart from the reports inside unchanged runs (and a run crossing the start
+of the history window begins at the window start).
+
+    python -m benchmarks.bench_deadband --servers 90 --days 90
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks.common import temp_database, timeit
+import models
+from models import DiskUsage
+
+KINDS = ('log', 'backup', 'archive')
+
+
+def fleet_reports(servers, days, interval, seed=42, now=None):
+    """Yield one list of report dicts per interval, oldest first"""
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    start = (now - int(days * 86400)) // interval * interval
+    fleet = [(f'Site_{KINDS[i % 3]}', f'SubSite_{i // 30}', f'{KINDS[i % 3]}_{i}') for i in range(servers)]
+    sizes = [rng.uniform(500, 5000) for _ in fleet]
+    for ts in range(start, now + 1, interval):
+        t = time.gmtime(ts)
+        batch = []
+        for i, (site, sub_site, server_type) in enumerate(fleet):
+            kind = KINDS[i % 3]
+            if kind == 'log':
+                if t.tm_wday < 5 and 8 <= t.tm_hour < 20:
+                    sizes[i] += rng.uniform(0, 20) * interval / 3600
+                if t.tm_hour == 3 and rng.random() < 0.02:
+                    sizes[i] *= 0.5  # log rotation cleanup
+            elif kind == 'backup':
+                if t.tm_hour == 2 and t.tm_min < interval // 60:
+                    sizes[i] += rng.uniform(100, 400)
+                    if t.tm_wday == 6:
+                        sizes[i] *= 0.7
+            elif t.tm_mday == 1 and t.tm_hour == 0 and t.tm_min < interval // 60:
+                sizes[i] += rng.uniform(1000, 3000)
+            batch.append({'site': site, 'sub_site': sub_site, 'server_type': server_type,
+                          'path': '/data', 'size_mb': round(sizes[i], 2), 'recorded_at': ts})
+        yield batch
+
+
+def collapse(history):
+    """The points deadband storage keeps of a full history (tolerance 0):
+    first and last sample of every unchanged run within a UTC day"""
+    kept = []
+    for i, point in enumerate(history):
+        day = models.to_epoch(point['recorded_at']) // 86400
+        prev = history[i - 1] if i else None
+        nxt = history[i + 1] if i + 1 < len(history) else None
+        same = lambda other: (other is not None and other['size_mb'] == point['size_mb']
+                              and models.to_epoch(other['recorded_at']) // 86400 == day)
+        if not (same(prev) and same(nxt)):
+            kept.append(point)
+    return kept
+
+
+def run(args, deadband):
+    models.DEADBAND_ENABLED = deadband
+    models.DEADBAND_MB = args.tolerance_mb
+    models._newest_rows.clear()
+    with temp_database() as db_path:
+        start = time.perf_counter()
+        reports = 0
+        for batch in fleet_reports(args.servers, args.days, args.interval):
+            DiskUsage.record_many(batch)
+            reports += len(batch)
+        ingest_s = time.perf_counter() - start
+        conn = models.get_db_connection()
+        rows = conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+        conn.execute('VACUUM')
+        conn.close()
+        servers = [(item['site'], item['sub_site'], item['server_type'])
+                   for item in DiskUsage.get_all_sites_summary()]
+        results = {
+            'summary': DiskUsage.get_summary_with_growth(),
+            'monthly': {s: DiskUsage.get_monthly_growth(*s) for s in servers},
+            'history': {s: DiskUsage.get_history(*s, days=args.days - 1) for s in servers},
+        }
+        history_ms = timeit(lambda: [DiskUsage.get_history(*s, days=30, columnar=True) for s in servers])
+        return {
+            'reports': reports, 'rows': rows, 'bytes': os.path.getsize(db_path),
+            'ingest_s': ingest_s, 'history_ms': history_ms, 'results': results,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', type=int, default=90, help='servers (a third of each kind)')
+    parser.add_argument('--days', type=float, default=90, help='days of history')
+    parser.add_argument('--interval', type=int, default=3600, help='seconds between reports')
+    parser.add_argument('--tolerance-mb', type=float, default=0, help='DEADBAND_MB')
+    args = parser.parse_args()
+
+    plain, runs = run(args, False), run(args, True)
+    print(f"{args.servers} servers, {args.days:g} days, one report every {args.interval}s: "
+          f"{plain['reports']} reports\n")
+    print(f"{'':<16} {'rows':>10} {'db KB':>10} {'ingest s':>9} {'30d history ms':>15}")
+    for name, r in (('every report', plain), ('deadband', runs)):
+        print(f"{name:<16} {r['rows']:>10} {r['bytes'] // 1024:>10} {r['ingest_s']:>9.2f} {r['history_ms']:>15.1f}")
+    print(f"\nrows x {runs['rows'] / plain['rows']:.3f}, database size x {runs['bytes'] / plain['bytes']:.3f}")
+
+    p, d = plain['results'], runs['results']
+    for key in ('summary', 'monthly'):
+        print(f"{key:<12} {'identical' if p[key] == d[key] else 'DIFFERENT'}")
+    if args.tolerance_mb == 0:
+        same = all(d['history'][s][1:] == collapse(h)[1:] and d['history'][s][0]['size_mb'] == h[0]['size_mb']
+                   for s, h in p['history'].items())
+        print(f"{'history':<12} {'identical (without run interiors)' if same else 'DIFFERENT'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark monthly growth over column arrays: per-server dicts of lists fed to
+DiskUsage._calc_positive_growth's loop, versus growth.segment_stats with the
+array fallback and with NumPy (when installed).
+
+Pure computation, no database.
+
+    python -m benchmarks.bench_growth --samples 1000000 --servers 1000
+"""
+import argparse
+import random
+from unittest import mock
+
+from benchmarks.common import timeit
+import growth
+
+
+def make_columns(samples, servers, seed=42):
+    """Sorted (series, timestamp, size) columns spread over a year per server."""
+    rng = random.Random(seed)
+    per_server = samples // servers
+    step = 365 * 86400 // per_server
+    series, timestamps, sizes = [], [], []
+    for server in range(servers):
+        size = rng.uniform(500, 2000)
+        for i in range(per_server):
+            size = size * 0.6 if rng.random() < 0.01 else size + rng.uniform(0, 5)
+            series.append(server)
+            timestamps.append(1735689600 + i * step)
+            sizes.append(round(size, 2))
+    return series, timestamps, sizes
+
+
+def loop_growth(series, months, sizes):
+    """The old shape: group into lists per server and month, then loop each."""
+    groups = {}
+    for key, size in zip(zip(series, months), sizes):
+        groups.setdefault(key, []).append(size)
+    result = []
+    for points in groups.values():
+        growth_mb = 0
+        for i in range(1, len(points)):
+            diff = points[i] - points[i - 1]
+            if diff > 0:
+                growth_mb += diff
+        result.append((round(growth_mb, 2), max(points), points[-1]))
+    return result
+
+
+def engine_growth(series, months, timestamps, sizes):
+    stats = growth.segment_stats(series, months, timestamps, sizes)
+    return [(round(g, 2), m, last) for g, m, last in zip(stats.growth_mb, stats.max_mb, stats.last_mb)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=1000000)
+    parser.add_argument('--servers', type=int, default=1000)
+    args = parser.parse_args()
+
+    series, timestamps, sizes = make_columns(args.samples, args.servers)
+    months = growth.month_starts(timestamps)
+    print(f'{len(sizes)} samples, {args.servers} servers, {len(set(zip(series, months)))} server-months')
+
+    expected = loop_growth(series, months, sizes)
+    print(f'{"dict + loop":>14}: {timeit(lambda: loop_growth(series, months, sizes)):>8.1f} ms')
+
+    with mock.patch.object(growth, 'HAVE_NUMPY', False):
+        assert engine_growth(series, months, timestamps, sizes) == expected
+        ms = timeit(lambda: engine_growth(series, months, timestamps, sizes))
+    print(f'{"array":>14}: {ms:>8.1f} ms')
+
+    if growth.HAVE_NUMPY:
+        import numpy as np
+        columns = [np.asarray(c) for c in (series, months, timestamps, sizes)]
+        assert engine_growth(*columns) == expected
+        ms = timeit(lambda: engine_growth(*columns))
+        print(f'{"numpy":>14}: {ms:>8.1f} ms')
+    else:
+        print(f'{"numpy":>14}: not installed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark login throughput under concurrent agent ingest, with password hashing
+inline in the request thread versus on the bounded login hash pool.
+
+Runs in-process on a temporary database; every thread uses its own test client.
+
+    python -m benchmarks.bench_login --seconds 5 --login-threads 8 --ingest-threads 4
+"""
+import argparse
+import threading
+import time
+from unittest import mock
+
+from benchmarks.common import temp_database, fleet
+
+
+def hammer(app, seconds, login_threads, ingest_threads, username, password, token):
+    """Run logins and agent reports side by side; return (logins/s, reports/s, statuses)."""
+    servers = list(fleet(50))
+    stop = threading.Event()
+    counts = {'login': 0, 'report': 0}
+    statuses = {}
+    lock = threading.Lock()
+
+    def count(kind, status):
+        with lock:
+            counts[kind] += 1
+            statuses[(kind, status)] = statuses.get((kind, status), 0) + 1
+
+    def login_worker():
+        while not stop.is_set():
+            client = app.test_client()  # fresh session every attempt
+            res = client.post('/login', data={'username': username, 'password': password})
+            count('login', res.status_code)
+
+    def ingest_worker(offset):
+        client = app.test_client()
+        i = offset
+        while not stop.is_set():
+            site, sub_site, server_type = servers[i % len(servers)]
+            res = client.post('/api/report', json={
+                'token': token, 'site': site, 'sub_site': sub_site, 'server_type': server_type,
+                'path': '/data', 'size_mb': 1000 + i
+            })
+            count('report', res.status_code)
+            i += ingest_threads
+
+    threads = [threading.Thread(target=login_worker) for _ in range(login_threads)]
+    threads += [threading.Thread(target=ingest_worker, args=(n,)) for n in range(ingest_threads)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return counts['login'] / seconds, counts['report'] / seconds, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--ingest-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with temp_database():
+        import app as flask_app
+        import models
+        from config import API_TOKEN, USERS_CONFIG
+
+        models.user_registry.refresh()
+        user = next(iter(USERS_CONFIG.values()))
+        run = lambda: hammer(flask_app.app, args.seconds, args.login_threads, args.ingest_threads,
+                             user['username'], user['password'], API_TOKEN)
+
+        _, baseline, _ = hammer(flask_app.app, args.seconds, 0, args.ingest_threads, '', '', API_TOKEN)
+        print(f'{"ingest only":>14}: {"":>12}  {baseline:>9.0f} reports/s')
+
+        inline = lambda fn, *a: fn(*a)
+        with mock.patch.object(flask_app.login_hash_pool, 'run', side_effect=inline):
+            logins, reports, _ = run()
+        print(f'{"inline hashing":>14}: {logins:>6.1f} logins/s  {reports:>9.0f} reports/s')
+
+        logins, reports, statuses = run()
+        busy = statuses.get(('login', 503), 0)
+        print(f'{"hash pool":>14}: {logins:>6.1f} logins/s  {reports:>9.0f} reports/s'
+              f'  ({busy} logins shed with 503)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark /api/summary computation: the old per-server enrichment (2N+1 queries)
+versus DiskUsage.get_summary_with_growth (one streaming scan).
+
+Usage: python -m benchmarks.bench_summary [--servers 10,100,300] [--days 30,365] [--per-day 4]
+"""
+import argparse
+
+from benchmarks.common import temp_database, populate, timeit
+import models
+from models import DiskUsage
+
+
+def per_server_summary(environment='production'):
+    """The pre-single-pass implementation of /api/summary."""
+    summary = DiskUsage.get_all_sites_summary(environment)
+    for item in summary:
+        key = (item['site'], item['sub_site'], item['server_type'])
+        item['growth_30d'] = DiskUsage.get_30day_growth(*key, environment)
+        monthly = DiskUsage.get_monthly_growth(*key, environment)
+        if monthly:
+            item['monthly_avg_growth'] = round(sum(m['growth_mb'] for m in monthly) / len(monthly), 2)
+        else:
+            item['monthly_avg_growth'] = 0
+    return summary
+
+
+def uncached(fn):
+    """fn with the query cache emptied first, so every call computes"""
+    def call():
+        models._query_cache.clear()
+        return fn()
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', default='10,100,300')
+    parser.add_argument('--days', default='30,365')
+    parser.add_argument('--per-day', type=int, default=4, help='samples per server per day')
+    args = parser.parse_args()
+
+    print(f"{'servers':>8} {'days':>6} {'rows':>10} {'per-server ms':>14} {'single-pass ms':>15} {'speedup':>8}")
+    for days in [int(d) for d in args.days.split(',')]:
+        for servers in [int(s) for s in args.servers.split(',')]:
+            with temp_database():
+                populate(servers, days, args.per_day)
+                assert uncached(DiskUsage.get_summary_with_growth)() == uncached(per_server_summary)()
+                old_ms = timeit(uncached(per_server_summary))
+                new_ms = timeit(uncached(DiskUsage.get_summary_with_growth))
+                rows = servers * (days * args.per_day + 1)
+                print(f"{servers:>8} {days:>6} {rows:>10} {old_ms:>14.1f} {new_ms:>15.1f} {old_ms / new_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
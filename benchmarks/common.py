@@ -0,0 +1,75 @@
+"""
+Shared helpers for LogHive benchmarks.
+Every benchmark runs against a throwaway SQLite file, never the real databases.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Allow running as `python -m benchmarks.<name>` from the project root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import models
+from bulkload import bulk_load
+
+
+@contextmanager
+def temp_database():
+    """Point models at a fresh temporary database for both environments."""
+    tmp_dir = tempfile.mkdtemp(prefix='loghive-bench-')
+    db_path = os.path.join(tmp_dir, 'bench.db')
+    original = models.get_database_path
+    models.get_database_path = lambda environment='production': db_path
+    try:
+        models.init_db()
+        yield db_path
+    finally:
+        models.close_db_connections()
+        models.get_database_path = original
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def fleet(servers):
+    """Yield (site, sub_site, server_type) tuples for a synthetic fleet."""
+    for i in range(servers):
+        yield (f'Site_{i // 100}', f'SubSite_{(i // 2) % 50}', f'server_{i}')
+
+
+def generate_samples(servers, days, interval, seed=42, now=None):
+    """Yield (site, sub_site, server_type, ts, size_mb) for a synthetic fleet,
+    server by server in time order: one sample every `interval` seconds over
+    the last `days` days, mostly growing with an occasional cleanup."""
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    start = now - int(days * 86400)
+    for site, sub_site, server_type in fleet(servers):
+        size = rng.uniform(500, 2000)
+        ts = start
+        while ts <= now:
+            size = size * 0.6 if rng.random() < 0.01 else size + rng.uniform(0, 5)
+            yield site, sub_site, server_type, int(ts), round(size, 2)
+            ts += interval
+
+
+def populate(servers, days, samples_per_day=24, environment='production', seed=42, interval=None):
+    """Bulk load a synthetic history for every server and derive the
+    rollups. Returns the row count."""
+    interval = interval or 86400 / samples_per_day
+    rows = ((site, sub_site, server_type, '/data', ts, size_mb)
+            for site, sub_site, server_type, ts, size_mb in generate_samples(servers, days, interval, seed))
+    return bulk_load(rows, environment)
+
+
+def timeit(fn, repeat=3):
+    """Return the best wall-clock time of `repeat` calls, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
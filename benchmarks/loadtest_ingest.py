@@ -0,0 +1,108 @@
+"""
+Load test agent ingest: reports/sec through /api/report (one report per request)
+versus /api/report/batch (many reports per request).
+
+By default the app runs in-process through the Flask test client on a temporary
+database. Pass --url to hit a running server instead (e.g. under gunicorn):
+
+    python -m benchmarks.loadtest_ingest --reports 2000 --threads 8 --batch-size 100
+    python -m benchmarks.loadtest_ingest --url http://localhost:5100 --token $API_TOKEN
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+from benchmarks.common import temp_database, fleet
+
+
+def make_reports(count, token):
+    servers = list(fleet(max(1, count // 10)))
+    reports = []
+    for i in range(count):
+        site, sub_site, server_type = servers[i % len(servers)]
+        reports.append({
+            'token': token,
+            'site': site, 'sub_site': sub_site, 'server_type': server_type,
+            'path': '/data', 'size_mb': 1000 + i * 0.5
+        })
+    return reports
+
+
+def make_poster(url):
+    """Return post(path, payload) -> status for a live server or the test client."""
+    if url:
+        def post(path, payload):
+            req = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(req) as res:
+                return res.status
+        return post
+
+    import app as flask_app
+    client = flask_app.app.test_client()
+    lock = threading.Lock()  # the test client is not thread-safe
+
+    def post(path, payload):
+        with lock:
+            return client.post(path, json=payload).status_code
+    return post
+
+
+def run(post, requests, threads):
+    """Send (path, payload) requests from `threads` workers; return elapsed seconds."""
+    pending = list(requests)
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                path, payload = pending.pop()
+            status = post(path, payload)
+            if status != 200:
+                errors.append(status)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    if errors:
+        print(f'  {len(errors)} failed requests (statuses: {sorted(set(errors))})')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running LogHive server')
+    parser.add_argument('--token', help='API token (defaults to config.API_TOKEN)')
+    parser.add_argument('--reports', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    def bench(post, token):
+        reports = make_reports(args.reports, token)
+        single = [('/api/report', r) for r in reports]
+        batches = [('/api/report/batch', {'token': token, 'reports': reports[i:i + args.batch_size]})
+                   for i in range(0, len(reports), args.batch_size)]
+        for name, requests in (('single', single), (f'batch x{args.batch_size}', batches)):
+            elapsed = run(post, requests, args.threads)
+            print(f'{name:>12}: {len(requests):>6} requests  {args.reports / elapsed:>10.0f} reports/sec')
+
+    if args.url:
+        from config import API_TOKEN
+        bench(make_poster(args.url), args.token or API_TOKEN)
+    else:
+        with temp_database():
+            from config import API_TOKEN
+            bench(make_poster(None), API_TOKEN)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Benchmark suite: every DiskUsage method and /api/* route at several fleet sizes.
+
+For each scale (servers x days of history at one sample per --interval
+seconds) a temporary database is filled with synthetic data, then every case
+is run --repeat times and reported with:
+
+  p50_ms / p95_ms  latency (query cache cleared before every call)
+  vm_steps         SQLite VM instructions for one call, a proxy for rows
+                   scanned (Python's sqlite3 does not expose scan counters)
+  peak_kb          peak Python allocations for one call (tracemalloc; SQLite's
+                   own page cache is not included)
+
+Results are written as JSON; --compare prints the change against an earlier file.
+
+    python -m benchmarks.suite --servers 10,100,1000 --days 1,30 --interval 60 --output bench.json
+    python -m benchmarks.suite --servers 10,100 --days 1,7 --compare bench.json
+"""
+import argparse
+import json
+import platform
+import resource
+import sqlite3
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.common import temp_database, populate, fleet
+import growth
+import models
+from models import DiskUsage
+
+VM_STEP_GRANULARITY = 10
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn, repeat, environment='production'):
+    """Latency percentiles, VM steps and peak Python memory of fn()"""
+    latencies = []
+    for _ in range(repeat):
+        models._query_cache.clear()
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    conn = models.get_db_connection(environment)
+    steps = [0]
+
+    def count():
+        steps[0] += VM_STEP_GRANULARITY
+        return 0
+    conn.set_progress_handler(count, VM_STEP_GRANULARITY)
+    models._query_cache.clear()
+    try:
+        fn()
+    finally:
+        conn.set_progress_handler(None, 0)
+        conn.close()
+
+    models._query_cache.clear()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'calls': repeat,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'vm_steps': steps[0],
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def model_cases(server):
+    # Writes use strictly increasing timestamps after the generated history: a
+    # sample at or before its bucket's last one takes the slower out-of-order path
+    counter = iter(range(1, 10 ** 9))
+    now = int(time.time())
+
+    def report(i):
+        site, sub_site, server_type = server
+        return {'site': site, 'sub_site': sub_site, 'server_type': server_type, 'path': '/data',
+                'size_mb': 10000 + i, 'recorded_at': now + i}
+
+    return [
+        ('record', lambda: DiskUsage.record(**report(next(counter)))),
+        ('record_many[100]', lambda: DiskUsage.record_many([report(next(counter)) for _ in range(100)])),
+        ('get_version', lambda: DiskUsage.get_version()),
+        ('get_latest', lambda: DiskUsage.get_latest(*server)),
+        ('get_history[30d]', lambda: DiskUsage.get_history(*server, days=30)),
+        ('get_history[30d,500pts]', lambda: DiskUsage.get_history(*server, days=30, points=500)),
+        ('get_history[30d,columnar]', lambda: DiskUsage.get_history(*server, days=30, columnar=True)),
+        ('get_monthly_growth', lambda: DiskUsage.get_monthly_growth(*server)),
+        ('get_current_and_previous_month_growth', lambda: DiskUsage.get_current_and_previous_month_growth(*server)),
+        ('get_30day_growth', lambda: DiskUsage.get_30day_growth(*server)),
+        ('get_summary_with_growth', lambda: DiskUsage.get_summary_with_growth()),
+        ('get_summary_with_growth[columnar]', lambda: DiskUsage.get_summary_with_growth(columnar=True)),
+        ('get_all_sites_summary', lambda: DiskUsage.get_all_sites_summary()),
+        ('get_changes_since[0]', lambda: DiskUsage.get_changes_since(0)),
+    ]
+
+
+def api_cases(client, server, token):
+    """(name, call) per /api/* route; /api/stream and /api/demo/seed are left out"""
+    path = '/'.join(server)
+    counter = iter(range(10 ** 9))
+
+    def get(url, **headers):
+        res = client.get(url, headers=headers)
+        assert res.status_code == 200, (url, res.status_code)
+
+    def post(url, payload):
+        res = client.post(url, json=payload)
+        assert res.status_code in (200, 201, 202), (url, res.status_code)
+
+    # The API stamps reports with the current second, so every write goes to a
+    # server of its own instead of repeating a second of an existing one
+    def report():
+        i = next(counter)
+        return {'token': token, 'site': 'Bench', 'sub_site': 'Ingest', 'server_type': f'server_{i}',
+                'path': '/data', 'size_mb': 1000 + i}
+    return [
+        ('GET /api/summary', lambda: get('/api/summary')),
+        ('GET /api/summary[columnar]', lambda: get('/api/summary?format=columnar')),
+        ('GET /api/sites', lambda: get('/api/sites')),
+        ('GET /api/last-update', lambda: get('/api/last-update')),
+        ('GET /api/history[30d]', lambda: get(f'/api/history/{path}?days=30')),
+        ('GET /api/history[30d,500pts]', lambda: get(f'/api/history/{path}?days=30&points=500')),
+        ('GET /api/history[30d,columnar]', lambda: get(f'/api/history/{path}?days=30&format=columnar')),
+        ('GET /api/history[30d,columnar,gzip]',
+         lambda: get(f'/api/history/{path}?days=30&format=columnar', **{'Accept-Encoding': 'gzip'})),
+        ('GET /api/monthly', lambda: get(f'/api/monthly/{path}')),
+        ('GET /api/month-production', lambda: get(f'/api/month-production/{path}')),
+        ('POST /api/report', lambda: post('/api/report', report())),
+        ('POST /api/report/batch[100]', lambda: post('/api/report/batch', [report() for _ in range(100)])),
+    ]
+
+
+def logged_in_client(flask_app):
+    """Test client with an admin session (skips the password hash)"""
+    from config import USERS_CONFIG
+    models.user_registry.refresh()
+    admin = next(cfg for cfg in USERS_CONFIG.values() if cfg['environment'] == 'production')
+    user = models.User.get_by_username(admin['username'])
+    client = flask_app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user.get_id()
+        session['_fresh'] = True
+    return client
+
+
+def run_scale(servers, days, interval, repeat):
+    results = []
+    with temp_database():
+        import app as flask_app
+        from config import API_TOKEN
+
+        start = time.perf_counter()
+        rows = populate(servers, days, interval=interval)
+        scale = {'servers': servers, 'days': days, 'interval': interval, 'rows': rows,
+                 'populate_s': round(time.perf_counter() - start, 2)}
+        print(f"\n{servers} servers x {days} days @ {interval}s: {rows} rows "
+              f"(populated in {scale['populate_s']}s)")
+
+        server = list(fleet(servers))[servers // 2]
+        client = logged_in_client(flask_app)
+        for kind, cases in (('model', model_cases(server)), ('api', api_cases(client, server, API_TOKEN))):
+            for name, fn in cases:
+                result = dict(scale=scale, kind=kind, name=name, **measure(fn, repeat))
+                results.append(result)
+                print(f"  {name:<42} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms"
+                      f"  {result['vm_steps']:>11} steps  {result['peak_kb']:>9.1f} KB")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print p50 / vm_steps ratios against a previous run for matching cases"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    key = lambda r: (r['scale']['servers'], r['scale']['days'], r['scale']['interval'], r['name'])
+    old = {key(r): r for r in baseline['results']}
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('commit')}):")
+    for result in results:
+        before = old.get(key(result))
+        if not before:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+        steps = result['vm_steps'] / before['vm_steps'] if before['vm_steps'] else float('inf')
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f"  {key(result)[0]:>6}x{key(result)[1]:<4} {result['name']:<42} "
+              f"p50 x{ratio:5.2f}  steps x{steps:5.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', default='10,100', help='comma-separated fleet sizes (10..10000)')
+    parser.add_argument('--days', default='1,7', help='comma-separated history lengths in days')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between samples')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per case')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for days in [float(d) for d in args.days.split(',')]:
+        for servers in [int(s) for s in args.servers.split(',')]:
+            results.extend(run_scale(servers, days, args.interval, args.repeat))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'numpy': growth.HAVE_NUMPY,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {len(results)} results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
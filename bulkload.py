@@ -0,0 +1,99 @@
+# Bulk loading of historical samples for LogHive (demo seeding, imports, benchmarks)
+import itertools
+import random
+import time
+
+from models import get_db_connection, rebuild_rollups, _series_id, _forget_series
+
+CHUNK_SIZE = 10000
+DEMO_MAX_SERVERS = 1000
+# Rows /api/demo/seed may generate in one request; larger fleets go through
+# tools/bulk_load.py instead of tying up a web worker
+DEMO_MAX_ROWS = 1000000
+
+# (site, sub_site, server_type, days of history); the short ones show the
+# individual data points in the dashboard charts
+DEMO_FLEET = [
+    ('Site_A', 'SubSite_1', 'log_server', 60),
+    ('Site_A', 'SubSite_1', 'backup_server', 60),
+    ('Site_A', 'SubSite_2', 'log_server', 60),
+    ('Site_A', 'SubSite_2', 'backup_server', 10),
+    ('Site_A', 'SubSite_4', 'log_server', 60),
+    ('Site_A', 'SubSite_4', 'backup_server', 7),
+    ('Site_A', 'SubSite_6', 'log_server', 60),
+    ('Site_A', 'SubSite_6', 'backup_server', 60),
+    ('Site_B', 'SubSite_3', 'log_server', 60),
+    ('Site_B', 'SubSite_3', 'backup_log_server', 15),
+    ('Site_B', 'SubSite_5', 'log_server', 60),
+    ('Site_B', 'SubSite_5', 'backup_log_server', 60),
+    ('Site_B', 'SubSite_6', 'log_server', 60),
+    ('Site_B', 'SubSite_6', 'backup_log_server', 60),
+    ('Site_B', 'SubSite_Lab', 'log_server', 5),
+    ('Site_B', 'SubSite_Lab', 'backup_log_server', 60),
+    ('Site_B', 'SubSite_4', 'log_server', 60),
+    ('Site_B', 'SubSite_4', 'backup_log_server', 20),
+]
+
+
+def demo_rows(servers=len(DEMO_FLEET), days=60, interval=86400, now=None, seed=None):
+    """Yield (site, sub_site, server_type, path, ts, size_mb) demo rows, server
+    by server in time order: one sample every `interval` seconds, growing by
+    0-50 MB a day. Beyond DEMO_FLEET, extra servers are added to Site_C."""
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    for i in range(servers):
+        if i < len(DEMO_FLEET):
+            site, sub_site, server_type, fleet_days = DEMO_FLEET[i]
+            server_days = min(days, fleet_days * days / 60)
+        else:
+            site, sub_site, server_type = 'Site_C', f'SubSite_{i // 10}', f'server_{i}'
+            server_days = days
+        size = rng.randint(500, 2000)
+        ts = now - int(server_days * 86400)
+        while ts <= now:
+            size += rng.uniform(0, 50) * interval / 86400
+            yield site, sub_site, server_type, '/data', ts, round(size, 2)
+            ts += interval
+
+
+def demo_row_count(servers, days, interval):
+    """Upper bound of the rows demo_rows yields for these arguments"""
+    return servers * (int(days * 86400) // interval + 1)
+
+
+def bulk_load(rows, environment='production', replace=False, chunk_size=CHUNK_SIZE):
+    """Insert (site, sub_site, server_type, path, ts, size_mb) rows in one
+    transaction, chunk_size rows per executemany, then rebuild the rollups.
+
+    rows may be any iterable (a generator is never materialized). Duplicate
+    samples are ignored; replace=True deletes every existing sample first.
+    Returns the number of samples inserted.
+    """
+    conn = get_db_connection(environment)
+    cursor = conn.cursor()
+    # Durability is pointless for a load that is redone from its source if the
+    # machine crashes mid-way; WAL keeps the file itself consistent
+    conn.execute('PRAGMA synchronous=OFF')
+    added = []
+    try:
+        if replace:
+            cursor.execute('DELETE FROM samples')
+        inserted = 0
+        rows = iter(rows)
+        while True:
+            chunk = [(_series_id(cursor, environment, site, sub_site, server_type, path, added), int(ts), size_mb)
+                     for site, sub_site, server_type, path, ts, size_mb in itertools.islice(rows, chunk_size)]
+            if not chunk:
+                break
+            cursor.executemany('INSERT OR IGNORE INTO samples (series_id, ts, size_mb) VALUES (?, ?, ?)', chunk)
+            inserted += cursor.rowcount
+        rebuild_rollups(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _forget_series(added)
+        raise
+    finally:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.close()
+    return inserted
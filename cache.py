@@ -0,0 +1,64 @@
+# In-process result cache for LogHive queries
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+cache_hits_counter = Counter(
+    'loghive_cache_hits_total',
+    'Query results served from the in-process cache',
+    ['cache']
+)
+cache_misses_counter = Counter(
+    'loghive_cache_misses_total',
+    'Query results computed because the cache had no current entry',
+    ['cache']
+)
+
+
+class VersionedCache:
+    """LRU cache with a TTL whose entries are tagged with the data version
+    they were computed from.
+
+    A lookup passes the current version; an entry with a different tag is
+    stale and recomputed. Since versions live in the database, a write in
+    any worker invalidates exactly the entries of the servers it touched.
+    The TTL only bounds how long anything survives writes made outside
+    DiskUsage (e.g. manual SQL).
+    """
+
+    def __init__(self, name, maxsize=2048, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (tag, expires, value)
+        self._hits = cache_hits_counter.labels(cache=name)
+        self._misses = cache_misses_counter.labels(cache=name)
+
+    def get_or_compute(self, key, tag, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == tag and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return entry[2]
+
+        # Computed outside the lock; concurrent misses may compute twice
+        self._misses.inc()
+        value = compute()
+        with self._lock:
+            self._entries[key] = (tag, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -26,12 +26,99 @@ def get_database_path(environment='production'):
 # Default database path (for backward compatibility)
 DATABASE_PATH = get_database_path('production')
 
+# SQLite connection tuning (applied once when a pooled connection is opened)
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 8192))
+DB_MMAP_SIZE_MB = int(os.environ.get('DB_MMAP_SIZE_MB', 64))
+# How often (seconds) a pooled connection is pinged before being reused
+DB_HEALTHCHECK_SECONDS = int(os.environ.get('DB_HEALTHCHECK_SECONDS', 30))
+# In-process cache of summary / growth results. Entries are dropped as soon as
+# the server's data version changes; the TTL only covers out-of-band edits.
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 2048))
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get('QUERY_CACHE_TTL_SECONDS', 300))
+# How often (seconds) the in-memory user registry checks for user changes
+USER_REGISTRY_CHECK_SECONDS = int(os.environ.get('USER_REGISTRY_CHECK_SECONDS', 5))
+
 # Session configuration
 SESSION_LIFETIME = timedelta(hours=24)
 
+# Login protection: failed attempts allowed per client IP and per username
+# within the window (token bucket), and the bounded password-hash pool
+LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', 5))
+LOGIN_FAILURE_WINDOW_SECONDS = int(os.environ.get('LOGIN_FAILURE_WINDOW_SECONDS', 300))
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 2))
+LOGIN_HASH_MAX_PENDING = int(os.environ.get('LOGIN_HASH_MAX_PENDING', 8))
+# Reverse proxies in front of the app (1 behind nginx). Their X-Forwarded-*
+# headers are trusted, so the login limits see the client IP instead of the
+# proxy's. Keep 0 when clients connect directly: they could forge the headers.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
 # API Token for agents (change in production)
 API_TOKEN = os.environ.get('API_TOKEN', 'change-me-set-api-token-in-env')
 
+# Maximum number of reports accepted by one /api/report/batch request
+BATCH_MAX_REPORTS = int(os.environ.get('BATCH_MAX_REPORTS', 5000))
+# Largest /api/report/batch body after gzip decoding (Content-Encoding: gzip)
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 8 * 1024 * 1024))
+
+# Agents replaying their spool send each sample's own recorded_at; one
+# further ahead of the server clock than this is rejected
+REPORT_MAX_FUTURE_SECONDS = int(os.environ.get('REPORT_MAX_FUTURE_SECONDS', 300))
+
+# Agent report ingest mode:
+#   'sync'  - write each report to SQLite before responding (default)
+#   'queue' - validate, queue in memory, reply 202 and write in batches
+#             from a background thread (503 when the queue is full)
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+INGEST_QUEUE_MAXSIZE = int(os.environ.get('INGEST_QUEUE_MAXSIZE', 10000))
+INGEST_FLUSH_BATCH_SIZE = int(os.environ.get('INGEST_FLUSH_BATCH_SIZE', 500))
+INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS', 200))
+
+# Compress dashboard API responses (gzip, or brotli when installed) for
+# clients that accept it, when the body is at least this many bytes
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+
+# Deadband storage: a report within DEADBAND_MB or DEADBAND_PCT percent of
+# its server's newest stored size (whichever is larger) extends that row's
+# run (last_seen, sample_count) instead of adding a row. Runs end at UTC day
+# boundaries. A server entry in SITES_CONFIG may set its own "deadband"
+# (true / false), "deadband_mb" and "deadband_pct".
+DEADBAND_ENABLED = os.environ.get('DEADBAND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+DEADBAND_MB = float(os.environ.get('DEADBAND_MB', 0))
+DEADBAND_PCT = float(os.environ.get('DEADBAND_PCT', 0))
+
+# Upper bound for /api/history?points=N (server-side downsampling)
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', 2000))
+
+# /api/stream (Server-Sent Events): how often each worker checks for new
+# data, the keepalive comment interval and how long one stream stays open
+# before the browser reconnects (frees the worker thread periodically)
+STREAM_POLL_INTERVAL_MS = int(os.environ.get('STREAM_POLL_INTERVAL_MS', 1000))
+STREAM_KEEPALIVE_SECONDS = int(os.environ.get('STREAM_KEEPALIVE_SECONDS', 15))
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 300))
+# Open streams per worker; beyond it /api/stream answers 503 and the
+# dashboard polls instead, so streams never take every gthread thread
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 16))
+
+# Per-method SQLite time / rows, connection, summary, serialization and
+# ingest commit histograms plus per-server report age on /metrics. When
+# disabled the hot paths run without any timing calls.
+DETAILED_METRICS = os.environ.get('DETAILED_METRICS', 'true').lower() in ('1', 'true', 'yes')
+# Per-server metric labels are limited to SITES_CONFIG (anything else is
+# labeled 'other') and to this many label sets per metric
+METRICS_MAX_SERIES = int(os.environ.get('METRICS_MAX_SERIES', 500))
+
+# Retention (tools/retention.py): raw samples are kept for RAW_DAYS (rounded
+# back to a month start), hourly rollups for HOURLY_DAYS, daily rollups for
+# DAILY_DAYS (0 = forever). Monthly rollups are never deleted.
+RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', 90))
+RETENTION_HOURLY_DAYS = int(os.environ.get('RETENTION_HOURLY_DAYS', 365))
+RETENTION_DAILY_DAYS = int(os.environ.get('RETENTION_DAILY_DAYS', 0))
+# Rows deleted per transaction, and the pause between transactions
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 5000))
+RETENTION_PAUSE_MS = int(os.environ.get('RETENTION_PAUSE_MS', 50))
+
 # Site and Server Configuration
 SITES_CONFIG = {
     "Site_A": {
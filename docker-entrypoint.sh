@@ -19,6 +19,7 @@ if [ ! -f "/app/data/dashboard.db" ]; then
 else
     echo "Database found. Checking for pending migrations..."
 fi
+python3 migrate_db.py
 python3 -c "from models import init_db; init_db()"
 echo "✓ Database ready"
 
@@ -0,0 +1,179 @@
+# Column-oriented growth statistics for LogHive
+import calendar
+import time
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: the array-based fallback gives the same results
+    np = None
+
+HAVE_NUMPY = np is not None
+
+# One row per (series, bucket) segment; every field is a list
+Segments = namedtuple('Segments', [
+    'series', 'bucket_ts', 'first_ts', 'last_ts', 'first_mb', 'last_mb',
+    'max_mb', 'sample_count', 'growth_mb'
+])
+
+
+def positive_growth(sizes):
+    """Sum of the positive deltas between consecutive sizes, unrounded.
+    0 (int) when nothing grew, like DiskUsage._calc_positive_growth."""
+    if len(sizes) < 2:
+        return 0
+    if HAVE_NUMPY:
+        deltas = np.clip(np.diff(np.asarray(sizes, dtype=np.float64)), 0, None)
+        # cumsum adds strictly left to right, so the total matches a Python loop
+        growth = float(np.cumsum(deltas)[-1])
+    else:
+        growth = 0
+        for i in range(1, len(sizes)):
+            diff = sizes[i] - sizes[i - 1]
+            if diff > 0:
+                growth += diff
+    return growth if growth > 0 else 0
+
+
+def hour_starts(timestamps):
+    """UTC hour start of every epoch timestamp"""
+    if HAVE_NUMPY:
+        ts = np.asarray(timestamps, dtype=np.int64)
+        return ts - ts % 3600
+    return array('q', (ts - ts % 3600 for ts in timestamps))
+
+
+def day_starts(timestamps):
+    """UTC day start of every epoch timestamp"""
+    if HAVE_NUMPY:
+        ts = np.asarray(timestamps, dtype=np.int64)
+        return ts - ts % 86400
+    return array('q', (ts - ts % 86400 for ts in timestamps))
+
+
+def _month_start(ts):
+    t = time.gmtime(ts)
+    return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+
+
+def month_starts(timestamps):
+    """UTC calendar month start of every epoch timestamp"""
+    if HAVE_NUMPY:
+        months = np.asarray(timestamps, dtype=np.int64).astype('datetime64[s]').astype('datetime64[M]')
+        return months.astype('datetime64[s]').astype(np.int64)
+    starts = array('q')
+    day, start = None, None
+    for ts in timestamps:
+        if ts - ts % 86400 != day:  # samples are mostly many per day
+            day = ts - ts % 86400
+            start = _month_start(day)
+        starts.append(start)
+    return starts
+
+
+def segment_stats(series, buckets, timestamps, sizes, counts=None):
+    """First/last/max size, sample count and positive-delta growth of every
+    (series, bucket) run in parallel columns.
+
+    series are integer server ids and buckets the bucket start of each
+    sample (see day_starts / month_starts). Rows must be ordered by series,
+    then timestamp (then size, as idx_disk_usage_lookup returns them).
+    counts: reports each row stands for (default 1), summed into sample_count.
+    """
+    if HAVE_NUMPY:
+        return _segment_stats_numpy(series, buckets, timestamps, sizes, counts)
+    return _segment_stats_array(series, buckets, timestamps, sizes, counts)
+
+
+def _sequential_sums(values, starts, lengths):
+    """Per-segment sums of values[start:start + length], added left to right.
+
+    np.add.reduceat sums pairwise and can differ from a Python loop in the
+    last bit, which shows after rounding to 2 decimals. Segments are instead
+    laid out as rows of zero-padded blocks and summed with cumsum (strictly
+    sequential); grouping by power-of-two length keeps padding under 2x.
+    """
+    sums = np.zeros(len(starts), dtype=np.float64)
+    if len(values) == 0:
+        return sums
+    classes = np.frexp(lengths.astype(np.float64))[1]  # 0 for empty segments
+    for cls in np.unique(classes[classes > 0]):
+        rows = np.flatnonzero(classes == cls)
+        row_lengths = lengths[rows]
+        columns = np.arange(row_lengths.max())
+        index = np.minimum(starts[rows, None] + columns, len(values) - 1)
+        block = np.where(columns < row_lengths[:, None], values[index], 0.0)
+        sums[rows] = block.cumsum(axis=1)[:, -1]
+    return sums
+
+
+def _segment_stats_numpy(series, buckets, timestamps, sizes, counts=None):
+    series = np.asarray(series, dtype=np.int64)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    if len(sizes) == 0:
+        return Segments(*([] for _ in Segments._fields))
+
+    boundary = np.empty(len(sizes), dtype=bool)
+    boundary[0] = True
+    np.not_equal(series[1:], series[:-1], out=boundary[1:])
+    boundary[1:] |= buckets[1:] != buckets[:-1]
+    starts = np.flatnonzero(boundary)
+    ends = np.append(starts[1:], len(sizes))
+
+    # deltas[i] = sizes[i + 1] - sizes[i]; a segment owns the deltas between
+    # its own samples, the one crossing into the next segment is skipped
+    deltas = np.clip(np.diff(sizes), 0, None)
+    growth = _sequential_sums(deltas, starts, ends - starts - 1)
+
+    return Segments(
+        series=series[starts].tolist(),
+        bucket_ts=buckets[starts].tolist(),
+        first_ts=timestamps[starts].tolist(),
+        last_ts=timestamps[ends - 1].tolist(),
+        first_mb=sizes[starts].tolist(),
+        last_mb=sizes[ends - 1].tolist(),
+        max_mb=np.maximum.reduceat(sizes, starts).tolist(),
+        sample_count=(ends - starts if counts is None
+                      else np.add.reduceat(np.asarray(counts, dtype=np.int64), starts)).tolist(),
+        growth_mb=[g if g > 0 else 0 for g in growth.tolist()],
+    )
+
+
+def _segment_stats_array(series, buckets, timestamps, sizes, counts=None):
+    series = array('q', series)
+    buckets = array('q', buckets)
+    timestamps = array('q', timestamps)
+    sizes = array('d', sizes)
+    if len(sizes) == 0:
+        return Segments(*([] for _ in Segments._fields))
+
+    keys = list(zip(series, buckets))
+    starts = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]]
+    ends = starts[1:] + [len(keys)]
+
+    growth = []
+    for start, end in zip(starts, ends):
+        total = 0
+        previous = sizes[start]
+        for size in sizes[start + 1:end]:
+            diff = size - previous
+            if diff > 0:
+                total += diff
+            previous = size
+        growth.append(total)
+
+    return Segments(
+        series=[series[i] for i in starts],
+        bucket_ts=[buckets[i] for i in starts],
+        first_ts=[timestamps[i] for i in starts],
+        last_ts=[timestamps[i - 1] for i in ends],
+        first_mb=[sizes[i] for i in starts],
+        last_mb=[sizes[i - 1] for i in ends],
+        max_mb=[max(sizes[s:e]) for s, e in zip(starts, ends)],
+        sample_count=([e - s for s, e in zip(starts, ends)] if counts is None
+                      else [sum(counts[s:e]) for s, e in zip(starts, ends)]),
+        growth_mb=growth,
+    )
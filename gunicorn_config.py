@@ -23,7 +23,13 @@ bind = f"0.0.0.0:{PORT}"
 workers = 2
 
 # Worker class
-worker_class = "sync"
+# gthread keeps /api/stream (Server-Sent Events) connections on threads so
+# they do not block other requests. Each open dashboard holds one thread
+# for up to STREAM_MAX_SECONDS; STREAM_MAX_SUBSCRIBERS (keep it below
+# threads) leaves the rest for other requests. The pooled SQLite
+# connections are per-thread, so avoid gevent/eventlet here.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
 
 # Timeout for worker processes
 timeout = 120
@@ -42,3 +48,10 @@ daemon = False
 
 # Reload on code changes (set to False for production)
 reload = False
+
+
+def worker_exit(server, worker):
+    """Flush queued agent reports (INGEST_MODE=queue) before a worker exits"""
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.ingest_queue.stop()
@@ -0,0 +1,153 @@
+# Write-behind ingest queue for LogHive
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue by stop() to wake the writer thread
+_WAKEUP = object()
+
+ingest_queue_depth = Gauge(
+    'loghive_ingest_queue_depth',
+    'Agent reports waiting in the write-behind queue'
+)
+ingest_flush_seconds = Histogram(
+    'loghive_ingest_flush_seconds',
+    'Time spent writing one batch of queued agent reports',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+ingest_flush_size = Histogram(
+    'loghive_ingest_flush_size',
+    'Number of agent reports written per batch',
+    buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 5000)
+)
+ingest_dropped_counter = Counter(
+    'loghive_ingest_dropped_total',
+    'Queued agent reports dropped after repeated write failures'
+)
+
+
+class IngestQueue:
+    """Bounded in-process queue of agent reports drained by a background writer.
+
+    writer(reports) is called with a list of reports whenever batch_size
+    reports are waiting or interval_ms has passed since the first one arrived.
+    The writer thread starts on the first submit, so a queue created before
+    a fork (gunicorn preload) starts its own thread in each worker.
+    """
+
+    WRITE_ATTEMPTS = 3
+
+    def __init__(self, writer, maxsize=10000, batch_size=500, interval_ms=200):
+        self.writer = writer
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._reset()
+        atexit.register(self.stop)
+
+    def _reset(self):
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent's queue and thread are not ours
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def submit(self, report):
+        """Queue one report. Returns False when the queue is full (backpressure)."""
+        return self.submit_many([report]) == 1
+
+    def submit_many(self, reports):
+        """Queue reports in order. Returns how many were accepted before the queue filled up."""
+        self._ensure_started()
+        accepted = 0
+        for report in reports:
+            try:
+                self._queue.put_nowait(report)
+            except queue.Full:
+                break
+            accepted += 1
+        return accepted
+
+    def _get(self, timeout):
+        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+        if item is _WAKEUP:
+            raise queue.Empty
+        return item
+
+    def _take(self, wait):
+        """Collect up to batch_size reports. With wait, block up to interval for
+        the first one and keep collecting until interval after it arrived."""
+        try:
+            batch = [self._get(self.interval if wait else 0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + (self.interval if wait else 0)
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._get(deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            start = time.perf_counter()
+            try:
+                self.writer(batch)
+            except Exception:
+                logger.exception('Ingest flush of %d reports failed (attempt %d/%d)',
+                                 len(batch), attempt, self.WRITE_ATTEMPTS)
+                time.sleep(self.interval * attempt)
+                continue
+            ingest_flush_seconds.observe(time.perf_counter() - start)
+            ingest_flush_size.observe(len(batch))
+            return True
+        ingest_dropped_counter.inc(len(batch))
+        return False
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take(wait=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = self._take(wait=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self, timeout=10):
+        """Stop the writer thread and flush what is left (called at exit)"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_WAKEUP)
+            except queue.Full:
+                pass  # the writer is busy draining anyway
+            self._thread.join(timeout)
+        if self._pid == os.getpid():
+            self.flush()
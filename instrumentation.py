@@ -0,0 +1,207 @@
+# Hot-path Prometheus metrics for LogHive (DB time, rows, ingest lag)
+import functools
+import sqlite3
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+from config import DETAILED_METRICS
+
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+db_query_seconds = Histogram(
+    'loghive_db_query_seconds',
+    'SQLite time (execute and fetch) of one DiskUsage call',
+    ['method'],
+    buckets=_LATENCY_BUCKETS
+)
+db_rows_returned = Histogram(
+    'loghive_db_rows_returned',
+    'Rows fetched from SQLite by one DiskUsage call',
+    ['method'],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000)
+)
+db_connect_seconds = Histogram(
+    'loghive_db_connect_seconds',
+    'Time to open a pooled SQLite connection and apply its pragmas',
+    buckets=_LATENCY_BUCKETS
+)
+summary_compute_seconds = Histogram(
+    'loghive_summary_compute_seconds',
+    'Time to build the dashboard summary from the monthly rollups (cache misses)',
+    buckets=_LATENCY_BUCKETS
+)
+response_serialize_seconds = Histogram(
+    'loghive_response_serialize_seconds',
+    'Time to serialize (and compress) an API response',
+    buckets=_LATENCY_BUCKETS
+)
+ingest_commit_seconds = Histogram(
+    'loghive_ingest_commit_seconds',
+    'Commit latency of one agent report write (single report or batch)',
+    buckets=_LATENCY_BUCKETS
+)
+
+metric_labels_dropped_counter = Counter(
+    'loghive_metric_labels_dropped_total',
+    'Agent-supplied label sets collapsed into "other" (unknown topology or series cap)',
+    ['metric', 'reason']
+)
+
+OTHER = 'other'
+
+# Per thread: [db seconds, rows] of the innermost instrumented call
+_calls = threading.local()
+
+
+def _account(seconds, rows=0):
+    call = getattr(_calls, 'current', None)
+    if call is not None:
+        call[0] += seconds
+        call[1] += rows
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute/fetch time and fetched rows to the
+    instrumented call running on this thread. Rows read by iterating the
+    cursor are not seen, so instrumented code uses fetchone/fetchall."""
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _account(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _account(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        _account(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        _account(time.perf_counter() - start, len(rows))
+        return rows
+
+
+# Cursor class for pooled connections
+cursor_factory = TimedCursor if DETAILED_METRICS else sqlite3.Cursor
+
+
+def instrumented(fn):
+    """Observe the SQLite time and rows of every call to fn, labeled with its
+    name. Nested instrumented calls count towards the outer one as well.
+    Returns fn itself when detailed metrics are disabled."""
+    if not DETAILED_METRICS:
+        return fn
+    seconds = db_query_seconds.labels(method=fn.__name__)
+    rows = db_rows_returned.labels(method=fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_calls, 'current', None)
+        call = _calls.current = [0.0, 0]
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _calls.current = outer
+            seconds.observe(call[0])
+            rows.observe(call[1])
+            if outer is not None:
+                outer[0] += call[0]
+                outer[1] += call[1]
+    return wrapper
+
+
+def timed(histogram, fn, *args):
+    """fn(*args), observed in histogram when detailed metrics are enabled"""
+    if not DETAILED_METRICS:
+        return fn(*args)
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class ServerLabels:
+    """Maps agent-supplied (site, sub_site, server_type) to metric labels
+    that stay within SITES_CONFIG: each unknown part becomes 'other'. At
+    most max_series distinct label sets are handed out; later ones are
+    collapsed into ('other', 'other', 'other'). Collapses are counted in
+    loghive_metric_labels_dropped_total.
+    """
+
+    def __init__(self, metric, sites_config, max_series):
+        self.max_series = max_series
+        self._sub_sites = {(site, sub_site): set(servers)
+                           for site, cfg in sites_config.items()
+                           for sub_site, servers in cfg['sub_sites'].items()}
+        self._sites = set(sites_config)
+        self._issued = set()
+        self._lock = threading.Lock()
+        self._unknown = metric_labels_dropped_counter.labels(metric=metric, reason='unknown')
+        self._capped = metric_labels_dropped_counter.labels(metric=metric, reason='cap')
+
+    def __call__(self, site, sub_site, server_type, count=1):
+        servers = self._sub_sites.get((site, sub_site))
+        if servers is None or server_type not in servers:
+            self._unknown.inc(count)
+            if servers is None:
+                sub_site = OTHER
+                if site not in self._sites:
+                    site = OTHER
+            server_type = OTHER
+        labels = (site, sub_site, server_type)
+        if labels not in self._issued:
+            with self._lock:
+                if len(self._issued) >= self.max_series and labels not in self._issued:
+                    self._capped.inc(count)
+                    return OTHER, OTHER, OTHER
+                self._issued.add(labels)
+        return labels
+
+
+class ReportAgeCollector:
+    """loghive_series_last_report_age_seconds, read at scrape time.
+    source() yields (environment, site, sub_site, server_type, last report epoch);
+    labels maps the server part like ServerLabels (newest report per label set)."""
+
+    def __init__(self, source, labels):
+        self.source = source
+        self.labels = labels
+
+    @staticmethod
+    def _family():
+        return GaugeMetricFamily(
+            'loghive_series_last_report_age_seconds',
+            'Seconds since each server last reported',
+            labels=['environment', 'site', 'sub_site', 'server_type']
+        )
+
+    def describe(self):
+        # Without describe() the registry calls collect() on register, which
+        # would query the database before init_db() created its tables
+        yield self._family()
+
+    def collect(self):
+        gauge = self._family()
+        latest = {}
+        for environment, site, sub_site, server_type, last_ts in self.source():
+            key = (environment, *self.labels(site, sub_site, server_type, count=0))
+            latest[key] = max(latest.get(key, last_ts), last_ts)
+        now = time.time()
+        for key, last_ts in latest.items():
+            gauge.add_metric(list(key), max(0, now - last_ts))
+        yield gauge
@@ -1,56 +1,762 @@
 # Database Models for LogHive
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+import calendar
+from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
-from config import get_database_path, USERS_CONFIG
+from array import array
+from downsample import lttb
+from growth import segment_stats, positive_growth, hour_starts, day_starts, month_starts
+from cache import VersionedCache
+from instrumentation import (
+    instrumented, timed, cursor_factory, db_connect_seconds, summary_compute_seconds, ingest_commit_seconds
+)
+from config import (
+    get_database_path, USERS_CONFIG,
+    DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB, DB_HEALTHCHECK_SECONDS,
+    QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS, USER_REGISTRY_CHECK_SECONDS,
+    SITES_CONFIG, DEADBAND_ENABLED, DEADBAND_MB, DEADBAND_PCT
+)
 
 
-def get_db_connection(environment='production'):
-    """Get database connection with row factory based on environment"""
-    db_path = get_database_path(environment)
+# ==================== Connection Pool ====================
+# One SQLite connection per (process, thread, database file), opened once with
+# WAL and tuning pragmas and reused by every get_db_connection() call.
+
+_pool = threading.local()
+_pool_pid = os.getpid()
+# Pools inherited across fork are kept referenced but never used or closed,
+# so a child process cannot disturb the parent's file handles and locks
+_orphaned_pools = []
+
+
+class _PooledConnection:
+    """Proxy for a pooled sqlite3 connection; close() returns it to the pool"""
+    
+    def __init__(self, conn, db_path):
+        self._conn = conn
+        self.db_path = db_path
+        self.last_checked = time.monotonic()
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def cursor(self):
+        return self._conn.cursor(cursor_factory)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+    
+    def close(self):
+        # Never leave a transaction (and its locks) open between checkouts
+        if self._conn.in_transaction:
+            self._conn.rollback()
+    
+    def is_healthy(self):
+        """Ping the connection and make sure its file was not removed"""
+        try:
+            self._conn.execute('SELECT 1').fetchone()
+        except sqlite3.Error:
+            return False
+        return os.path.exists(self.db_path)
+    
+    def dispose(self):
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def _open_connection(db_path):
+    """Open a new SQLite connection and apply the pragmas once"""
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    # Lets tools/retention.py return freed pages to the OS. Only takes effect on
+    # a new file (before WAL writes the header); `retention.py --vacuum`
+    # converts existing ones.
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    # WAL lets dashboard reads proceed while an agent report is being written
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return _PooledConnection(conn, db_path)
+
+
+def _reset_pool_after_fork():
+    """Give a forked child (e.g. a gunicorn worker) its own, empty pool"""
+    global _pool, _pool_pid
+    _orphaned_pools.append(_pool)
+    _pool = threading.local()
+    _pool_pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def get_db_connection(environment='production'):
+    """Get the pooled database connection for this thread and environment"""
+    if os.getpid() != _pool_pid:
+        _reset_pool_after_fork()
+    db_path = get_database_path(environment)
+    connections = getattr(_pool, 'connections', None)
+    if connections is None:
+        connections = _pool.connections = {}
+    
+    conn = connections.get(db_path)
+    if conn is not None:
+        now = time.monotonic()
+        if now - conn.last_checked >= DB_HEALTHCHECK_SECONDS:
+            if conn.is_healthy():
+                conn.last_checked = now
+            else:
+                conn.dispose()
+                conn = None
+    
+    if conn is None:
+        conn = connections[db_path] = timed(db_connect_seconds, _open_connection, db_path)
+    elif conn.in_transaction:
+        # A previous caller failed before commit/close
+        conn.rollback()
     return conn
 
 
-def init_db():
-    """Initialize database tables for both test and production environments"""
-    for env in ['test', 'production']:
-        conn = get_db_connection(env)
-        cursor = conn.cursor()
+def close_db_connections():
+    """Close this thread's pooled connections (e.g. before deleting database files)"""
+    connections = getattr(_pool, 'connections', None) or {}
+    for conn in connections.values():
+        conn.dispose()
+    connections.clear()
+    _series_ids.clear()
+
+
+# ==================== Timestamps ====================
+# samples.ts holds UTC epoch seconds; months are UTC calendar months.
+# The API keeps returning recorded_at as 'YYYY-MM-DD HH:MM:SS' (UTC).
+
+def to_epoch(value):
+    """Convert an epoch number, datetime or 'YYYY-MM-DD HH:MM:SS' / ISO 8601
+    string to UTC epoch seconds. Naive values are taken as UTC."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def format_ts(ts):
+    """Format epoch seconds as the API's recorded_at string"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+def month_range(month):
+    """Half-open [start, end) epoch range of a 'YYYY-MM' month"""
+    year, mon = int(month[:4]), int(month[5:7])
+    start = calendar.timegm((year, mon, 1, 0, 0, 0))
+    end = calendar.timegm((year + mon // 12, mon % 12 + 1, 1, 0, 0, 0))
+    return start, end
+
+
+def current_month():
+    return datetime.now(timezone.utc).strftime('%Y-%m')
+
+
+def previous_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    if mon == 1:
+        return f"{year - 1}-12"
+    return f"{year}-{mon - 1:02d}"
+
+
+# ==================== Series ====================
+# Raw samples are stored as (series_id, ts, size_mb) in `samples`, clustered
+# on (series_id, ts); `series` maps each (site, sub_site, server_type) to its
+# id and last reported path. The `disk_usage` view joins them back into the
+# old row shape for manual SQL and maintenance scripts.
+
+# (database path, site, sub_site, server_type) -> (series id, path).
+# Series rows are never deleted, so cached ids stay valid once committed;
+# writers pass `added` and drop those keys again if they roll back.
+_series_ids = {}
+_series_lock = threading.Lock()
+
+
+def _series_id(cursor, environment, site, sub_site, server_type, path, added=None):
+    """Id of a series, created (or its path updated) on first use.
+    Keys cached by this call are appended to added when a list is given."""
+    key = (get_database_path(environment), site, sub_site, server_type)
+    cached = _series_ids.get(key)
+    if cached is not None and cached[1] == path:
+        return cached[0]
+    cursor.execute('''
+        INSERT INTO series (site, sub_site, server_type, path) VALUES (?, ?, ?, ?)
+        ON CONFLICT (site, sub_site, server_type) DO UPDATE SET path = excluded.path
+        WHERE path != excluded.path
+    ''', (site, sub_site, server_type, path))
+    cursor.execute(
+        'SELECT id FROM series WHERE site = ? AND sub_site = ? AND server_type = ?',
+        (site, sub_site, server_type)
+    )
+    series_id = cursor.fetchone()[0]
+    with _series_lock:
+        _series_ids[key] = (series_id, path)
+    if added is not None:
+        added.append(key)
+    return series_id
+
+
+def _forget_series(keys):
+    """Drop cached ids of a transaction that was rolled back"""
+    with _series_lock:
+        for key in keys:
+            _series_ids.pop(key, None)
+
+
+# ==================== Deadband ====================
+# With deadband storage on for a server, a report within its tolerance of the
+# newest stored row adds no row: that row becomes a run, last_seen moving to
+# the report's time and sample_count counting the reports it stands for (its
+# size stays the first report's). Runs never cross a UTC day, so daily and
+# monthly buckets hold whole runs. Hourly buckets are folded per report as
+# it arrives; rebuilds spread a run's reports evenly over its span
+# (_run_samples), which gives the same hourly buckets for reports at a fixed
+# interval. Readers expand a run into its first and last sample
+# (_run_points). A late sample inside a run with another size splits the run
+# into its two ends.
+
+# (database path, series id) -> (ts, size_mb, last_seen) of the newest row
+# this process stored. Only a hint: run extensions re-check it in SQL.
+_newest_rows = {}
+
+_COVERING_ROW_SQL = '''
+    SELECT ts, size_mb, COALESCE(last_seen, ts) FROM samples
+    WHERE series_id = ? AND ts <= ?
+    ORDER BY ts DESC, size_mb DESC
+    LIMIT 1
+'''
+
+# Only while the run is still the newest row of its series
+_EXTEND_RUN_SQL = '''
+    UPDATE samples SET last_seen = ?, sample_count = sample_count + 1
+    WHERE series_id = ? AND ts = ? AND size_mb = ? AND COALESCE(last_seen, ts) < ?
+    AND NOT EXISTS (SELECT 1 FROM samples WHERE series_id = ? AND ts > ?)
+'''
+
+
+def deadband_tolerance(site, sub_site, server_type):
+    """(MB, fraction) by which a report may differ from the newest stored size
+    and still extend its run; None when deadband storage is off for the server"""
+    server = SITES_CONFIG.get(site, {}).get('sub_sites', {}).get(sub_site, {}).get(server_type, {})
+    if not server.get('deadband', DEADBAND_ENABLED):
+        return None
+    return server.get('deadband_mb', DEADBAND_MB), server.get('deadband_pct', DEADBAND_PCT) / 100
+
+
+def _within(size_mb, run_mb, tolerance):
+    abs_mb, fraction = tolerance
+    return abs(size_mb - run_mb) <= max(abs_mb, fraction * abs(run_mb))
+
+
+def _covering_row(cursor, series_id, ts):
+    """(ts, size_mb, last_seen or ts) of the newest row starting at or before ts"""
+    cursor.execute(_COVERING_ROW_SQL, (series_id, ts))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def _split_run(cursor, series_id, run):
+    """Turn a run into its first and last sample (a late sample falls between)"""
+    run_ts, size_mb, last_seen = run
+    cursor.execute(
+        'UPDATE samples SET last_seen = NULL, sample_count = sample_count - 1 '
+        'WHERE series_id = ? AND ts = ? AND size_mb = ? AND last_seen = ?',
+        (series_id, run_ts, size_mb, last_seen)
+    )
+    if cursor.rowcount > 0:
+        cursor.execute('INSERT OR IGNORE INTO samples (series_id, ts, size_mb) VALUES (?, ?, ?)',
+                       (series_id, last_seen, size_mb))
+
+
+def _store_sample(cursor, environment, series_id, ts, size_mb, tolerance=None):
+    """Insert one sample or, within the deadband `tolerance`, extend the newest
+    run of its series. Returns the size it is stored as (the run's when it
+    extended one), or None when it is already stored (a retried report)."""
+    if tolerance is not None:
+        key = (get_database_path(environment), series_id)
+        row = _newest_rows.get(key)
+        if row is None or ts <= row[2]:
+            row = _covering_row(cursor, series_id, ts)
+        for _ in range(2):
+            if row is None or not _within(size_mb, row[1], tolerance):
+                break
+            if ts <= row[2]:
+                return None  # the run already covers it
+            if ts >= _day_bounds(row[0])[1]:
+                break
+            cursor.execute(_EXTEND_RUN_SQL, (ts, series_id, row[0], row[1], ts, series_id, row[0]))
+            if cursor.rowcount > 0:
+                _newest_rows[key] = (row[0], row[1], ts)
+                return row[1]
+            # Another process stored a newer sample since the hint was taken
+            row = _covering_row(cursor, series_id, ts)
+        if row is not None and row[0] < ts < row[2]:
+            _split_run(cursor, series_id, row)
+    cursor.execute('INSERT OR IGNORE INTO samples (series_id, ts, size_mb) VALUES (?, ?, ?)',
+                   (series_id, ts, size_mb))
+    if cursor.rowcount <= 0:
+        return None
+    if tolerance is not None:
+        _newest_rows[key] = (ts, size_mb, ts)
+    return size_mb
+
+
+def _run_samples(ts, last_seen, sample_count):
+    """(ts, count) samples standing for the reports of a run: its first
+    report, then in every UTC hour the first and the last of the reports
+    spread evenly up to last_seen (count 1 and the rest of that hour's)"""
+    n = sample_count - 1
+    span = last_seen - ts
+    samples = [(ts, 1)]
+    first = 1  # report i is at ts + i * span // n
+    hour_end = ts - ts % 3600 + 3600
+    while first <= n:
+        after = min(-(-(hour_end - ts) * n // span), n + 1)  # first report from hour_end on
+        if after > first:
+            samples.append((ts + first * span // n, 1))
+            if after - 1 > first:
+                samples.append((ts + (after - 1) * span // n, after - 1 - first))
+            first = after
+        hour_end += 3600
+    return samples
+
+
+def _run_points(rows, since=0):
+    """(ts, size_mb, last_seen) rows in primary key order -> (ts, size_mb)
+    points from `since` on, a run standing for its first and last sample.
+    A run that began before `since` starts at `since` (its size held there)."""
+    points = []
+    end = 0  # last_seen of the latest run so far
+    ordered = True
+    for ts, size_mb, last_seen in rows:
+        # False once a row lies within a run (bulk loaded after the run was stored)
+        ordered = ordered and ts >= end
+        if ts >= since:
+            points.append((ts, size_mb))
+        elif last_seen is not None and last_seen > since:
+            points.append((since, size_mb))
+        if last_seen is not None:
+            points.append((last_seen, size_mb))
+            end = last_seen
+    if not ordered:
+        points.sort()
+    return points
+
+
+# ==================== Rollups ====================
+# disk_usage_hourly / _daily / _monthly hold first, last and max size, sample
+# count and positive-delta growth per server and bucket. They are folded
+# forward on every insert, so growth queries read one row per month instead
+# of every sample.
+#
+# tools/retention.py deletes raw samples older than a month-aligned
+# watermark (retention_watermark). Buckets before it can no longer be
+# recomputed from disk_usage and are left as they are; history before it is
+# read from the hourly rollups (daily where those were trimmed as well), and
+# reports recorded before it are rejected.
+
+def _hour_bounds(ts):
+    start = ts - ts % 3600
+    return start, start + 3600
+
+
+def _day_bounds(ts):
+    start = ts - ts % 86400
+    return start, start + 86400
+
+
+def _month_bounds(ts):
+    return month_range(time.strftime('%Y-%m', time.gmtime(ts)))
+
+
+# Rollup table -> function returning the [start, end) bucket containing ts
+ROLLUPS = {
+    'disk_usage_hourly': _hour_bounds,
+    'disk_usage_daily': _day_bounds,
+    'disk_usage_monthly': _month_bounds,
+}
+
+# Rollup table -> bucket starts for a whole column of timestamps (rebuilds)
+_ROLLUP_STARTS = {
+    'disk_usage_hourly': hour_starts,
+    'disk_usage_daily': day_starts,
+    'disk_usage_monthly': month_starts,
+}
+
+_ROLLUP_COLUMNS = (
+    'site', 'sub_site', 'server_type', 'bucket_ts', 'first_ts', 'last_ts',
+    'first_mb', 'last_mb', 'max_mb', 'sample_count', 'growth_mb'
+)
+
+
+def _fold(bucket, ts, size_mb, count=1):
+    """Fold one sample (in time order) into a rollup bucket dict.
+    count: reports it stands for (the end of a deadband run stands for all
+    but the first)"""
+    if bucket is None:
+        return {'first_ts': ts, 'last_ts': ts, 'first_mb': size_mb, 'last_mb': size_mb,
+                'max_mb': size_mb, 'sample_count': count, 'growth_mb': 0}
+    # Same accumulation as DiskUsage._calc_positive_growth
+    diff = size_mb - bucket['last_mb']
+    if diff > 0:
+        bucket['growth_mb'] += diff
+    bucket['last_ts'] = ts
+    bucket['last_mb'] = size_mb
+    bucket['max_mb'] = max(bucket['max_mb'], size_mb)
+    bucket['sample_count'] += count
+    return bucket
+
+
+def _save_rows(cursor, table, rows):
+    """Upsert rollup rows given as tuples in _ROLLUP_COLUMNS order"""
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(_ROLLUP_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(_ROLLUP_COLUMNS))})",
+        rows
+    )
+
+
+def _save_buckets(cursor, table, buckets):
+    """Upsert (key, bucket_ts, bucket dict) rollup rows"""
+    _save_rows(cursor, table, [
+        (*key, bucket_ts, b['first_ts'], b['last_ts'], b['first_mb'], b['last_mb'],
+         b['max_mb'], b['sample_count'], b['growth_mb'])
+        for key, bucket_ts, b in buckets
+    ])
+
+
+def compacted_before(cursor):
+    """Raw samples before this epoch may have been deleted by retention (0: none)"""
+    cursor.execute("SELECT before_ts FROM retention_watermark WHERE tier = 'disk_usage'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _bucket_from_raw(cursor, key, start, end):
+    """Recompute one bucket from disk_usage (used for out-of-order samples)"""
+    cursor.execute(_RANGE_POINTS_SQL, (*key, start, end, start))
+    points = []
+    for ts, size_mb, last_seen, sample_count in cursor.fetchall():
+        if last_seen is None:
+            points.append((ts, size_mb, sample_count))
+            continue
+        points.extend((t, size_mb, count) for t, count in _run_samples(ts, last_seen, sample_count)
+                      if start <= t < end)
+    points.sort()  # a late sample may lie within a run
+    bucket = None
+    for ts, size_mb, count in points:
+        bucket = _fold(bucket, ts, size_mb, count)
+    return bucket
+
+
+def _apply_rollups(cursor, samples):
+    """Fold samples just inserted into disk_usage into every rollup table.
+    samples: (site, sub_site, server_type, ts, size_mb) tuples in insert order.
+    Must run in the inserting transaction, after the INSERT took the write lock.
+    """
+    # Primary key order: samples sharing a timestamp are ordered by size, and
+    # exact duplicates are stored once. A duplicate of a stored sample is never
+    # newer than its bucket, so the late path below recomputes that bucket.
+    ordered = sorted(set(samples), key=lambda s: (s[:3], s[3], s[4]))
+    watermark = None
+    for table, bounds in ROLLUPS.items():
+        groups = {}
+        for site, sub_site, server_type, ts, size_mb in ordered:
+            start, end = bounds(ts)
+            groups.setdefault(((site, sub_site, server_type), start, end), []).append((ts, size_mb))
         
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                environment TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        buckets = []
+        for (key, start, end), points in groups.items():
+            cursor.execute(
+                f'SELECT * FROM {table} WHERE site = ? AND sub_site = ? AND server_type = ? AND bucket_ts = ?',
+                (*key, start)
             )
+            row = cursor.fetchone()
+            bucket = dict(row) if row else None
+            if bucket is not None and points[0][0] <= bucket['last_ts']:
+                # Late (or same-second) sample: carrying forward would misorder deltas
+                if watermark is None:
+                    watermark = compacted_before(cursor)
+                if start < watermark:
+                    continue  # compacted bucket, its raw samples are gone
+                bucket = _bucket_from_raw(cursor, key, start, end)
+            else:
+                for ts, size_mb in points:
+                    bucket = _fold(bucket, ts, size_mb)
+            buckets.append((key, start, bucket))
+        _save_buckets(cursor, table, buckets)
+
+
+# Samples fetched per step while rebuilding, so the table is never loaded whole
+REBUILD_FETCH_ROWS = 10000
+
+
+def _rebuild_series(cursor, key, timestamps, sizes, counts, ordered):
+    """Write every rollup of one series from its samples in time order
+    (runs expanded by _run_samples, see rebuild_rollups)"""
+    if not ordered:
+        # A sample lies within a run: put the series back in time order
+        order = sorted(range(len(timestamps)), key=lambda i: (timestamps[i], sizes[i]))
+        timestamps, sizes, counts = (array(column.typecode, (column[i] for i in order))
+                                     for column in (timestamps, sizes, counts))
+    series = array('q', bytes(8 * len(timestamps)))  # all index 0
+    for table, starts in _ROLLUP_STARTS.items():
+        stats = segment_stats(series, starts(timestamps), timestamps, sizes, counts)
+        _save_rows(cursor, table, [(*key, *row[1:]) for row in zip(*stats)])
+
+
+def rebuild_rollups(cursor):
+    """Recompute every rollup table from disk_usage in one ordered scan,
+    one series at a time. Buckets before the retention watermark are kept
+    as they are."""
+    watermark = compacted_before(cursor)
+    for table in ROLLUPS:
+        cursor.execute(f'DELETE FROM {table} WHERE bucket_ts >= ?', (watermark,))
+    
+    # Series in key order, each one's samples in primary key order (a
+    # deadband run as its _run_samples). Read on a second cursor so
+    # each series' rollups are written while the scan goes on.
+    reader = cursor.connection.cursor()
+    reader.execute('''
+        SELECT s.site, s.sub_site, s.server_type, d.ts, d.size_mb, d.last_seen, d.sample_count
+        FROM series s JOIN samples d ON d.series_id = s.id
+        WHERE d.ts >= ?
+        ORDER BY s.site, s.sub_site, s.server_type, d.ts, d.size_mb
+    ''', (watermark,))
+    keys = []
+    timestamps, sizes, counts = array('q'), array('d'), array('q')
+    end = 0  # last_seen of the series' latest run so far
+    ordered = True
+    while True:
+        rows = reader.fetchmany(REBUILD_FETCH_ROWS)
+        for site, sub_site, server_type, ts, size_mb, last_seen, sample_count in rows:
+            if not keys or keys[-1] != (site, sub_site, server_type):
+                if keys:
+                    _rebuild_series(cursor, keys[-1], timestamps, sizes, counts, ordered)
+                keys.append((site, sub_site, server_type))
+                timestamps, sizes, counts = array('q'), array('d'), array('q')
+                end = 0
+                ordered = True
+            ordered = ordered and ts >= end
+            if last_seen is None:
+                timestamps.append(ts)
+                sizes.append(size_mb)
+                counts.append(sample_count)
+            else:
+                for t, count in _run_samples(ts, last_seen, sample_count):
+                    timestamps.append(t)
+                    sizes.append(size_mb)
+                    counts.append(count)
+                end = last_seen
+        if not rows:
+            break
+    if keys:
+        _rebuild_series(cursor, keys[-1], timestamps, sizes, counts, ordered)
+    
+    # Derived data may have changed for any server
+    _bump_versions(cursor, keys, all_servers=True)
+
+
+# ==================== Data Versions ====================
+# data_version has one row per server plus the environment row ('', '', '').
+# Every ingest transaction bumps the environment version and stamps it on the
+# servers it touched, so versions only ever increase and can serve as ETags.
+
+_ENV_KEY = ('', '', '')
+
+
+def _bump_versions(cursor, keys, all_servers=False):
+    """Advance the environment version and assign it to the given servers
+    (or to every known server). Returns the new version."""
+    now = int(time.time())
+    cursor.execute('''
+        INSERT INTO data_version (site, sub_site, server_type, version, updated_at)
+        VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT (site, sub_site, server_type)
+        DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+    ''', (*_ENV_KEY, now))
+    cursor.execute(
+        'SELECT version FROM data_version WHERE site = ? AND sub_site = ? AND server_type = ?',
+        _ENV_KEY
+    )
+    version = cursor.fetchone()[0]
+    if all_servers:
+        cursor.execute('UPDATE data_version SET version = ?, updated_at = ?', (version, now))
+    cursor.executemany(
+        'INSERT OR REPLACE INTO data_version (site, sub_site, server_type, version, updated_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [(*key, version, now) for key in set(keys)]
+    )
+    return version
+
+
+def _growth_value(growth_mb):
+    """Rounded growth, 0 (int) when there was no increase - as _calc_positive_growth returns"""
+    return round(growth_mb, 2) if growth_mb > 0 else 0
+
+
+def create_tables(cursor):
+    """Create tables and indexes if they don't exist"""
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            environment TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Bumped by triggers on any users change (init_db, update_passwords, manual
+    # SQL) so every process knows when to reload its UserRegistry
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO users_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_{event.lower()}_version AFTER {event} ON users
+            BEGIN
+                UPDATE users_version SET version = version + 1 WHERE id = 1;
+            END
         ''')
-        
-        # Disk usage records table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS disk_usage (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+    
+    # Disk usage samples (ts = UTC epoch seconds), see "Series" above
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS series (
+            id INTEGER PRIMARY KEY,
+            site TEXT NOT NULL,
+            sub_site TEXT NOT NULL,
+            server_type TEXT NOT NULL,
+            path TEXT NOT NULL,
+            UNIQUE (site, sub_site, server_type)
+        )
+    ''')
+    # Every per-server time range query is a range scan of the primary key.
+    # last_seen / sample_count: see "Deadband" above (NULL / 1 for one sample)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS samples (
+            series_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            size_mb REAL NOT NULL,
+            last_seen INTEGER,
+            sample_count INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (series_id, ts, size_mb)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS disk_usage AS
+        SELECT s.site, s.sub_site, s.server_type, s.path, d.size_mb, d.ts
+        FROM samples d JOIN series s ON s.id = d.series_id
+    ''')
+    # Writes through the view (rollups are not maintained; run
+    # tools/rebuild_rollups.py after inserting this way)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS disk_usage_insert INSTEAD OF INSERT ON disk_usage
+        BEGIN
+            INSERT INTO series (site, sub_site, server_type, path)
+            VALUES (NEW.site, NEW.sub_site, NEW.server_type, NEW.path)
+            ON CONFLICT (site, sub_site, server_type) DO NOTHING;
+            INSERT OR IGNORE INTO samples (series_id, ts, size_mb)
+            SELECT id, COALESCE(NEW.ts, CAST(strftime('%s', 'now') AS INTEGER)), NEW.size_mb FROM series
+            WHERE site = NEW.site AND sub_site = NEW.sub_site AND server_type = NEW.server_type;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS disk_usage_delete INSTEAD OF DELETE ON disk_usage
+        BEGIN
+            DELETE FROM samples WHERE ts = OLD.ts AND size_mb = OLD.size_mb AND series_id = (
+                SELECT id FROM series
+                WHERE site = OLD.site AND sub_site = OLD.sub_site AND server_type = OLD.server_type
+            );
+        END
+    ''')
+    
+    # Rollups per server and UTC hour / day / month (bucket_ts = bucket start).
+    # growth_mb is the cumulative positive delta between samples in the bucket.
+    for table in ROLLUPS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
                 site TEXT NOT NULL,
                 sub_site TEXT NOT NULL,
                 server_type TEXT NOT NULL,
-                path TEXT NOT NULL,
-                size_mb REAL NOT NULL,
-                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                bucket_ts INTEGER NOT NULL,
+                first_ts INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL,
+                first_mb REAL NOT NULL,
+                last_mb REAL NOT NULL,
+                max_mb REAL NOT NULL,
+                sample_count INTEGER NOT NULL,
+                growth_mb REAL NOT NULL,
+                PRIMARY KEY (site, sub_site, server_type, bucket_ts)
             )
         ''')
+    
+    # Monotonic change counters per server and per environment ('', '', '')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            site TEXT NOT NULL,
+            sub_site TEXT NOT NULL,
+            server_type TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (site, sub_site, server_type)
+        )
+    ''')
+    
+    # Random id of this database file, so results cached for another file
+    # (a replaced database, benchmark copies) never match its data versions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_epoch (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO data_epoch (id, epoch) VALUES (1, random())')
+    
+    # Retention: rows of `tier` older than before_ts may have been deleted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS retention_watermark (
+            tier TEXT PRIMARY KEY,
+            before_ts INTEGER NOT NULL
+        )
+    ''')
+
+
+def init_db():
+    """Initialize database tables for both test and production environments"""
+    for env in ['test', 'production']:
+        conn = get_db_connection(env)
+        cursor = conn.cursor()
         
-        # Create index for faster queries
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_disk_usage_lookup 
-            ON disk_usage (site, sub_site, server_type, recorded_at)
-        ''')
-        
+        create_tables(cursor)
         conn.commit()
         
         
@@ -84,74 +790,363 @@ class User:
         self.is_anonymous = False
     
     def get_id(self):
-        return str(self.id)
+        # ids restart in every environment's database, so qualify them
+        return f'{self.environment}:{self.id}'
     
     @staticmethod
-    def get_by_id(user_id):
-        # Try both environments
-        for env in ['test', 'production']:
-            conn = get_db_connection(env)
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, environment FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
-            conn.close()
+    def get_by_id(user_id, environment=None):
+        """Look up a user by id; without environment, test is tried first"""
+        for env in ([environment] if environment else UserRegistry.ENVIRONMENTS):
+            row = user_registry.get(env, user_id)
             if row:
                 return User(row['id'], row['username'], row['environment'])
         return None
     
+    @staticmethod
+    def _resolve(username):
+        """The one users row a username logs in as: the environment it is
+        configured for in USERS_CONFIG, else the first found (test first)"""
+        rows = user_registry.find(username)
+        configured = [cfg['environment'] for cfg in USERS_CONFIG.values() if cfg['username'] == username]
+        for row in rows:
+            if row['environment'] in configured:
+                return row
+        return rows[0] if rows else None
+    
     @staticmethod
     def get_by_username(username):
-        # Try both environments
-        for env in ['test', 'production']:
+        row = User._resolve(username)
+        return User(row['id'], row['username'], row['environment']) if row else None
+    
+    @staticmethod
+    def verify_password(username, password):
+        # At most one hash check per attempt, none for unknown usernames
+        row = User._resolve(username)
+        if row and check_password_hash(row['password_hash'], password):
+            return User(row['id'], row['username'], row['environment'])
+        return None
+
+
+class UserRegistry:
+    """In-memory copy of the users tables of both environments.
+
+    Lookups cost no I/O. At most every check_seconds a lookup reads
+    users_version (bumped by triggers on every users change) from each
+    database and reloads when any of them moved.
+    """
+    
+    ENVIRONMENTS = ('test', 'production')  # lookup order for unqualified ids / names
+    
+    def __init__(self, check_seconds=5):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._versions = None
+        self._by_id = {}
+        self._by_username = {}
+        self._checked = 0
+    
+    def _read_versions(self):
+        versions = {}
+        for env in self.ENVIRONMENTS:
             conn = get_db_connection(env)
             cursor = conn.cursor()
-            cursor.execute('SELECT id, username, environment FROM users WHERE username = ?', (username,))
+            cursor.execute('SELECT version FROM users_version WHERE id = 1')
             row = cursor.fetchone()
             conn.close()
-            if row:
-                return User(row['id'], row['username'], row['environment'])
-        return None
+            versions[env] = row[0] if row else 0
+        return versions
     
-    @staticmethod
-    def verify_password(username, password):
-        # Try both environments
-        for env in ['test', 'production']:
+    def _load(self, versions):
+        by_id, by_username = {}, {}
+        for env in self.ENVIRONMENTS:
             conn = get_db_connection(env)
             cursor = conn.cursor()
-            cursor.execute('SELECT id, username, password_hash, environment FROM users WHERE username = ?', (username,))
-            row = cursor.fetchone()
+            cursor.execute('SELECT id, username, password_hash, environment FROM users')
+            for row in cursor.fetchall():
+                user = dict(row)
+                by_id[(env, user['id'])] = user
+                by_username.setdefault(user['username'], []).append(user)
             conn.close()
-            if row and check_password_hash(row['password_hash'], password):
-                return User(row['id'], row['username'], row['environment'])
-        return None
+        self._by_id, self._by_username, self._versions = by_id, by_username, versions
+    
+    def refresh(self, force=True):
+        """Reload the users (with force=False only if a users table changed)"""
+        with self._lock:
+            versions = self._read_versions()
+            if force or versions != self._versions:
+                self._load(versions)
+            self._checked = time.monotonic()
+    
+    def _ensure_current(self):
+        if self._versions is None or time.monotonic() - self._checked >= self.check_seconds:
+            self.refresh(force=self._versions is None)
+    
+    def get(self, environment, user_id):
+        self._ensure_current()
+        try:
+            return self._by_id.get((environment, int(user_id)))
+        except (TypeError, ValueError):
+            return None
+    
+    def find(self, username):
+        """Users with this name, test environment first"""
+        self._ensure_current()
+        return self._by_username.get(username, [])
+
+
+user_registry = UserRegistry(check_seconds=USER_REGISTRY_CHECK_SECONDS)
+
+
+# Per-server queries; each is a range scan over the samples primary key
+_SERIES_ID = '(SELECT id FROM series WHERE site = ? AND sub_site = ? AND server_type = ?)'
+
+_LATEST_SQL = f'''
+    SELECT size_mb, datetime(COALESCE(last_seen, ts), 'unixepoch') AS recorded_at FROM samples
+    WHERE series_id = {_SERIES_ID}
+    ORDER BY ts DESC
+    LIMIT 1
+'''
+
+# Runs never cross a day, so one that ends after `since` starts within the
+# day before it
+_HISTORY_SQL = f'''
+    SELECT ts, size_mb, datetime(ts, 'unixepoch'), last_seen, datetime(last_seen, 'unixepoch') FROM samples
+    WHERE series_id = {_SERIES_ID}
+    AND ts > ? - 86400 AND COALESCE(last_seen, ts) >= ?
+    ORDER BY ts ASC
+'''
+
+_HISTORY_POINTS_SQL = f'''
+    SELECT ts, size_mb, last_seen FROM samples
+    WHERE series_id = {_SERIES_ID}
+    AND ts > ? - 86400 AND COALESCE(last_seen, ts) >= ?
+    ORDER BY ts ASC
+'''
+
+# Fields of a summary entry, the columns of the columnar summary
+SUMMARY_FIELDS = ('site', 'sub_site', 'server_type', 'size_mb', 'recorded_at', 'growth_30d', 'monthly_avg_growth')
+
+
+def _history_columns(points):
+    """(ts, size_mb) pairs -> columnar history"""
+    if not points:
+        return {'recorded_at': [], 'size_mb': []}
+    timestamps, sizes = zip(*points)
+    return {'recorded_at': list(timestamps), 'size_mb': list(sizes)}
+
+
+_DAILY_POINTS_SQL = '''
+    SELECT first_ts, first_mb, last_ts, last_mb, max_mb FROM disk_usage_daily
+    WHERE site = ? AND sub_site = ? AND server_type = ?
+    AND bucket_ts >= ?
+    ORDER BY bucket_ts ASC
+'''
+
+_HOURLY_POINTS_SQL = '''
+    SELECT first_ts, first_mb, last_ts, last_mb, max_mb FROM disk_usage_hourly
+    WHERE site = ? AND sub_site = ? AND server_type = ?
+    AND bucket_ts >= ? AND bucket_ts < ?
+    ORDER BY bucket_ts ASC
+'''
+
+
+def _bucket_points(rows, since, before=float('inf')):
+    """(first_ts, first_mb, last_ts, last_mb, max_mb) rollup rows -> (ts, size_mb)
+    points within [since, before): first and last sample of each bucket, and
+    its peak when that lies between them. Rollups keep no time for the peak,
+    so it is placed halfway."""
+    points = []
+    for first_ts, first_mb, last_ts, last_mb, max_mb in rows:
+        if since <= first_ts < before:
+            points.append((first_ts, first_mb))
+        if max_mb > first_mb and max_mb > last_mb:
+            # halfway keeps the points in time order
+            peak_ts = (first_ts + last_ts) // 2
+            if since <= peak_ts < before:
+                points.append((peak_ts, max_mb))
+        if last_ts != first_ts and since <= last_ts < before:
+            points.append((last_ts, last_mb))
+    return points
+
+
+def _compacted_points(cursor, key, since, before):
+    """History points in [since, before) from the rollups, for the range
+    whose raw samples retention deleted: _bucket_points of every hour, and of
+    every day older than the oldest hourly bucket"""
+    cursor.execute(_HOURLY_POINTS_SQL, (*key, since - since % 3600, before))
+    hourly = _bucket_points(cursor.fetchall(), since, before)
+    cutoff = hourly[0][0] if hourly else before
+    cursor.execute(_DAILY_POINTS_SQL, (*key, since - since % 86400))
+    return _bucket_points(cursor.fetchall(), since, cutoff) + hourly
+
+# Rows with a sample in [start, end): runs starting up to a day earlier may end in it
+_RANGE_POINTS_SQL = f'''
+    SELECT ts, size_mb, last_seen, sample_count FROM samples
+    WHERE series_id = {_SERIES_ID}
+    AND ts > ? - 86400 AND ts < ? AND COALESCE(last_seen, ts) >= ?
+    ORDER BY ts ASC, size_mb ASC
+'''
+
+_MONTHLY_ROLLUP_SQL = '''
+    SELECT bucket_ts, max_mb, growth_mb FROM disk_usage_monthly
+    WHERE site = ? AND sub_site = ? AND server_type = ?
+    ORDER BY bucket_ts DESC
+    LIMIT ?
+'''
+
+_MONTH_GROWTH_SQL = '''
+    SELECT growth_mb FROM disk_usage_monthly
+    WHERE site = ? AND sub_site = ? AND server_type = ? AND bucket_ts = ?
+'''
+
+
+# Summary and growth results per environment / server, see DiskUsage._cached
+_query_cache = VersionedCache('queries', maxsize=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL_SECONDS)
 
 
 class DiskUsage:
     """Disk usage record model"""
     
     @staticmethod
-    def record(site, sub_site, server_type, path, size_mb, environment='production'):
-        """Record a new disk usage entry"""
+    @instrumented
+    def record(site, sub_site, server_type, path, size_mb, environment='production', recorded_at=None):
+        """Record a new disk usage entry (recorded_at defaults to now).
+        Returns False when the same sample is already stored (a retried report)
+        or lies before the retention watermark, whose rollups are final."""
+        ts = to_epoch(recorded_at) if recorded_at is not None else int(time.time())
+        conn = get_db_connection(environment)
+        cursor = conn.cursor()
+        added = []
+        try:
+            stored_mb = None
+            if ts >= compacted_before(cursor):
+                series_id = _series_id(cursor, environment, site, sub_site, server_type, path, added)
+                stored_mb = _store_sample(cursor, environment, series_id, ts, size_mb,
+                                          deadband_tolerance(site, sub_site, server_type))
+            stored = stored_mb is not None
+            if stored:
+                _apply_rollups(cursor, [(site, sub_site, server_type, ts, stored_mb)])
+                _bump_versions(cursor, [(site, sub_site, server_type)])
+            timed(ingest_commit_seconds, conn.commit)
+        except Exception:
+            conn.rollback()
+            _forget_series(added)
+            raise
+        finally:
+            conn.close()
+        return stored
+    
+    @staticmethod
+    @instrumented
+    def record_many(reports, environment='production', stored_reports=None):
+        """Record many disk usage entries in a single transaction.
+        reports: iterable of dicts with site, sub_site, server_type, path, size_mb
+        and optionally recorded_at, or received_at (when the ingest queue took
+        a report without recorded_at); both default to now
+        Samples already stored (the series, recorded_at and size_mb of a
+        retried report) and samples before the retention watermark are
+        skipped. Returns the number of samples stored; the reports they came
+        from are appended to stored_reports when a list is given.
+        """
+        now = int(time.time())
+        rows, single = [], []
+        for r in reports:
+            stamped = r.get('recorded_at') is not None
+            row = (r['site'], r['sub_site'], r['server_type'], r['path'], r['size_mb'],
+                   to_epoch(r['recorded_at']) if stamped else r.get('received_at', now), r)
+            tolerance = deadband_tolerance(*row[:3])
+            if stamped or tolerance is not None:
+                single.append((row, tolerance))
+            else:
+                rows.append(row)
+        if not rows and not single:
+            return 0
+        conn = get_db_connection(environment)
+        cursor = conn.cursor()
+        added = []
+        try:
+            watermark = compacted_before(cursor)
+            if watermark:
+                rows = [r for r in rows if r[5] >= watermark]
+                single = [(r, tolerance) for r, tolerance in single if r[5] >= watermark]
+            cursor.executemany(
+                'INSERT OR IGNORE INTO samples (series_id, ts, size_mb) VALUES (?, ?, ?)',
+                [(_series_id(cursor, environment, *r[:4], added=added), r[5], r[4]) for r in rows]
+            )
+            stored = max(cursor.rowcount, 0)
+            samples = [(r[0], r[1], r[2], r[5], r[4]) for r in rows]
+            if stored_reports is not None:
+                # Stamped on receipt: only a repeat of a report in this batch was ignored
+                seen = set()
+                for r in rows:
+                    if r[:6] not in seen:
+                        seen.add(r[:6])
+                        stored_reports.append(r[6])
+            # Reports with their own timestamp may be retries, and deadband reports
+            # may extend a run: store them one by one so a sample that is already
+            # stored does not touch rollups or versions
+            for r, tolerance in single:
+                series_id = _series_id(cursor, environment, *r[:4], added=added)
+                stored_mb = _store_sample(cursor, environment, series_id, r[5], r[4], tolerance)
+                if stored_mb is not None:
+                    samples.append((r[0], r[1], r[2], r[5], stored_mb))
+                    stored += 1
+                    if stored_reports is not None:
+                        stored_reports.append(r[6])
+            if samples:
+                _apply_rollups(cursor, samples)
+                _bump_versions(cursor, [s[:3] for s in samples])
+            timed(ingest_commit_seconds, conn.commit)
+        except Exception:
+            conn.rollback()
+            _forget_series(added)
+            raise
+        finally:
+            conn.close()
+        return stored
+    
+    @staticmethod
+    @instrumented
+    def get_version(environment='production', site='', sub_site='', server_type=''):
+        """(version, updated_at epoch) of one server, or of the whole environment
+        when no server is given. (0, 0) before anything was recorded."""
+        conn = get_db_connection(environment)
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT version, updated_at FROM data_version WHERE site = ? AND sub_site = ? AND server_type = ?',
+            (site, sub_site, server_type)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return (row['version'], row['updated_at']) if row else (0, 0)
+    
+    @staticmethod
+    def _cached(environment, key, compute, server=_ENV_KEY):
+        """compute() through the query cache. The result stays valid while the
+        database epoch, the data version of `server` (default: the whole
+        environment) and the UTC month are unchanged. Callers get copies of
+        the cached rows."""
         conn = get_db_connection(environment)
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO disk_usage (site, sub_site, server_type, path, size_mb)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (site, sub_site, server_type, path, size_mb))
-        conn.commit()
+            SELECT e.epoch, COALESCE(v.version, 0) FROM data_epoch e
+            LEFT JOIN data_version v ON v.site = ? AND v.sub_site = ? AND v.server_type = ?
+        ''', server)
+        epoch, version = cursor.fetchone()
         conn.close()
+        tag = (epoch, version, current_month())
+        value = _query_cache.get_or_compute((environment, *key), tag, compute)
+        if isinstance(value, dict):
+            return {k: list(v) if isinstance(v, list) else v for k, v in value.items()}
+        return [dict(item) for item in value]
     
     @staticmethod
+    @instrumented
     def get_latest(site, sub_site, server_type, environment='production'):
         """Get the latest disk usage record"""
         conn = get_db_connection(environment)
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT size_mb, recorded_at FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            ORDER BY recorded_at DESC
-            LIMIT 1
-        ''', (site, sub_site, server_type))
+        cursor.execute(_LATEST_SQL, (site, sub_site, server_type))
         row = cursor.fetchone()
         conn.close()
         if row:
@@ -159,171 +1154,278 @@ class DiskUsage:
         return None
     
     @staticmethod
-    def get_history(site, sub_site, server_type, days=30, environment='production'):
-        """Get disk usage history for the past N days"""
+    @instrumented
+    def get_history(site, sub_site, server_type, days=30, environment='production', points=None,
+                    columnar=False):
+        """Get disk usage history for the past N days.
+        With points, return at most that many samples chosen by LTTB. When the
+        daily rollups (first and last sample of each day) already provide that
+        many, they are downsampled instead of the raw samples.
+        Before the retention watermark, where raw samples were deleted, the
+        first and last sample of each hourly (or daily) rollup stand in.
+        columnar: {'recorded_at': [epoch, ...], 'size_mb': [...]} instead of
+        one dict per sample.
+        """
         conn = get_db_connection(environment)
         cursor = conn.cursor()
-        since = datetime.now() - timedelta(days=days)
-        cursor.execute('''
-            SELECT size_mb, recorded_at FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            AND recorded_at >= ?
-            ORDER BY recorded_at ASC
-        ''', (site, sub_site, server_type, since.isoformat()))
-        rows = cursor.fetchall()
+        since = int(time.time() - days * 86400)
+        key = (site, sub_site, server_type)
+        watermark = compacted_before(cursor)
+        compacted = _compacted_points(cursor, key, since, watermark) if watermark and since < watermark else []
+        raw_since = max(since, watermark)
+        if points is None and columnar:
+            cursor.row_factory = None
+            cursor.execute(_HISTORY_POINTS_SQL, (*key, raw_since, raw_since))
+            rows = cursor.fetchall()
+            conn.close()
+            return _history_columns(compacted + _run_points(rows, raw_since))
+        if points is None:
+            cursor.row_factory = None
+            cursor.execute(_HISTORY_SQL, (*key, raw_since, raw_since))
+            rows = cursor.fetchall()
+            conn.close()
+            since = raw_since
+            # As _run_points, keeping the recorded_at strings SQLite formatted
+            history, end, ordered = [], 0, True
+            for ts, size_mb, recorded_at, last_seen, last_seen_at in rows:
+                ordered = ordered and ts >= end
+                if ts >= since:
+                    history.append((ts, size_mb, recorded_at))
+                elif last_seen is not None and last_seen > since:
+                    history.append((since, size_mb, format_ts(since)))
+                if last_seen is not None:
+                    history.append((last_seen, size_mb, last_seen_at))
+                    end = last_seen
+            if not ordered:
+                history.sort()
+            return ([{'size_mb': size_mb, 'recorded_at': format_ts(ts)} for ts, size_mb in compacted] +
+                    [{'size_mb': size_mb, 'recorded_at': recorded_at} for _, size_mb, recorded_at in history])
+        
+        cursor.execute(_DAILY_POINTS_SQL, (*key, since - since % 86400))
+        series = _bucket_points(cursor.fetchall(), since)
+        if len(series) < points:
+            cursor.execute(_HISTORY_POINTS_SQL, (*key, raw_since, raw_since))
+            series = compacted + _run_points(cursor.fetchall(), raw_since)
         conn.close()
-        return [{'size_mb': row['size_mb'], 'recorded_at': row['recorded_at']} for row in rows]
+        if columnar:
+            return _history_columns(lttb(series, points))
+        return [{'size_mb': size_mb, 'recorded_at': format_ts(ts)} for ts, size_mb in lttb(series, points)]
     
     @staticmethod
     def _calc_positive_growth(data_points):
         """Calculate cumulative positive deltas from ordered data points.
         Only sums increases, ignoring decreases (deletions).
         """
-        growth = 0
-        for i in range(1, len(data_points)):
-            diff = data_points[i] - data_points[i - 1]
-            if diff > 0:
-                growth += diff
-        return round(growth, 2)
+        return round(positive_growth(data_points), 2)
 
     @staticmethod
+    def _month_growth(cursor, site, sub_site, server_type, month):
+        """Positive-delta growth of one server within one month"""
+        cursor.execute(_MONTH_GROWTH_SQL, (site, sub_site, server_type, month_range(month)[0]))
+        row = cursor.fetchone()
+        return _growth_value(row['growth_mb']) if row else 0
+
+    @staticmethod
+    @instrumented
     def get_monthly_growth(site, sub_site, server_type, environment='production'):
         """Calculate monthly growth statistics using cumulative positive deltas"""
-        conn = get_db_connection(environment)
-        cursor = conn.cursor()
-        
-        # Get all data points ordered by time
-        cursor.execute('''
-            SELECT 
-                strftime('%Y-%m', recorded_at) as month,
-                size_mb
-            FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            ORDER BY recorded_at ASC
-        ''', (site, sub_site, server_type))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # Group data points by month
-        monthly_points = {}
-        for row in rows:
-            month = row['month']
-            if month not in monthly_points:
-                monthly_points[month] = []
-            monthly_points[month].append(row['size_mb'])
-        
-        # Calculate growth for each month using positive deltas
-        monthly_data = []
-        for month in sorted(monthly_points.keys(), reverse=True)[:12]:
-            points = monthly_points[month]
-            growth = DiskUsage._calc_positive_growth(points)
-            monthly_data.append({
-                'month': month,
-                'growth_mb': growth,
-                'max_size_mb': max(points)
-            })
-        
-        return monthly_data
+        def compute():
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
+            cursor.execute(_MONTHLY_ROLLUP_SQL, (site, sub_site, server_type, 12))
+            rows = cursor.fetchall()
+            conn.close()
+            
+            return [{
+                'month': time.strftime('%Y-%m', time.gmtime(row['bucket_ts'])),
+                'growth_mb': _growth_value(row['growth_mb']),
+                'max_size_mb': row['max_mb']
+            } for row in rows]
+        return DiskUsage._cached(environment, ('monthly', site, sub_site, server_type), compute,
+                                 server=(site, sub_site, server_type))
     
     @staticmethod
+    @instrumented
     def get_current_and_previous_month_growth(site, sub_site, server_type, environment='production'):
         """Get current month and previous month growth using cumulative positive deltas"""
-        conn = get_db_connection(environment)
-        cursor = conn.cursor()
-        
-        now = datetime.now()
-        current_month = now.strftime('%Y-%m')
-        
-        # Calculate previous month
-        if now.month == 1:
-            prev_month = f"{now.year - 1}-12"
-        else:
-            prev_month = f"{now.year}-{now.month - 1:02d}"
-        
-        # Get current month data points ordered by time
-        cursor.execute('''
-            SELECT size_mb
-            FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            AND strftime('%Y-%m', recorded_at) = ?
-            ORDER BY recorded_at ASC
-        ''', (site, sub_site, server_type, current_month))
-        current_points = [row['size_mb'] for row in cursor.fetchall()]
-        current_growth = DiskUsage._calc_positive_growth(current_points)
-        
-        # Get previous month data points ordered by time
-        cursor.execute('''
-            SELECT size_mb
-            FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            AND strftime('%Y-%m', recorded_at) = ?
-            ORDER BY recorded_at ASC
-        ''', (site, sub_site, server_type, prev_month))
-        previous_points = [row['size_mb'] for row in cursor.fetchall()]
-        previous_growth = DiskUsage._calc_positive_growth(previous_points)
-        
-        conn.close()
-        
-        return {
-            'current_month': current_month,
-            'current_month_growth': current_growth,
-            'previous_month': prev_month,
-            'previous_month_growth': previous_growth
-        }
+        def compute():
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
+            
+            cur_month = current_month()
+            prev_month = previous_month(cur_month)
+            
+            current_growth = DiskUsage._month_growth(cursor, site, sub_site, server_type, cur_month)
+            previous_growth = DiskUsage._month_growth(cursor, site, sub_site, server_type, prev_month)
+            
+            conn.close()
+            
+            return {
+                'current_month': cur_month,
+                'current_month_growth': current_growth,
+                'previous_month': prev_month,
+                'previous_month_growth': previous_growth
+            }
+        return DiskUsage._cached(environment, ('month_pair', site, sub_site, server_type), compute,
+                                 server=(site, sub_site, server_type))
     
     @staticmethod
+    @instrumented
     def get_30day_growth(site, sub_site, server_type, environment='production'):
         """Calculate current month's production using cumulative positive deltas.
         The total overview = sum of each server's monthly production.
         """
         conn = get_db_connection(environment)
         cursor = conn.cursor()
+        growth = DiskUsage._month_growth(cursor, site, sub_site, server_type, current_month())
+        conn.close()
+        return growth
+    
+    @staticmethod
+    def _summarize(cursor, since_version=None, timestamp=format_ts):
+        """Summary entries from the monthly rollups; with since_version only
+        servers whose data_version is newer, each carrying its 'version'.
+        timestamp converts the epoch of each server's last sample to recorded_at."""
+        this_month = month_range(current_month())[0]
         
-        current_month = datetime.now().strftime('%Y-%m')
+        # Newest month first within each server (primary key order, reversed per server)
+        if since_version is None:
+            cursor.execute('''
+                SELECT site, sub_site, server_type, bucket_ts, last_ts, last_mb, growth_mb, NULL
+                FROM disk_usage_monthly
+                ORDER BY site, sub_site, server_type, bucket_ts DESC
+            ''')
+        else:
+            cursor.execute('''
+                SELECT m.site, m.sub_site, m.server_type, m.bucket_ts, m.last_ts, m.last_mb,
+                       m.growth_mb, v.version
+                FROM data_version v
+                JOIN disk_usage_monthly m
+                    ON m.site = v.site AND m.sub_site = v.sub_site AND m.server_type = v.server_type
+                WHERE v.version > ?
+                ORDER BY m.site, m.sub_site, m.server_type, m.bucket_ts DESC
+            ''', (since_version,))
         
-        # Get all data points in the current month, ordered by time
-        cursor.execute('''
-            SELECT size_mb FROM disk_usage
-            WHERE site = ? AND sub_site = ? AND server_type = ?
-            AND strftime('%Y-%m', recorded_at) = ?
-            ORDER BY recorded_at ASC
-        ''', (site, sub_site, server_type, current_month))
-        rows = cursor.fetchall()
+        summary = []
+        months = []
+        for site, sub_site, server_type, bucket_ts, last_ts, last_mb, growth_mb, version in cursor.fetchall():
+            growth = _growth_value(growth_mb)
+            if not summary or (site, sub_site, server_type) != (
+                    summary[-1]['site'], summary[-1]['sub_site'], summary[-1]['server_type']):
+                months = []
+                summary.append({
+                    'site': site,
+                    'sub_site': sub_site,
+                    'server_type': server_type,
+                    'size_mb': last_mb,
+                    'recorded_at': timestamp(last_ts),
+                    'growth_30d': growth if bucket_ts == this_month else 0,
+                    'monthly_avg_growth': 0
+                })
+                if version is not None:
+                    summary[-1]['version'] = version
+            if len(months) < 12:
+                months.append(growth)
+                summary[-1]['monthly_avg_growth'] = round(sum(months) / len(months), 2)
+        return summary
+    
+    @staticmethod
+    @instrumented
+    def get_summary_with_growth(environment='production', columnar=False):
+        """Get latest size, current month growth and 12-month average growth
+        for every server from the monthly rollups in one ordered scan.
+
+        Equivalent to get_all_sites_summary() enriched with get_30day_growth()
+        and the average of get_monthly_growth(), without per-server queries.
+        columnar: one list per field (SUMMARY_FIELDS), recorded_at as epoch seconds.
+        """
+        def compute():
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            if columnar:
+                summary = timed(summary_compute_seconds, DiskUsage._summarize, cursor, None, int)
+                summary = {field: [entry[field] for entry in summary] for field in SUMMARY_FIELDS}
+            else:
+                summary = timed(summary_compute_seconds, DiskUsage._summarize, cursor)
+            conn.close()
+            return summary
+        return DiskUsage._cached(environment, ('summary', 'columnar' if columnar else 'rows'), compute)
+    
+    @staticmethod
+    @instrumented
+    def get_changes_since(version, environment='production'):
+        """Servers changed after data version `version`, as summary entries
+        with their 'version', oldest change first.
+        Returns (current environment version, changes).
+        """
+        conn = get_db_connection(environment)
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        # Read both in one transaction so no change falls between them
+        cursor.execute('BEGIN')
+        cursor.execute(
+            'SELECT version FROM data_version WHERE site = ? AND sub_site = ? AND server_type = ?',
+            _ENV_KEY
+        )
+        row = cursor.fetchone()
+        changes = DiskUsage._summarize(cursor, version)
+        conn.commit()
+        conn.close()
+        changes.sort(key=lambda item: item['version'])
+        return (row[0] if row else 0), changes
+    
+    @staticmethod
+    @instrumented
+    def rebuild_rollups(environment='production'):
+        """Recompute the rollups from the raw samples (after the retention watermark)"""
+        conn = get_db_connection(environment)
+        cursor = conn.cursor()
+        rebuild_rollups(cursor)
+        conn.commit()
         conn.close()
-        
-        data_points = [row['size_mb'] for row in rows]
-        return DiskUsage._calc_positive_growth(data_points)
     
     @staticmethod
+    @instrumented
     def get_all_sites_summary(environment='production'):
         """Get summary for all sites and servers"""
+        def compute():
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
+            
+            # Get latest record for each site/sub_site/server combination
+            cursor.execute('''
+                SELECT 
+                    s.site, s.sub_site, s.server_type, d.size_mb,
+                    datetime(COALESCE(d.last_seen, d.ts), 'unixepoch') AS recorded_at
+                FROM series s
+                INNER JOIN samples d ON d.series_id = s.id
+                    AND d.ts = (SELECT MAX(ts) FROM samples WHERE series_id = s.id)
+                ORDER BY s.site, s.sub_site, s.server_type
+            ''')
+            
+            rows = cursor.fetchall()
+            conn.close()
+            
+            return [{
+                'site': row['site'],
+                'sub_site': row['sub_site'],
+                'server_type': row['server_type'],
+                'size_mb': row['size_mb'],
+                'recorded_at': row['recorded_at']
+            } for row in rows]
+        return DiskUsage._cached(environment, ('all_sites',), compute)
+    
+    @staticmethod
+    def get_report_times(environment='production'):
+        """(site, sub_site, server_type, last report epoch) of every server,
+        from the monthly rollups"""
         conn = get_db_connection(environment)
         cursor = conn.cursor()
-        
-        # Get latest record for each site/sub_site/server combination
         cursor.execute('''
-            SELECT 
-                d1.site, d1.sub_site, d1.server_type, d1.size_mb, d1.recorded_at
-            FROM disk_usage d1
-            INNER JOIN (
-                SELECT site, sub_site, server_type, MAX(recorded_at) as max_recorded
-                FROM disk_usage
-                GROUP BY site, sub_site, server_type
-            ) d2 ON d1.site = d2.site 
-                AND d1.sub_site = d2.sub_site 
-                AND d1.server_type = d2.server_type 
-                AND d1.recorded_at = d2.max_recorded
-            ORDER BY d1.site, d1.sub_site, d1.server_type
+            SELECT site, sub_site, server_type, MAX(last_ts) FROM disk_usage_monthly
+            GROUP BY site, sub_site, server_type
         ''')
-        
-        rows = cursor.fetchall()
+        rows = [tuple(row) for row in cursor.fetchall()]
         conn.close()
-        
-        return [{
-            'site': row['site'],
-            'sub_site': row['sub_site'],
-            'server_type': row['server_type'],
-            'size_mb': row['size_mb'],
-            'recorded_at': row['recorded_at']
-        } for row in rows]
+        return rows
@@ -0,0 +1,60 @@
+# Response encoding for the LogHive API: JSON or MessagePack, optionally compressed
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder produces the same documents, slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: without it every client gets JSON
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional: without it compressed responses use gzip
+    brotli = None
+
+HAVE_ORJSON = orjson is not None
+HAVE_MSGPACK = msgpack is not None
+HAVE_BROTLI = brotli is not None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+# Served media types, preferred first when the client accepts several equally
+MEDIA_TYPES = [JSON] + ([MSGPACK, 'application/x-msgpack'] if HAVE_MSGPACK else [])
+CONTENT_ENCODINGS = (['br'] if HAVE_BROTLI else []) + ['gzip']
+
+GZIP_LEVEL = 4  # 6 costs three times the CPU for ~8% smaller history responses
+BROTLI_QUALITY = 5  # brotli's higher levels cost far more CPU than they save bytes
+
+
+def negotiate(accept_mimetypes, accept_encodings, compression=True):
+    """(media type, content coding or None) for a request's Accept headers
+    (werkzeug Accept objects)"""
+    media_type = accept_mimetypes.best_match(MEDIA_TYPES, default=JSON)
+    if media_type != JSON:
+        media_type = MSGPACK
+    encoding = accept_encodings.best_match(CONTENT_ENCODINGS) if compression else None
+    return media_type, encoding
+
+
+def encode(data, media_type=JSON):
+    """Serialize data (dicts, lists, str, numbers, None) to bytes"""
+    if media_type == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # No timestamp in the header: equal bodies give equal bytes
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return body
@@ -13,17 +13,57 @@ let lastUpdateDisplayInterval = null;
 let lastDataRefreshTime = null;
 const POLL_INTERVAL_MS = 30000; // 30 seconds
 
+// Live updates (Server-Sent Events); polling is the fallback
+let eventSource = null;
+let eventSourceRetry = null;
+const STREAM_RETRY_MS = 300000; // retry a refused stream (503: worker full) after 5 minutes
+
+// ==================== Conditional Fetch ====================
+
+// Last body and ETag per URL, revalidated with If-None-Match
+const conditionalCache = new Map();
+
+// Fetch JSON, reusing the cached body when the server answers 304.
+// Resolves to { data, changed }.
+async function fetchJSONConditional(url) {
+    const cached = conditionalCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    // no-store keeps the browser cache out of the way so the 304 reaches us
+    const res = await fetch(url, { headers, cache: 'no-store' });
+    if (res.status === 304 && cached) {
+        return { data: cached.data, changed: false };
+    }
+    if (!res.ok) throw new Error(`Request failed: ${res.status}`);
+    const data = await res.json();
+    const etag = res.headers.get('ETag');
+    if (etag) conditionalCache.set(url, { etag, data });
+    return { data, changed: true };
+}
+
+// Columnar summary ({field: [values]}) -> one object per server.
+// recorded_at comes as epoch seconds and is formatted like the SSE updates.
+function summaryRows(columns) {
+    return columns.site.map((_, i) => ({
+        site: columns.site[i],
+        sub_site: columns.sub_site[i],
+        server_type: columns.server_type[i],
+        size_mb: columns.size_mb[i],
+        recorded_at: new Date(columns.recorded_at[i] * 1000).toISOString().slice(0, 19).replace('T', ' '),
+        growth_30d: columns.growth_30d[i],
+        monthly_avg_growth: columns.monthly_avg_growth[i]
+    }));
+}
+
 // ==================== Initialization ====================
 
 
 async function loadData() {
     try {
-        const [summaryRes, lastUpdateRes] = await Promise.all([
-            fetch('/api/summary'),
+        const [summary, lastUpdateRes] = await Promise.all([
+            fetchJSONConditional('/api/summary?format=columnar'),
             fetch('/api/last-update')
         ]);
-        if (!summaryRes.ok) throw new Error('Failed to load data');
-        sitesData = await summaryRes.json();
+        sitesData = summaryRows(summary.data);
 
         // Use server's actual last report time (not frontend clock)
         if (lastUpdateRes.ok) {
@@ -347,7 +387,7 @@ function renderSiteCard(group) {
     });
 
     return `
-        <div class="site-card">
+        <div class="site-card" data-card-key="${site}-${sub_site}">
             <div class="site-card-header">
                 <div class="site-name">
                     ${sub_site}
@@ -595,16 +635,17 @@ document.addEventListener('DOMContentLoaded', () => {
     applyTheme();
     initSidebarState();
     loadData();
-    startPolling();
+    startEventStream();
     startLastUpdateDisplayTimer();
 
-    // Pause polling when page is hidden, resume when visible
+    // Pause updates when page is hidden, resume when visible
     document.addEventListener('visibilitychange', () => {
         if (document.hidden) {
             stopPolling();
+            stopEventStream();
         } else {
             checkForUpdates(); // Immediate check on return
-            startPolling();
+            startEventStream();
         }
     });
 });
@@ -691,8 +732,7 @@ async function showDetails(site, subSite, serverType) {
     try {
         await fetchAndRenderChart();
         // Fetch month production data
-        const monthResponse = await fetch(`/api/month-production/${site}/${subSite}/${serverType}`);
-        const monthData = await monthResponse.json();
+        const { data: monthData } = await fetchJSONConditional(`/api/month-production/${site}/${subSite}/${serverType}`);
 
         // Render stats with current month, previous month, and average
         const currentData = sitesData.find(d =>
@@ -728,8 +768,9 @@ async function fetchAndRenderChart() {
     if (!site || !subSite || !serverType) return;
 
     try {
-        const response = await fetch(`/api/history/${site}/${subSite}/${serverType}?days=${days}`);
-        const history = await response.json();
+        // About one point per pixel; the server downsamples longer ranges
+        const points = Math.round(document.getElementById('history-chart').clientWidth) || 600;
+        const { data: history } = await fetchJSONConditional(`/api/history/${site}/${subSite}/${serverType}?days=${days}&points=${points}&format=columnar`);
         renderChart(history);
     } catch (error) {
         console.error('Error fetching chart data:', error);
@@ -750,6 +791,7 @@ async function changeTimeRange(days) {
     await fetchAndRenderChart();
 }
 
+// history: { recorded_at: [epoch seconds], size_mb: [MB] }
 function renderChart(history) {
     const ctx = document.getElementById('history-chart').getContext('2d');
 
@@ -760,8 +802,8 @@ function renderChart(history) {
 
     const fullTimestamps = []; // Store precise times for tooltips
 
-    const labels = history.map(h => {
-        const date = new Date(h.recorded_at.replace(' ', 'T') + 'Z');
+    const labels = history.recorded_at.map(t => {
+        const date = new Date(t * 1000);
         // Format for precise tooltip: MM/DD HH:mm:ss
         const preciseTime = `${date.getMonth() + 1}/${date.getDate()} ${String(date.getHours()).padStart(2, '0')}:${String(date.getMinutes()).padStart(2, '0')}:${String(date.getSeconds()).padStart(2, '0')}`;
         fullTimestamps.push(preciseTime);
@@ -770,7 +812,7 @@ function renderChart(history) {
         return `${date.getMonth() + 1}/${date.getDate()}`;
     });
 
-    const data = history.map(h => h.size_mb);
+    const data = history.size_mb;
 
     // Dynamic Rendering: Determine if data is dense (e.g., more than 30 points)
     const isDense = data.length > 30;
@@ -912,13 +954,13 @@ async function checkForUpdates() {
 
         if (knownLastUpdate === null) {
             // First poll: just record baseline, don't show toast
-            knownLastUpdate = data.last_update;
+            knownLastUpdate = data.version;
             return;
         }
 
-        if (data.last_update && data.last_update !== knownLastUpdate) {
-            // Genuine new data from an agent
-            knownLastUpdate = data.last_update;
+        if (data.version && data.version !== knownLastUpdate) {
+            // Genuine new data from an agent (versions are shared by all workers)
+            knownLastUpdate = data.version;
             await loadData();
             showToast('資料已自動更新', 'success');
         } else {
@@ -942,6 +984,83 @@ function stopPolling() {
     }
 }
 
+// ==================== Live Updates (SSE) ====================
+
+function startEventStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    if (eventSource) return;
+
+    eventSource = new EventSource('/api/stream');
+    eventSource.addEventListener('open', () => {
+        // Pushed updates replace polling while the stream is up
+        stopPolling();
+    });
+    eventSource.addEventListener('update', (e) => {
+        applyServerUpdate(JSON.parse(e.data));
+    });
+    eventSource.addEventListener('error', () => {
+        // The browser reconnects by itself (unless CLOSED); poll meanwhile
+        if (!pollingInterval) startPolling();
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            // Refused (e.g. 503 when the worker has no stream slot left):
+            // keep polling and try again later
+            eventSource = null;
+            clearTimeout(eventSourceRetry);
+            eventSourceRetry = setTimeout(() => {
+                if (!document.hidden) startEventStream();
+            }, STREAM_RETRY_MS);
+        }
+    });
+}
+
+function stopEventStream() {
+    clearTimeout(eventSourceRetry);
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
+function applyServerUpdate(update) {
+    const entry = sitesData.find(d =>
+        d.site === update.site && d.sub_site === update.sub_site && d.server_type === update.server_type
+    );
+    knownLastUpdate = Math.max(knownLastUpdate || 0, update.version);
+    lastDataRefreshTime = new Date(update.recorded_at.replace(' ', 'T') + 'Z');
+
+    if (!entry) {
+        // New server: tabs and cards need a full render
+        loadData();
+        return;
+    }
+    entry.size_mb = update.size_mb;
+    entry.recorded_at = update.recorded_at;
+    entry.growth_30d = update.growth_30d;
+    entry.monthly_avg_growth = update.monthly_avg_growth;
+
+    // Re-render only the card holding this server
+    const card = document.querySelector(`.site-card[data-card-key="${CSS.escape(`${update.site}-${update.sub_site}`)}"]`);
+    if (card) {
+        card.outerHTML = renderSiteCard({
+            site: update.site,
+            sub_site: update.sub_site,
+            servers: sitesData.filter(d => d.site === update.site && d.sub_site === update.sub_site)
+        });
+    }
+    updateOverviewStats();
+    updateLastUpdateDisplay();
+
+    // Refresh the open chart if it shows this server
+    const modalOpen = document.getElementById('detail-modal').classList.contains('active');
+    if (modalOpen && currentModalState.site === update.site &&
+        currentModalState.subSite === update.sub_site && currentModalState.serverType === update.server_type) {
+        fetchAndRenderChart();
+    }
+}
+
 // ==================== Last Update Display ====================
 
 function formatRelativeTime(date) {
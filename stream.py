@@ -0,0 +1,134 @@
+# Server-Sent Events change feed for LogHive
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from prometheus_client import Gauge
+
+from models import DiskUsage
+
+logger = logging.getLogger(__name__)
+
+stream_subscribers = Gauge(
+    'loghive_stream_subscribers',
+    'Open /api/stream connections in this worker'
+)
+
+
+class StreamFull(Exception):
+    """The worker already serves max_subscribers streams"""
+
+
+class ChangeFeed:
+    """Fans data_version changes out to the SSE clients of this worker.
+
+    While anyone is subscribed, one thread per process asks the database
+    (shared by all workers) which servers changed since the last version it
+    saw and hands each change to every subscriber of that environment.
+    Each client holds a worker thread, so at most max_subscribers (0: no
+    limit) may be subscribed at once.
+    """
+
+    QUEUE_SIZE = 1000
+
+    def __init__(self, interval_ms=1000, max_subscribers=0):
+        self.interval = interval_ms / 1000
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._subscribers = {}  # queue -> environment
+        self._versions = {}     # environment -> last version published
+        self._thread = None
+        self._pid = os.getpid()
+
+    def subscribe(self, environment):
+        """Register a client; returns the queue its changes arrive on.
+        Raises StreamFull when max_subscribers are already registered."""
+        q = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent's thread and clients are not ours
+                self._reset()
+            if self.max_subscribers and len(self._subscribers) >= self.max_subscribers:
+                raise StreamFull()
+            if environment not in self._versions:
+                self._versions[environment] = DiskUsage.get_version(environment)[0]
+            self._subscribers[q] = environment
+            stream_subscribers.set(len(self._subscribers))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+            stream_subscribers.set(len(self._subscribers))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._subscribers:
+                    # Idle: stop, the next subscriber starts from the current version
+                    self._thread = None
+                    self._versions.clear()
+                    return
+                versions = {env: self._versions[env] for env in set(self._subscribers.values())}
+            for env, since in versions.items():
+                try:
+                    version, changes = DiskUsage.get_changes_since(since, env)
+                except Exception:
+                    logger.exception('Change feed poll failed for %s', env)
+                    continue
+                self._publish(env, version, changes)
+
+    def _publish(self, environment, version, changes):
+        with self._lock:
+            self._versions[environment] = version
+            targets = [q for q, env in self._subscribers.items() if env == environment]
+        for q in targets:
+            for change in changes:
+                try:
+                    q.put_nowait(change)
+                except queue.Full:
+                    # Stalled client: it replays from Last-Event-ID when it reconnects
+                    break
+
+
+def _format_event(environment, change):
+    data = dict(change, environment=environment)
+    return f"id: {change['version']}\nevent: update\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(feed, environment, last_event_id=None, keepalive=15, max_seconds=300, q=None):
+    """Generate the text/event-stream body for one client.
+
+    Changes after last_event_id (the browser's Last-Event-ID on reconnect)
+    are replayed first. The stream ends after max_seconds so the worker
+    thread is released; EventSource reconnects on its own. q is the client's
+    queue when it was subscribed up front (to answer StreamFull before the
+    response starts).
+    """
+    if q is None:
+        q = feed.subscribe(environment)
+    try:
+        yield 'retry: 5000\n\n'
+        if last_event_id is not None:
+            for change in DiskUsage.get_changes_since(last_event_id, environment)[1]:
+                yield _format_event(environment, change)
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            try:
+                change = q.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield _format_event(environment, change)
+    finally:
+        feed.unsubscribe(q)
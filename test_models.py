@@ -1,6 +1,6 @@
 """
 LogHive Unit Tests
-Covers: _calc_positive_growth, DiskUsage model operations, Flask API endpoints
+Covers: _calc_positive_growth, growth engine, LTTB downsampling, DiskUsage model operations, Flask API endpoints
 Uses in-memory SQLite - does NOT touch any real database.
 """
 
@@ -9,6 +9,7 @@ import json
 import sqlite3
 import sys
 import os
+import time
 import unittest.mock as mock
 
 os.environ['TESTING'] = '1'
@@ -17,27 +18,6 @@ os.environ['TESTING'] = '1'
 
 _real_conn = sqlite3.connect(':memory:', check_same_thread=False)
 _real_conn.row_factory = sqlite3.Row
-_real_conn.executescript('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        environment TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS disk_usage (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        site TEXT NOT NULL,
-        sub_site TEXT NOT NULL,
-        server_type TEXT NOT NULL,
-        path TEXT NOT NULL,
-        size_mb REAL NOT NULL,
-        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE INDEX IF NOT EXISTS idx_disk_usage_lookup
-        ON disk_usage (site, sub_site, server_type, recorded_at);
-''')
-_real_conn.commit()
 
 
 class _NoCloseConn:
@@ -83,6 +63,13 @@ with mock.patch('models.get_db_connection', side_effect=_fake_get_db), \
     import models as models_module
     from models import DiskUsage, User
 
+# Keep the real pooled implementation for the connection pool tests
+_pooled_get_db = models_module.get_db_connection
+
+# Same schema as init_db(), in memory
+models_module.create_tables(_real_conn.cursor())
+_real_conn.commit()
+
 # Override at module level so all subsequent calls use in-memory
 models_module.get_db_connection = _fake_get_db
 
@@ -131,24 +118,124 @@ class TestCalcPositiveGrowth(unittest.TestCase):
         self.assertEqual(result, 1.5)
 
 
+def _loop_growth(data):
+    """The original pure-Python _calc_positive_growth, as the reference"""
+    growth = 0
+    for i in range(1, len(data)):
+        diff = data[i] - data[i - 1]
+        if diff > 0:
+            growth += diff
+    return round(growth, 2)
+
+
+class TestGrowthEngine(unittest.TestCase):
+    """growth.segment_stats must match the per-server loop exactly, with and
+    without NumPy."""
+
+    def _backends(self):
+        import growth
+        backends = [False] + ([True] if growth.HAVE_NUMPY else [])
+        for have_numpy in backends:
+            with self.subTest(numpy=have_numpy), mock.patch.object(growth, 'HAVE_NUMPY', have_numpy):
+                yield growth
+
+    def _random_columns(self, rng, servers):
+        series, buckets, timestamps, sizes = [], [], [], []
+        for server in range(servers):
+            size = rng.uniform(0, 5000)
+            for month in range(rng.randint(1, 4)):
+                for i in range(rng.choice([1, 2, 3, 17, 200])):
+                    size = round(size * 0.5 if rng.random() < 0.1 else size + rng.uniform(-1, 25), 2)
+                    series.append(server)
+                    buckets.append(month)
+                    timestamps.append(month * 1000 + i)
+                    sizes.append(size)
+        return series, buckets, timestamps, sizes
+
+    def test_positive_growth_matches_existing_cases(self):
+        cases = [[50, 80, 120], [85, 120, 60, 85], [100, 50, 30], [100, 10, 100], [100, 100, 100],
+                 [100], [], [50, 100, 30, 80, 20, 60], [1.5, 3.7, 2.1, 5.3], [1.0, 2.5]]
+        for growth in self._backends():
+            for data in cases:
+                result = round(growth.positive_growth(data), 2)
+                self.assertEqual(result, _loop_growth(data))
+
+    def test_segment_stats_property(self):
+        import random
+        for seed in range(20):
+            rng = random.Random(seed)
+            series, buckets, timestamps, sizes = self._random_columns(rng, rng.randint(1, 30))
+            for growth in self._backends():
+                stats = growth.segment_stats(series, buckets, timestamps, sizes)
+                expected = {}
+                for key, size in zip(zip(series, buckets), sizes):
+                    expected.setdefault(key, []).append(size)
+                self.assertEqual(list(zip(stats.series, stats.bucket_ts)), list(expected))
+                for i, points in enumerate(expected.values()):
+                    self.assertEqual(round(stats.growth_mb[i], 2), _loop_growth(points))
+                    self.assertEqual(stats.max_mb[i], max(points))
+                    self.assertEqual((stats.first_mb[i], stats.last_mb[i]), (points[0], points[-1]))
+                    self.assertEqual(stats.sample_count[i], len(points))
+
+    def test_segment_stats_counts(self):
+        # Deadband runs: each row stands for `counts` reports
+        for growth in self._backends():
+            stats = growth.segment_stats([0, 0, 0, 1], [0, 0, 1, 0], [1, 2, 3, 1], [5.0, 5.0, 6.0, 1.0],
+                                         [1, 9, 2, 1])
+            self.assertEqual(list(stats.sample_count), [10, 2, 1])
+
+    def test_month_starts_match_month_range(self):
+        timestamps = [models_module.to_epoch(t) for t in
+                      ('2024-02-29 23:59:59', '2024-03-01 00:00:00', '2026-12-31 12:00:00', '1970-01-01 00:00:00')]
+        expected = [models_module.month_range(models_module.format_ts(ts)[:7])[0] for ts in timestamps]
+        for growth in self._backends():
+            self.assertEqual(list(growth.month_starts(timestamps)), expected)
+            self.assertEqual(list(growth.day_starts(timestamps)), [ts - ts % 86400 for ts in timestamps])
+
+
+class TestLTTB(unittest.TestCase):
+    def setUp(self):
+        from downsample import lttb
+        self.lttb = lttb
+
+    def test_short_series_returned_unchanged(self):
+        points = [(0, 1), (1, 2), (2, 3)]
+        self.assertEqual(self.lttb(points, 10), points)
+
+    def test_keeps_endpoints_and_bounds_size(self):
+        points = [(x, x % 7) for x in range(1000)]
+        sampled = self.lttb(points, 50)
+        self.assertEqual(len(sampled), 50)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertEqual(sampled, sorted(sampled))
+
+    def test_keeps_spike_and_drop(self):
+        points = [(x, 100.0) for x in range(500)]
+        points[123] = (123, 900.0)   # spike
+        points[321] = (321, 5.0)     # cleanup
+        sampled = self.lttb(points, 20)
+        self.assertIn((123, 900.0), sampled)
+        self.assertIn((321, 5.0), sampled)
+
+
 # ════════════════════════════════════════════════════════════════════════════
 # 2. DiskUsage - record & history
 # ════════════════════════════════════════════════════════════════════════════
 
 def _insert(site, sub, stype, size_mb, timestamp=None):
-    if timestamp:
-        _real_conn.execute(
-            'INSERT INTO disk_usage (site, sub_site, server_type, path, size_mb, recorded_at)'
-            ' VALUES (?, ?, ?, ?, ?, ?)',
-            (site, sub, stype, '/data', size_mb, timestamp)
-        )
-    else:
-        _real_conn.execute(
-            'INSERT INTO disk_usage (site, sub_site, server_type, path, size_mb)'
-            ' VALUES (?, ?, ?, ?, ?)',
-            (site, sub, stype, '/data', size_mb)
-        )
+    DiskUsage.record(site, sub, stype, '/data', size_mb, recorded_at=timestamp)
+
+
+def _clear(site=None):
+    """Delete raw samples and rollups (of one site, or everything)"""
+    for table in ('disk_usage', *models_module.ROLLUPS):
+        if site is None:
+            _real_conn.execute(f'DELETE FROM {table}')
+        else:
+            _real_conn.execute(f'DELETE FROM {table} WHERE site = ?', (site,))
     _real_conn.commit()
+    # Direct deletes do not bump data versions
+    models_module._query_cache.clear()
 
 
 class TestDiskUsageRecord(unittest.TestCase):
@@ -157,8 +244,7 @@ class TestDiskUsageRecord(unittest.TestCase):
     STYPE = 'log_server'
 
     def setUp(self):
-        _real_conn.execute('DELETE FROM disk_usage WHERE site = ?', (self.SITE,))
-        _real_conn.commit()
+        _clear(self.SITE)
 
     def test_history_returns_inserted_records(self):
         _insert(self.SITE, self.SUB, self.STYPE, 100.0)
@@ -177,6 +263,268 @@ class TestDiskUsageRecord(unittest.TestCase):
         self.assertEqual(history, [])
 
 
+class TestSeriesStorage(unittest.TestCase):
+    SITE = 'SeriesSite'
+
+    def setUp(self):
+        _clear(self.SITE)
+
+    def _series(self):
+        return [tuple(row) for row in _real_conn.execute(
+            'SELECT site, sub_site, server_type, path FROM series WHERE site = ?', (self.SITE,))]
+
+    def test_one_series_row_per_server_with_latest_path(self):
+        for i in range(5):
+            _insert(self.SITE, 'S1', 'log', 100 + i, 1767225600 + i)
+        DiskUsage.record(self.SITE, 'S1', 'log', '/data2', 200, recorded_at=1767225700)
+        self.assertEqual(self._series(), [(self.SITE, 'S1', 'log', '/data2')])
+        self.assertEqual(len(DiskUsage.get_history(self.SITE, 'S1', 'log', days=10000)), 6)
+
+    def test_exact_duplicates_stored_once(self):
+        report = {'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data',
+                  'size_mb': 100, 'recorded_at': 1767225600}
+        DiskUsage.record_many([report, dict(report), dict(report, size_mb=90)])
+        DiskUsage.record_many([report])
+        rows = _real_conn.execute('SELECT ts, size_mb FROM disk_usage WHERE site = ?', (self.SITE,)).fetchall()
+        self.assertEqual(len(rows), 2)
+        daily = _real_conn.execute(
+            'SELECT sample_count FROM disk_usage_daily WHERE site = ?', (self.SITE,)).fetchone()
+        self.assertEqual(daily['sample_count'], 2)
+
+    def test_rolled_back_series_is_not_cached(self):
+        report = {'site': self.SITE, 'sub_site': 'New', 'server_type': 'log', 'path': '/data',
+                  'size_mb': 100, 'recorded_at': 1767225600}
+        writers = {'record': lambda: DiskUsage.record(self.SITE, 'New', 'log', '/data', 100,
+                                                      recorded_at=1767225600),
+                   'record_many': lambda: DiskUsage.record_many([report])}
+        for name, record in writers.items():
+            with self.subTest(name):
+                _real_conn.execute('DELETE FROM series WHERE site = ?', (self.SITE,))
+                _real_conn.commit()
+                models_module._series_ids.clear()
+                with mock.patch.object(models_module, '_bump_versions', side_effect=sqlite3.OperationalError):
+                    with self.assertRaises(sqlite3.OperationalError):
+                        record()
+                self.assertEqual(self._series(), [])
+                record()
+                latest = DiskUsage.get_latest(self.SITE, 'New', 'log')
+                self.assertEqual(latest['size_mb'], 100)
+                summary = [row for row in DiskUsage.get_summary_with_growth()
+                           if row['site'] == self.SITE]
+                self.assertEqual(len(summary), 1)
+                _clear(self.SITE)
+
+    def test_migrate_legacy_table(self):
+        from tools.migrate_db import migrate_series
+        legacy = sqlite3.connect(':memory:')
+        legacy.execute('''
+            CREATE TABLE disk_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, site TEXT NOT NULL, sub_site TEXT NOT NULL,
+                server_type TEXT NOT NULL, path TEXT NOT NULL, size_mb REAL NOT NULL, ts INTEGER NOT NULL
+            )
+        ''')
+        legacy.executemany(
+            'INSERT INTO disk_usage (site, sub_site, server_type, path, size_mb, ts) VALUES (?, ?, ?, ?, ?, ?)',
+            [('A', 'S1', 'log', '/old', 100, 10), ('A', 'S1', 'log', '/new', 150, 20),
+             ('A', 'S1', 'log', '/new', 150, 20), ('B', 'S2', 'log', '/data', 70, 15)]
+        )
+        legacy.commit()
+        with mock.patch('builtins.print'):
+            self.assertTrue(migrate_series(legacy))
+        self.assertEqual(legacy.execute('SELECT site, path FROM series ORDER BY site').fetchall(),
+                         [('A', '/new'), ('B', '/data')])
+        self.assertEqual(legacy.execute(
+            'SELECT site, size_mb, ts FROM disk_usage ORDER BY site, ts').fetchall(),
+            [('A', 100, 10), ('A', 150, 20), ('B', 70, 15)])
+        self.assertEqual(legacy.execute(
+            "SELECT type FROM sqlite_master WHERE name = 'disk_usage'").fetchone()[0], 'view')
+        self.assertFalse(migrate_series(legacy))
+
+
+class TestHistoryDownsampling(unittest.TestCase):
+    SITE = 'DownsampleSite'
+
+    def setUp(self):
+        _clear(self.SITE)
+        import time
+        self.now = int(time.time())
+
+    def _fill(self, days, per_day):
+        step = 86400 // per_day
+        DiskUsage.record_many([
+            {'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data',
+             'size_mb': 1000 + i, 'recorded_at': self.now - days * 86400 + i * step}
+            for i in range(days * per_day)
+        ])
+
+    def test_points_bounds_raw_history(self):
+        self._fill(days=10, per_day=48)
+        full = DiskUsage.get_history(self.SITE, 'S1', 'log', days=30)
+        sampled = DiskUsage.get_history(self.SITE, 'S1', 'log', days=30, points=100)
+        self.assertEqual(len(full), 480)
+        self.assertEqual(len(sampled), 100)
+        self.assertEqual((sampled[0], sampled[-1]), (full[0], full[-1]))
+
+    def test_long_range_reads_daily_rollups(self):
+        self._fill(days=200, per_day=24)
+        with mock.patch.object(models_module, '_HISTORY_POINTS_SQL', 'invalid sql'):
+            sampled = DiskUsage.get_history(self.SITE, 'S1', 'log', days=365, points=150)
+        self.assertEqual(len(sampled), 150)
+        self.assertEqual(sampled[-1], DiskUsage.get_latest(self.SITE, 'S1', 'log'))
+
+    def test_daily_rollups_keep_peaks(self):
+        # A spike inside one day is neither that day's first nor last sample
+        start = self.now - self.now % 86400 - 300 * 86400
+        DiskUsage.record_many([
+            {'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data',
+             'size_mb': 5000 if i == 4 * 150 + 2 else 1000 + i, 'recorded_at': start + i * 21600}
+            for i in range(4 * 300)
+        ])
+        with mock.patch.object(models_module, '_HISTORY_POINTS_SQL', 'invalid sql'):
+            sampled = DiskUsage.get_history(self.SITE, 'S1', 'log', days=365, points=150)
+        self.assertEqual(max(r['size_mb'] for r in sampled), 5000)
+        self.assertEqual(models_module._bucket_points([(0, 10, 86000, 20, 30), (86400, 5, 90000, 8, 8)], 0),
+                         [(0, 10), (43000, 30), (86000, 20), (86400, 5), (90000, 8)])
+
+    def test_few_samples_not_padded(self):
+        self._fill(days=2, per_day=2)
+        self.assertEqual(len(DiskUsage.get_history(self.SITE, 'S1', 'log', points=100)), 4)
+
+    def test_columnar_matches_rows(self):
+        from models import to_epoch
+        self._fill(days=10, per_day=48)
+        for points in (None, 100):
+            rows = DiskUsage.get_history(self.SITE, 'S1', 'log', days=30, points=points)
+            columns = DiskUsage.get_history(self.SITE, 'S1', 'log', days=30, points=points, columnar=True)
+            self.assertEqual(columns, {'recorded_at': [to_epoch(r['recorded_at']) for r in rows],
+                                       'size_mb': [r['size_mb'] for r in rows]})
+
+
+class TestDeadband(unittest.TestCase):
+    SITE = 'DeadbandSite'
+    SITES = {SITE: {'sub_sites': {
+        'S1': {'log': {'deadband': True}},
+        'S2': {'log': {'deadband': True, 'deadband_mb': 1}},
+    }}}
+
+    def setUp(self):
+        _clear(self.SITE)
+        models_module._newest_rows.clear()
+        patcher = mock.patch.object(models_module, 'SITES_CONFIG', self.SITES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        import time
+        self.day = int(time.time()) // 86400 * 86400 - 86400  # yesterday, UTC
+
+    def _record(self, sub, sizes, start=0, step=60):
+        return [DiskUsage.record(self.SITE, sub, 'log', '/data', size, recorded_at=self.day + start + i * step)
+                for i, size in enumerate(sizes)]
+
+    def _rows(self, sub):
+        return [tuple(row) for row in _real_conn.execute(
+            'SELECT d.ts - ?, d.size_mb, d.last_seen - ?, d.sample_count FROM samples d '
+            'JOIN series s ON s.id = d.series_id WHERE s.site = ? AND s.sub_site = ? ORDER BY d.ts',
+            (self.day, self.day, self.SITE, sub))]
+
+    def _rollups(self, sub):
+        return {table: [tuple(row)[3:] for row in _real_conn.execute(
+            f'SELECT * FROM {table} WHERE site = ? AND sub_site = ? ORDER BY bucket_ts', (self.SITE, sub))]
+            for table in models_module.ROLLUPS}
+
+    def test_same_results_as_every_sample(self):
+        # P1 is not configured for deadband storage and keeps every sample
+        sizes = [100, 100, 100, 120, 120, 120, 120, 90, 90, 150]
+        self._record('S1', sizes, step=1200)
+        self._record('P1', sizes, step=1200)
+        self.assertEqual(self._rows('S1'), [(0, 100, 2400, 3), (3600, 120, 7200, 4), (8400, 90, 9600, 2),
+                                            (10800, 150, None, 1)])
+        self.assertEqual(len(self._rows('P1')), 10)
+        self.assertEqual(self._rollups('S1'), self._rollups('P1'))
+        for method in (DiskUsage.get_latest, DiskUsage.get_monthly_growth, DiskUsage.get_30day_growth):
+            self.assertEqual(method(self.SITE, 'S1', 'log'), method(self.SITE, 'P1', 'log'))
+        # History keeps the first and last sample of every unchanged run
+        full = DiskUsage.get_history(self.SITE, 'P1', 'log')
+        history = DiskUsage.get_history(self.SITE, 'S1', 'log')
+        self.assertEqual(history, [full[i] for i in (0, 2, 3, 6, 7, 8, 9)])
+        self.assertEqual(DiskUsage.get_history(self.SITE, 'S1', 'log', points=100), history)
+        # Rebuilt rollups (sample_count included) match the incremental ones:
+        # the 120 MB run's reports are spread over its two hours again
+        incremental = self._rollups('S1')
+        DiskUsage.rebuild_rollups()
+        self.assertEqual([row[6] for row in incremental['disk_usage_hourly']], [3, 3, 3, 1])
+        self.assertEqual(self._rollups('S1'), incremental)
+
+    def test_rebuild_spreads_runs_over_their_hours(self):
+        # Runs over many hours, reported at a fixed interval for a whole day
+        sizes = [100] * 30 + [110] * 7 + [105] * 59
+        for sub in ('S1', 'P1'):
+            self._record(sub, sizes, start=300, step=900)
+        self.assertEqual(len(self._rows('S1')), 3)
+        self.assertEqual(self._rollups('S1'), self._rollups('P1'))
+        DiskUsage.rebuild_rollups()
+        self.assertEqual(self._rollups('S1'), self._rollups('P1'))
+        # A late sample between two runs recomputes its hour from both
+        for sub in ('S1', 'P1'):
+            self._record(sub, [120], start=300 + 29 * 900 + 600)
+        self.assertEqual(self._rollups('S1')['disk_usage_hourly'], self._rollups('P1')['disk_usage_hourly'])
+
+    def test_history_window_starts_inside_a_run(self):
+        self._record('S1', [100] * 10)
+        now = int(__import__('time').time())
+        days = (now - self.day - 300) / 86400
+        history = DiskUsage.get_history(self.SITE, 'S1', 'log', days=days, columnar=True)
+        # The run's size held at the window start
+        self.assertEqual(history['size_mb'], [100, 100])
+        self.assertIn(history['recorded_at'][0] - (self.day + 300), (0, 1))
+        self.assertEqual(history['recorded_at'][1], self.day + 540)
+        rows = DiskUsage.get_history(self.SITE, 'S1', 'log', days=days)
+        self.assertEqual([r['size_mb'] for r in rows], [100, 100])
+
+    def test_retried_and_late_samples(self):
+        self.assertEqual(self._record('S1', [100, 100, 100, 100]), [True] * 4)
+        self.assertFalse(DiskUsage.record(self.SITE, 'S1', 'log', '/data', 100, recorded_at=self.day + 90))
+        # A late sample of another size splits the run into its ends
+        self.assertTrue(DiskUsage.record(self.SITE, 'S1', 'log', '/data', 130, recorded_at=self.day + 90))
+        self.assertEqual(self._rows('S1'), [(0, 100, None, 3), (90, 130, None, 1), (180, 100, None, 1)])
+        self.assertEqual(self._rollups('S1')['disk_usage_hourly'][0][-2:], (5, 30))
+        self.assertEqual(DiskUsage.get_latest(self.SITE, 'S1', 'log')['size_mb'], 100)
+
+    def test_runs_end_at_the_day(self):
+        start = 86400 - 7200
+        self._record('S1', [100] * 4, start=start, step=3600)
+        self.assertEqual(self._rows('S1'), [(start, 100, start + 3600, 2), (start + 7200, 100, start + 10800, 2)])
+
+    def test_tolerance(self):
+        self._record('S2', [100, 100.5, 99.2, 101.5, 101])
+        self.assertEqual(self._rows('S2'), [(0, 100, 120, 3), (180, 101.5, 240, 2)])
+        self.assertEqual(DiskUsage.get_30day_growth(self.SITE, 'S2', 'log'), 1.5)
+
+    def test_row_loaded_inside_a_run(self):
+        self._record('S1', [100, 100, 100])
+        self._record('P1', [100, 100, 100])
+        # bulk_load stores plain rows, also within an existing run
+        series_id = _real_conn.execute('SELECT id FROM series WHERE site = ? AND sub_site = ?',
+                                       (self.SITE, 'S1')).fetchone()[0]
+        _real_conn.execute('INSERT INTO samples (series_id, ts, size_mb) VALUES (?, ?, 140)',
+                           (series_id, self.day + 90))
+        _real_conn.commit()
+        DiskUsage.record(self.SITE, 'P1', 'log', '/data', 140, recorded_at=self.day + 90)
+        self.assertEqual([h['size_mb'] for h in DiskUsage.get_history(self.SITE, 'S1', 'log')], [100, 140, 100])
+        DiskUsage.rebuild_rollups()
+        self.assertEqual(self._rollups('S1'), self._rollups('P1'))
+
+    def test_stale_hint_does_not_extend_an_older_run(self):
+        self._record('S1', [100, 100])
+        # Another worker stores a newer sample of the same series
+        series_id = _real_conn.execute('SELECT id FROM series WHERE site = ? AND sub_site = ?',
+                                       (self.SITE, 'S1')).fetchone()[0]
+        _real_conn.execute('INSERT INTO samples (series_id, ts, size_mb) VALUES (?, ?, 120)',
+                           (series_id, self.day + 120))
+        _real_conn.commit()
+        self._record('S1', [100], start=180)
+        self.assertEqual(self._rows('S1'), [(0, 100, 60, 2), (120, 120, None, 1), (180, 100, None, 1)])
+
+
 # ════════════════════════════════════════════════════════════════════════════
 # 3. DiskUsage - monthly growth
 # ════════════════════════════════════════════════════════════════════════════
@@ -187,8 +535,7 @@ class TestMonthlyGrowth(unittest.TestCase):
     STYPE = 'log_server'
 
     def setUp(self):
-        _real_conn.execute('DELETE FROM disk_usage WHERE site = ?', (self.SITE,))
-        _real_conn.commit()
+        _clear(self.SITE)
 
     def _seq(self, sizes, month='2026-01'):
         for i, sz in enumerate(sizes):
@@ -246,7 +593,487 @@ class TestMonthlyGrowth(unittest.TestCase):
 
 
 # ════════════════════════════════════════════════════════════════════════════
-# 4. Flask API (test client, no login required endpoints)
+# 4. Timestamps & query plans
+# ════════════════════════════════════════════════════════════════════════════
+
+class TestTimestamps(unittest.TestCase):
+    SITE = 'TsSite'
+
+    def setUp(self):
+        _clear(self.SITE)
+
+    def test_to_epoch_normalizes_formats(self):
+        expected = 1767225600  # 2026-01-01 00:00:00 UTC
+        for value in ('2026-01-01 00:00:00', '2026-01-01T00:00:00', '2026-01-01T00:00:00.000000',
+                      '2026-01-01T00:00:00Z', '2026-01-01T08:00:00+08:00', expected):
+            self.assertEqual(models_module.to_epoch(value), expected, value)
+
+    def test_month_range_is_half_open(self):
+        self.assertEqual(models_module.month_range('2025-12'), (1764547200, 1767225600))
+        self.assertEqual(models_module.previous_month('2026-01'), '2025-12')
+
+    def test_mixed_input_formats_sort_chronologically(self):
+        # 'T' and space separated strings used to compare as text
+        _insert(self.SITE, 'S1', 'log', 2.0, '2026-01-01T10:00:00')
+        _insert(self.SITE, 'S1', 'log', 1.0, '2026-01-01 09:00:00')
+        _insert(self.SITE, 'S1', 'log', 3.0, '2026-01-01 11:00:00')
+        latest = DiskUsage.get_latest(self.SITE, 'S1', 'log')
+        self.assertEqual(latest, {'size_mb': 3.0, 'recorded_at': '2026-01-01 11:00:00'})
+        result = DiskUsage.get_monthly_growth(self.SITE, 'S1', 'log')
+        self.assertEqual(result[0]['growth_mb'], 2.0)
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Time predicates must be index range scans, never table scans."""
+
+    def plan(self, sql, params):
+        rows = _real_conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        return ' | '.join(row['detail'] for row in rows)
+
+    def assertIndexRangeScan(self, plan):
+        self.assertIn('SEARCH samples USING PRIMARY KEY (series_id=?', plan)
+        self.assertIn('USING COVERING INDEX sqlite_autoindex_series_1', plan)
+        self.assertNotIn('SCAN', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_month_range_query(self):
+        plan = self.plan(models_module._RANGE_POINTS_SQL, ('A', 'B', 'C', 0, 1, 0))
+        self.assertIndexRangeScan(plan)
+        self.assertIn('ts>? AND ts<?', plan)
+
+    def test_history_query(self):
+        plan = self.plan(models_module._HISTORY_SQL, ('A', 'B', 'C', 0, 0))
+        self.assertIndexRangeScan(plan)
+        self.assertIn('ts>?', plan)
+
+    def test_latest_query(self):
+        self.assertIndexRangeScan(self.plan(models_module._LATEST_SQL, ('A', 'B', 'C')))
+
+    def test_deadband_queries(self):
+        for sql, params in ((models_module._COVERING_ROW_SQL, (1, 0)),
+                            (models_module._EXTEND_RUN_SQL, (0, 1, 0, 0.0, 0, 1, 0))):
+            plan = self.plan(sql, params)
+            self.assertIn('samples USING PRIMARY KEY (series_id=? AND ts', plan)
+            self.assertNotIn('SCAN', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_history_points_queries(self):
+        self.assertIndexRangeScan(self.plan(models_module._HISTORY_POINTS_SQL, ('A', 'B', 'C', 0, 0)))
+        plan = self.plan(models_module._DAILY_POINTS_SQL, ('A', 'B', 'C', 0))
+        self.assertIn('USING INDEX sqlite_autoindex_disk_usage_daily_1', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self.plan(models_module._HOURLY_POINTS_SQL, ('A', 'B', 'C', 0, 1))
+        self.assertIn('USING INDEX sqlite_autoindex_disk_usage_hourly_1', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_rollup_queries_use_primary_key(self):
+        for sql, params in ((models_module._MONTHLY_ROLLUP_SQL, ('A', 'B', 'C', 12)),
+                            (models_module._MONTH_GROWTH_SQL, ('A', 'B', 'C', 0))):
+            plan = self.plan(sql, params)
+            self.assertIn('USING INDEX sqlite_autoindex_disk_usage_monthly_1', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+# 5. DiskUsage - single-pass summary
+# ════════════════════════════════════════════════════════════════════════════
+
+class TestSummaryWithGrowth(unittest.TestCase):
+    SITE = 'SummarySite'
+
+    def setUp(self):
+        _clear()
+
+    def _per_server_summary(self):
+        """Reference result built the way /api/summary used to (2N+1 queries)."""
+        summary = DiskUsage.get_all_sites_summary()
+        for item in summary:
+            key = (item['site'], item['sub_site'], item['server_type'])
+            item['growth_30d'] = DiskUsage.get_30day_growth(*key)
+            monthly = DiskUsage.get_monthly_growth(*key)
+            item['monthly_avg_growth'] = round(
+                sum(m['growth_mb'] for m in monthly) / len(monthly), 2)
+        return summary
+
+    def test_matches_per_server_queries(self):
+        from datetime import datetime
+        cur = datetime.now().strftime('%Y-%m')
+        # 14 months of history so the 12-month window actually truncates
+        months = [f'2024-{m:02d}' for m in range(1, 13)] + ['2025-01', '2025-02', cur]
+        for i, month in enumerate(months):
+            for h, sz in enumerate([100 + i * 10, 130 + i * 10, 90 + i * 10, 160 + i * 7.5]):
+                _insert(self.SITE, 'Sub1', 'log_server', sz, f'{month}-10 {h:02d}:00:00')
+        _insert(self.SITE, 'Sub1', 'backup_server', 42.5, f'{cur}-01 00:00:00')
+        _insert(self.SITE, 'Sub2', 'log_server', 300, '2025-02-03 00:00:00')
+        _insert(self.SITE, 'Sub2', 'log_server', 250, '2025-02-04 00:00:00')
+
+        self.assertEqual(DiskUsage.get_summary_with_growth(), self._per_server_summary())
+
+    def test_single_point_server(self):
+        _insert(self.SITE, 'Sub1', 'log_server', 75.0, '2025-06-01 00:00:00')
+        [item] = DiskUsage.get_summary_with_growth()
+        self.assertEqual(item['size_mb'], 75.0)
+        self.assertEqual(item['growth_30d'], 0)
+        self.assertEqual(item['monthly_avg_growth'], 0)
+
+    def test_empty_database(self):
+        self.assertEqual(DiskUsage.get_summary_with_growth(), [])
+
+    def test_columnar_matches_rows(self):
+        from models import SUMMARY_FIELDS, to_epoch
+        _insert(self.SITE, 'Sub1', 'log_server', 100, '2025-01-10 00:00:00')
+        _insert(self.SITE, 'Sub1', 'log_server', 130, '2025-02-10 00:00:00')
+        _insert(self.SITE, 'Sub2', 'log_server', 42.5, '2025-02-11 06:30:00')
+        rows = DiskUsage.get_summary_with_growth()
+        columns = DiskUsage.get_summary_with_growth(columnar=True)
+        self.assertEqual(list(columns), list(SUMMARY_FIELDS))
+        for row in rows:
+            row['recorded_at'] = to_epoch(row['recorded_at'])
+        self.assertEqual(columns, {f: [row[f] for row in rows] for f in SUMMARY_FIELDS})
+
+
+class TestQueryCache(unittest.TestCase):
+    SITE = 'CacheSite'
+
+    def setUp(self):
+        _clear(self.SITE)
+        _insert(self.SITE, 'S1', 'log', 10.0)
+        _insert(self.SITE, 'S2', 'log', 20.0)
+
+    def _hits(self):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('loghive_cache_hits_total', {'cache': 'queries'}) or 0
+
+    def test_versioned_cache_tag_lru_and_ttl(self):
+        from cache import VersionedCache
+        cache = VersionedCache('unit', maxsize=2, ttl=60)
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.get_or_compute('a', 1, compute), 1)
+        self.assertEqual(cache.get_or_compute('a', 1, compute), 1)   # hit
+        self.assertEqual(cache.get_or_compute('a', 2, compute), 2)   # new version
+        cache.get_or_compute('b', 1, compute)
+        cache.get_or_compute('c', 1, compute)                         # evicts 'a'
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_compute('a', 2, compute), 5)
+        with mock.patch('cache.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(cache.get_or_compute('a', 2, compute), 6)  # expired
+
+    def test_repeated_reads_hit_until_server_changes(self):
+        args = (self.SITE, 'S1', 'log')
+        first = DiskUsage.get_monthly_growth(*args)
+        hits = self._hits()
+        self.assertEqual(DiskUsage.get_monthly_growth(*args), first)
+        self.assertEqual(self._hits(), hits + 1)
+        _insert(self.SITE, 'S2', 'log', 25.0)        # other server: still cached
+        DiskUsage.get_monthly_growth(*args)
+        self.assertEqual(self._hits(), hits + 2)
+        _insert(self.SITE, 'S1', 'log', 15.0)        # this server: recomputed
+        self.assertEqual(DiskUsage.get_monthly_growth(*args)[0]['max_size_mb'], 15.0)
+        self.assertEqual(self._hits(), hits + 2)
+
+    def test_summary_recomputed_after_any_report(self):
+        count = lambda: sum(item['site'] == self.SITE for item in DiskUsage.get_summary_with_growth())
+        self.assertEqual(count(), 2)
+        _insert(self.SITE, 'S3', 'log', 30.0)
+        self.assertEqual(count(), 3)
+
+    def test_databases_with_equal_versions_are_kept_apart(self):
+        import tempfile, shutil
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.addCleanup(models_module.close_db_connections)
+        summaries = []
+        for name, size_mb in (('a.db', 10.0), ('b.db', 20.0)):
+            with mock.patch('models.get_database_path', return_value=os.path.join(tmp_dir, name)), \
+                    mock.patch('models.get_db_connection', _pooled_get_db):
+                models_module.init_db()
+                DiskUsage.record(self.SITE, 'S1', 'log', '/data', size_mb, 'test', recorded_at=1767225600)
+                self.assertEqual(DiskUsage.get_version('test')[0], 1)
+                summaries.append(DiskUsage.get_summary_with_growth('test'))
+        self.assertEqual([[item['size_mb'] for item in summary] for summary in summaries], [[10.0], [20.0]])
+
+    def test_callers_get_copies(self):
+        DiskUsage.get_summary_with_growth()[0]['size_mb'] = -1
+        DiskUsage.get_current_and_previous_month_growth(self.SITE, 'S1', 'log')['current_month'] = 'x'
+        self.assertNotEqual(DiskUsage.get_summary_with_growth()[0]['size_mb'], -1)
+        self.assertNotEqual(
+            DiskUsage.get_current_and_previous_month_growth(self.SITE, 'S1', 'log')['current_month'], 'x')
+
+
+class TestRollups(unittest.TestCase):
+    SITE = 'RollupSite'
+
+    def setUp(self):
+        _clear()
+
+    def _snapshot(self):
+        return {table: [tuple(row) for row in _real_conn.execute(
+                    f'SELECT * FROM {table} ORDER BY site, sub_site, server_type, bucket_ts')]
+                for table in models_module.ROLLUPS}
+
+    def assertMatchesRebuild(self):
+        incremental = self._snapshot()
+        models_module.rebuild_rollups(_real_conn.cursor())
+        self.assertEqual(incremental, self._snapshot())
+
+    def test_daily_bucket_values(self):
+        for h, sz in enumerate([100, 150, 120, 180]):
+            _insert(self.SITE, 'S1', 'log', sz, f'2026-01-05 {h:02d}:00:00')
+        row = _real_conn.execute('SELECT * FROM disk_usage_daily').fetchone()
+        self.assertEqual(row['bucket_ts'], models_module.to_epoch('2026-01-05 00:00:00'))
+        self.assertEqual((row['first_mb'], row['last_mb'], row['max_mb']), (100, 180, 180))
+        self.assertEqual((row['sample_count'], row['growth_mb']), (4, 110))
+
+    def test_out_of_order_and_same_second_samples(self):
+        _insert(self.SITE, 'S1', 'log', 100, '2026-01-05 10:00:00')
+        _insert(self.SITE, 'S1', 'log', 300, '2026-01-05 12:00:00')
+        _insert(self.SITE, 'S1', 'log', 50, '2026-01-05 11:00:00')   # late
+        _insert(self.SITE, 'S1', 'log', 20, '2026-01-05 12:00:00')   # same second
+        _insert(self.SITE, 'S1', 'log', 80, '2026-01-31 23:59:59')
+        self.assertMatchesRebuild()
+        [month] = DiskUsage.get_monthly_growth(self.SITE, 'S1', 'log')
+        # 100 -> 50 -> 20 -> 300 -> 80 (ties ordered by size)
+        self.assertEqual(month['growth_mb'], 280)
+
+    def test_record_many_matches_rebuild(self):
+        reports = [{'site': self.SITE, 'sub_site': f'S{i % 3}', 'server_type': 'log', 'path': '/data',
+                    'size_mb': (i * 37) % 101, 'recorded_at': 1767225600 + ((i * 7919) % 60) * 43200}
+                   for i in range(90)]
+        DiskUsage.record_many(reports[:60])
+        DiskUsage.record_many(reports[60:])
+        self.assertMatchesRebuild()
+
+    def test_rebuild_holds_one_series_at_a_time(self):
+        reports = [{'site': self.SITE, 'sub_site': f'S{i % 4}', 'server_type': 'log', 'path': '/data',
+                    'size_mb': (i * 37) % 101, 'recorded_at': 1767225600 + i * 3600}
+                   for i in range(80)]
+        DiskUsage.record_many(reports)
+        lengths = []
+        rebuild_series = models_module._rebuild_series
+
+        def spy(cursor, key, timestamps, *args):
+            lengths.append(len(timestamps))
+            rebuild_series(cursor, key, timestamps, *args)
+        # Chunks smaller than a series, split across series boundaries
+        with mock.patch.object(models_module, 'REBUILD_FETCH_ROWS', 3), \
+                mock.patch.object(models_module, '_rebuild_series', spy):
+            self.assertMatchesRebuild()
+        self.assertEqual(len(lengths), 4)
+        self.assertLessEqual(max(lengths), 2 * 20)  # a run is its first and last sample
+
+    def test_bulk_load_matches_record_many(self):
+        from bulkload import bulk_load
+        reports = [{'site': self.SITE, 'sub_site': f'S{i % 3}', 'server_type': 'log', 'path': '/data',
+                    'size_mb': (i * 37) % 101, 'recorded_at': 1767225600 + ((i * 7919) % 60) * 43200}
+                   for i in range(90)]
+        DiskUsage.record_many(reports)
+        recorded = self._snapshot()
+        _clear()
+        rows = ((r['site'], r['sub_site'], r['server_type'], r['path'], r['recorded_at'], r['size_mb'])
+                for r in reports)
+        self.assertEqual(bulk_load(rows, 'test', chunk_size=7), 90)
+        self.assertEqual(self._snapshot(), recorded)
+        # Exact duplicates are ignored, replace starts over
+        self.assertEqual(bulk_load([('RollupSite', 'S0', 'log', '/data', 1767225600, 0)], 'test'), 0)
+        self.assertEqual(bulk_load([('RollupSite', 'S0', 'log', '/data', 1767225600, 0)], 'test', replace=True), 1)
+        self.assertEqual(_real_conn.execute('SELECT COUNT(*) FROM disk_usage').fetchone()[0], 1)
+
+    def test_demo_rows(self):
+        from bulkload import demo_rows, DEMO_FLEET
+        rows = list(demo_rows(now=1767225600, seed=1))
+        self.assertEqual(len(rows), sum(days + 1 for *_, days in DEMO_FLEET))
+        self.assertEqual(max(row[4] for row in rows), 1767225600)
+        hourly = list(demo_rows(servers=30, days=2, interval=3600, now=1767225600, seed=1))
+        self.assertEqual(len({row[:3] for row in hourly}), 30)
+        per_server = {}
+        for row in hourly:
+            per_server[row[:3]] = per_server.get(row[:3], 0) + 1
+        self.assertEqual(per_server[('Site_A', 'SubSite_1', 'log_server')], 2 * 24 + 1)
+        self.assertEqual(per_server[('Site_B', 'SubSite_Lab', 'log_server')], 5)  # sparse: 5/60 of the range
+        self.assertEqual(per_server[('Site_C', 'SubSite_2', 'server_29')], 2 * 24 + 1)
+
+
+class TestRetention(unittest.TestCase):
+    SITE = 'RetentionSite'
+    NOW = 1767225600 + 200 * 86400  # 2026-07-20
+
+    def setUp(self):
+        _clear()
+        from tools import retention
+        self.retention = retention
+        # Jan..Jul, every 6 hours, with cleanups
+        reports = [{'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data',
+                    'size_mb': round(1000 + i * 1.37 - (i % 40 == 0) * 300, 2),
+                    'recorded_at': 1767225600 + i * 21600}
+                   for i in range(800)]
+        DiskUsage.record_many(reports)
+        # A server that stopped reporting in January
+        _insert(self.SITE, 'S2', 'log', 500, '2026-01-03 00:00:00')
+        _insert(self.SITE, 'S2', 'log', 700, '2026-01-04 00:00:00')
+
+    def tearDown(self):
+        _real_conn.execute('DELETE FROM retention_watermark')
+        _real_conn.commit()
+
+    def _monthly(self):
+        return [tuple(row) for row in _real_conn.execute(
+            'SELECT * FROM disk_usage_monthly ORDER BY site, sub_site, server_type, bucket_ts')]
+
+    def _apply(self, **policy):
+        policy.setdefault('raw_days', 90)
+        policy.setdefault('hourly_days', 120)
+        policy.setdefault('daily_days', 0)
+        with mock.patch.object(self.retention, 'incremental_vacuum'):
+            return self.retention.apply_retention('test', now=self.NOW, **policy)
+
+    def test_cutoff_is_month_aligned(self):
+        cutoff = self.retention.raw_cutoff(self.NOW, 90)
+        self.assertEqual(cutoff, models_module.to_epoch('2026-04-01 00:00:00'))
+
+    def test_compaction_preserves_growth_and_latest(self):
+        monthly = self._monthly()
+        summary = DiskUsage.get_summary_with_growth()
+        cutoff = self.retention.raw_cutoff(self.NOW, 90)
+
+        counts = self._apply()
+        self.assertGreater(counts['samples'], 0)
+        self.assertEqual(_real_conn.execute(
+            "SELECT COUNT(*) FROM disk_usage WHERE sub_site = 'S1' AND ts < ?", (cutoff,)).fetchone()[0], 0)
+        self.assertEqual(_real_conn.execute(
+            'SELECT MIN(bucket_ts) FROM disk_usage_hourly').fetchone()[0],
+            self.NOW - self.NOW % 3600 - 120 * 86400)
+        self.assertEqual(self._monthly(), monthly)
+        self.assertEqual(DiskUsage.get_summary_with_growth(), summary)
+        # The stopped server keeps its newest sample
+        self.assertEqual(DiskUsage.get_latest(self.SITE, 'S2', 'log')['size_mb'], 700)
+
+        # Rebuilding only recomputes buckets after the watermark
+        models_module.rebuild_rollups(_real_conn.cursor())
+        _real_conn.commit()
+        self.assertEqual(self._monthly(), monthly)
+
+    def test_late_sample_in_compacted_bucket_is_rejected(self):
+        self._apply()
+        feb = models_module.to_epoch('2026-02-01 00:00:00')
+        before = _real_conn.execute(
+            "SELECT growth_mb FROM disk_usage_monthly WHERE sub_site = 'S1' AND bucket_ts = ?", (feb,)).fetchone()
+        self.assertFalse(DiskUsage.record(self.SITE, 'S1', 'log', '/data', 5, recorded_at='2026-02-10 00:00:00'))
+        report = {'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data', 'size_mb': 5}
+        self.assertEqual(DiskUsage.record_many([dict(report, recorded_at='2026-02-11 00:00:00'),
+                                                dict(report, recorded_at=self.NOW)]), 1)
+        after = _real_conn.execute(
+            "SELECT growth_mb FROM disk_usage_monthly WHERE sub_site = 'S1' AND bucket_ts = ?", (feb,)).fetchone()
+        self.assertEqual(tuple(after), tuple(before))
+        self.assertEqual(_real_conn.execute(
+            "SELECT COUNT(*) FROM disk_usage WHERE sub_site = 'S1' AND ts < ?", (feb + 30 * 86400,)).fetchone()[0], 0)
+
+    def test_history_before_watermark_reads_rollups(self):
+        days = (time.time() - 1767225600) / 86400 + 1
+        full = DiskUsage.get_history(self.SITE, 'S1', 'log', days=days, columnar=True)
+        self._apply()
+        cutoff = self.retention.raw_cutoff(self.NOW, 90)
+        hourly_from = self.NOW - self.NOW % 3600 - 120 * 86400
+        for columnar in (True, False):
+            history = DiskUsage.get_history(self.SITE, 'S1', 'log', days=days, columnar=columnar)
+            if not columnar:
+                history = {'recorded_at': [models_module.to_epoch(r['recorded_at']) for r in history],
+                           'size_mb': [r['size_mb'] for r in history]}
+            expected = [(ts, mb) for ts, mb in zip(full['recorded_at'], full['size_mb'])
+                        # daily rollups keep the first and last sample of each day
+                        if ts >= hourly_from or ts % 86400 in (0, 64800)]
+            self.assertEqual(list(zip(history['recorded_at'], history['size_mb'])), expected)
+            self.assertTrue(any(ts < cutoff for ts in history['recorded_at']))
+
+    def test_small_batches_and_dry_run(self):
+        dry = self._apply(dry_run=True)
+        before = self.retention.raw_cutoff(self.NOW, 90)
+        deleted = self.retention.compact_raw(_fake_get_db(), before, batch_size=7, pause=0)
+        # dry run counts every old row, compaction keeps S2's newest
+        self.assertEqual(deleted, dry['samples'] - 1)
+        self.assertEqual(self.retention.compact_raw(_fake_get_db(), before, batch_size=7, pause=0), 0)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+# 6. Connection pool (temporary file DB)
+# ════════════════════════════════════════════════════════════════════════════
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'pool.db')
+        patcher = mock.patch('models.get_database_path', return_value=self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        import shutil
+        models_module.close_db_connections()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_same_thread_reuses_connection(self):
+        self.assertIs(_pooled_get_db('test')._conn, _pooled_get_db('test')._conn)
+
+    def test_other_thread_gets_own_connection(self):
+        import threading
+        main = _pooled_get_db('test')._conn
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(_pooled_get_db('test')._conn))
+        t.start()
+        t.join()
+        self.assertIsNot(seen[0], main)
+
+    def test_pragmas_applied(self):
+        conn = _pooled_get_db('test')
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0],
+                         config.DB_BUSY_TIMEOUT_MS)
+
+    def test_close_rolls_back_uncommitted_work(self):
+        conn = _pooled_get_db('test')
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+        conn.close()
+        conn = _pooled_get_db('test')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+
+    def test_unhealthy_connection_is_replaced(self):
+        first = _pooled_get_db('test')
+        first._conn.close()
+        with mock.patch('models.DB_HEALTHCHECK_SECONDS', 0):
+            second = _pooled_get_db('test')
+        self.assertIsNot(second, first)
+        self.assertEqual(second.execute('SELECT 1').fetchone()[0], 1)
+
+    def test_reset_after_fork_opens_new_connection(self):
+        first = _pooled_get_db('test')
+        models_module._reset_pool_after_fork()
+        self.assertIsNot(_pooled_get_db('test'), first)
+
+    def test_instrumented_calls_observe_db_time_and_rows(self):
+        from prometheus_client import REGISTRY
+        conn = _pooled_get_db('test')
+        models_module.create_tables(conn.cursor())
+        conn.commit()
+
+        def sample(name):
+            return REGISTRY.get_sample_value(name, {'method': 'get_history'}) or 0
+        before = [sample(n) for n in ('loghive_db_query_seconds_count', 'loghive_db_query_seconds_sum',
+                                      'loghive_db_rows_returned_sum')]
+        with mock.patch('models.get_db_connection', _pooled_get_db):
+            for i in range(3):
+                DiskUsage.record('PoolSite', 'S1', 'log', '/data', i, 'test', recorded_at=1767225600 + i)
+            DiskUsage.get_history('PoolSite', 'S1', 'log', days=36500, environment='test')
+        self.assertEqual(sample('loghive_db_query_seconds_count'), before[0] + 1)
+        self.assertGreater(sample('loghive_db_query_seconds_sum'), before[1])
+        self.assertEqual(sample('loghive_db_rows_returned_sum'), before[2] + 3)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+# 7. Flask API (test client, no login required endpoints)
 # ════════════════════════════════════════════════════════════════════════════
 
 class TestFlaskAPI(unittest.TestCase):
@@ -272,6 +1099,35 @@ class TestFlaskAPI(unittest.TestCase):
             content_type='application/json')
         self.assertEqual(res.status_code, 401)
 
+    def test_api_report_records_and_counts(self):
+        from prometheus_client import REGISTRY
+        labels = {'site': 'Site_A', 'sub_site': 'SubSite_1', 'server_type': 'log_server'}
+        before = REGISTRY.get_sample_value('loghive_agent_reports_total', labels) or 0
+        res = self.client.post('/api/report',
+            data=json.dumps(dict(labels, token=config.API_TOKEN, path='/data', size_mb='12.5')),
+            content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(REGISTRY.get_sample_value('loghive_agent_reports_total', labels), before + 1)
+        self.assertEqual(DiskUsage.get_latest('Site_A', 'SubSite_1', 'log_server')['size_mb'], 12.5)
+        _clear('Site_A')
+
+    def test_last_update_reads_shared_version(self):
+        # A report stored by another worker only reaches this one through the database
+        before = json.loads(self.client.get('/api/last-update').data)
+        _insert('LastUpdateSite', 'S1', 'log', 1.0)
+        after = json.loads(self.client.get('/api/last-update').data)
+        self.assertGreater(after['version'], before['version'])
+        self.assertTrue(after['last_update'].endswith('+00:00'))
+
+    def test_metrics_include_report_age(self):
+        _insert('AgeSite', 'S1', 'log', 1.0)
+        body = self.client.get('/metrics').get_data(as_text=True)
+        # Servers outside SITES_CONFIG are reported under 'other'
+        self.assertIn('loghive_series_last_report_age_seconds{environment="production",server_type="other",'
+                      'site="other",sub_site="other"}', body)
+        self.assertNotIn('AgeSite', body)
+        self.assertIn('loghive_db_query_seconds_bucket{le="0.0005",method="record"}', body)
+
     def test_api_summary_redirects_without_login(self):
         res = self.client.get('/api/summary')
         self.assertIn(res.status_code, [302, 401])
@@ -283,6 +1139,895 @@ class TestFlaskAPI(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
 
 
+class TestServerLabels(unittest.TestCase):
+    SITES = {'Site_A': {'sub_sites': {'S1': {'log': {}, 'bak': {}}, 'S2': {'log': {}}}}}
+
+    def _dropped(self, reason):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('loghive_metric_labels_dropped_total',
+                                         {'metric': 'test_labels', 'reason': reason}) or 0
+
+    def test_unknown_parts_become_other(self):
+        from instrumentation import ServerLabels
+        labels = ServerLabels('test_labels', self.SITES, 100)
+        before = self._dropped('unknown')
+        self.assertEqual(labels('Site_A', 'S1', 'log'), ('Site_A', 'S1', 'log'))
+        self.assertEqual(labels('Site_A', 'S1', 'db'), ('Site_A', 'S1', 'other'))
+        self.assertEqual(labels('Site_A', 'S9', 'log'), ('Site_A', 'other', 'other'))
+        self.assertEqual(labels('Rogue', 'S1', 'log', count=5), ('other', 'other', 'other'))
+        self.assertEqual(self._dropped('unknown'), before + 7)
+
+    def test_series_cap(self):
+        from instrumentation import ServerLabels
+        labels = ServerLabels('test_labels', self.SITES, 2)
+        before = self._dropped('cap')
+        self.assertEqual(labels('Site_A', 'S1', 'log'), ('Site_A', 'S1', 'log'))
+        self.assertEqual(labels('Site_A', 'S1', 'bak'), ('Site_A', 'S1', 'bak'))
+        self.assertEqual(labels('Site_A', 'S2', 'log'), ('other', 'other', 'other'))
+        self.assertEqual(labels('Site_A', 'S1', 'log'), ('Site_A', 'S1', 'log'))
+        self.assertEqual(self._dropped('cap'), before + 1)
+
+
+class TestUserRegistry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from werkzeug.security import generate_password_hash
+        cur = _real_conn.execute(
+            "INSERT INTO users (username, password_hash, environment) VALUES ('reg_user', ?, 'test')",
+            (generate_password_hash('pw'),))
+        _real_conn.commit()
+        cls.user_id = cur.lastrowid
+        models_module.user_registry.refresh()
+
+    def test_lookups_do_no_io(self):
+        from app import load_user
+        with mock.patch.object(models_module, 'get_db_connection', side_effect=AssertionError('I/O')):
+            user = load_user(f'test:{self.user_id}')
+            self.assertEqual((user.username, user.environment), ('reg_user', 'test'))
+            self.assertEqual(user.get_id(), f'test:{self.user_id}')
+            self.assertEqual(User.verify_password('reg_user', 'pw').id, self.user_id)
+            self.assertIsNone(User.verify_password('reg_user', 'wrong'))
+            self.assertIsNone(load_user(f'production:{self.user_id}x'))
+
+    def test_at_most_one_hash_per_attempt(self):
+        # The in-memory test DB serves both environments, so reg_user exists twice
+        self.assertEqual(len(models_module.user_registry.find('reg_user')), 2)
+        with mock.patch('models.check_password_hash', return_value=False) as check:
+            User.verify_password('reg_user', 'wrong')
+            User.verify_password('nobody', 'wrong')
+        self.assertEqual(check.call_count, 1)
+
+    def test_legacy_unqualified_id(self):
+        from app import app, load_user
+        with app.test_request_context():
+            self.assertEqual(load_user(str(self.user_id)).username, 'reg_user')
+
+    def test_password_change_picked_up_after_check_interval(self):
+        from werkzeug.security import generate_password_hash
+        _real_conn.execute("UPDATE users SET password_hash = ? WHERE username = 'reg_user'",
+                           (generate_password_hash('new'),))
+        _real_conn.commit()
+        registry = models_module.user_registry
+        self.addCleanup(registry.refresh)
+        with mock.patch('models.time.monotonic', return_value=registry._checked + registry.check_seconds):
+            self.assertIsNotNone(User.verify_password('reg_user', 'new'))
+        _real_conn.execute("UPDATE users SET password_hash = ? WHERE username = 'reg_user'",
+                           (generate_password_hash('pw'),))
+        _real_conn.commit()
+
+
+class TestLoginThrottling(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        cls.flask_app = flask_app
+        cls.client = flask_app.app.test_client()
+
+    def test_token_bucket_limits_and_refills(self):
+        from auth import TokenBucket
+        bucket = TokenBucket(capacity=2, period=60)
+        with mock.patch('auth.time.monotonic', return_value=1000.0):
+            bucket.consume('k')
+            self.assertTrue(bucket.allowed('k'))
+            bucket.consume('k')
+            self.assertFalse(bucket.allowed('k'))
+            self.assertTrue(bucket.allowed('other'))
+            self.assertEqual(bucket.retry_after('k'), 31)
+        with mock.patch('auth.time.monotonic', return_value=1030.0):
+            self.assertTrue(bucket.allowed('k'))
+
+    def test_hash_pool_rejects_when_full(self):
+        import threading
+        import time
+        from auth import HashPool, PoolBusy
+        pool = HashPool(workers=1, max_pending=1)
+        release = threading.Event()
+        waiter = threading.Thread(target=pool.run, args=(release.wait,))
+        waiter.start()
+        time.sleep(0.05)
+        with self.assertRaises(PoolBusy):
+            pool.run(lambda: None)
+        release.set()
+        waiter.join()
+        self.assertEqual(pool.run(lambda: 42), 42)
+
+    def test_hash_pool_holds_slot_until_timed_out_hash_finishes(self):
+        import threading
+        from auth import HashPool, PoolBusy
+        pool = HashPool(workers=1, max_pending=1, timeout=0.05)
+        release, done = threading.Event(), threading.Event()
+        with self.assertRaises(PoolBusy):
+            pool.run(release.wait)
+        # The timed-out hash is still running on the pool thread
+        with self.assertRaises(PoolBusy):
+            pool.run(lambda: None)
+        release.set()
+        pool._executor.submit(done.set)
+        done.wait(1)
+        self.assertEqual(pool.run(lambda: 42), 42)
+
+    def test_failed_logins_are_rate_limited_before_hashing(self):
+        from auth import TokenBucket
+        limiter = TokenBucket(capacity=3, period=300)
+        with mock.patch.object(self.flask_app, 'login_failures', limiter), \
+             mock.patch.object(User, 'verify_password', return_value=None) as verify:
+            for _ in range(3):
+                res = self.client.post('/login', data={'username': 'admin', 'password': 'bad'})
+                self.assertEqual(res.status_code, 200)
+            res = self.client.post('/login', data={'username': 'admin', 'password': 'bad'})
+        self.assertEqual(res.status_code, 429)
+        self.assertIn('Retry-After', res.headers)
+        self.assertEqual(verify.call_count, 3)
+
+    def test_client_ip_from_trusted_proxy(self):
+        from auth import TokenBucket
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        limiter = TokenBucket(capacity=1, period=300)
+        app = self.flask_app.app
+        with mock.patch.object(self.flask_app, 'login_failures', limiter), \
+             mock.patch.object(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1)), \
+             mock.patch.object(User, 'verify_password', return_value=None):
+            res = self.client.post('/login', data={'username': 'a', 'password': 'bad'},
+                                   headers={'X-Forwarded-For': '198.51.100.1'})
+            self.assertEqual(res.status_code, 200)
+            # Another client behind the same proxy is not locked out
+            res = self.client.post('/login', data={'username': 'b', 'password': 'bad'},
+                                   headers={'X-Forwarded-For': '198.51.100.2'})
+            self.assertEqual(res.status_code, 200)
+            res = self.client.post('/login', data={'username': 'c', 'password': 'bad'},
+                                   headers={'X-Forwarded-For': '198.51.100.1'})
+            self.assertEqual(res.status_code, 429)
+
+    def test_busy_pool_returns_503(self):
+        from auth import PoolBusy
+        with mock.patch.object(self.flask_app.login_hash_pool, 'run', side_effect=PoolBusy):
+            res = self.client.post('/login', data={'username': 'admin', 'password': 'x'})
+        self.assertEqual(res.status_code, 503)
+
+
+class TestBatchReportAPI(unittest.TestCase):
+    SITE = 'BatchSite'
+
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        flask_app.app.config['TESTING'] = True
+        cls.client = flask_app.app.test_client()
+
+    def setUp(self):
+        _clear(self.SITE)
+
+    def _report(self, server_type, size_mb, **extra):
+        return dict(site=self.SITE, sub_site='S1', server_type=server_type,
+                    path='/data', size_mb=size_mb, **extra)
+
+    def _count(self):
+        return _real_conn.execute(
+            'SELECT COUNT(*) FROM disk_usage WHERE site = ?', (self.SITE,)).fetchone()[0]
+
+    def test_envelope_records_all_reports(self):
+        from prometheus_client import REGISTRY
+        # self.SITE is not in SITES_CONFIG
+        labels = {'site': 'other', 'sub_site': 'other', 'server_type': 'other'}
+        before = REGISTRY.get_sample_value('loghive_agent_reports_total', labels) or 0
+        body = {'token': config.API_TOKEN,
+                'reports': [self._report('log', 10), self._report('log', 20), self._report('bak', 5)]}
+        res = self.client.post('/api/report/batch', json=body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['accepted'], 3)
+        self.assertEqual(self._count(), 3)
+        self.assertEqual(REGISTRY.get_sample_value('loghive_agent_reports_total', labels), before + 3)
+
+    def test_resent_batch_is_not_counted_again(self):
+        from prometheus_client import REGISTRY
+        labels = {'site': 'other', 'sub_site': 'other', 'server_type': 'other'}
+        body = {'token': config.API_TOKEN,
+                'reports': [self._report('log', 10, recorded_at=1767225600),
+                            self._report('log', 20, recorded_at=1767229200)]}
+        self.client.post('/api/report/batch', json=body)
+        before = REGISTRY.get_sample_value('loghive_agent_reports_total', labels)
+        body['reports'].append(self._report('log', 30, recorded_at=1767232800))
+        res = self.client.post('/api/report/batch', json=body)
+        self.assertEqual(res.get_json()['duplicates'], 2)
+        self.assertEqual(REGISTRY.get_sample_value('loghive_agent_reports_total', labels), before + 1)
+
+    def test_per_item_results(self):
+        bad = self._report('log', 'abc')
+        missing = self._report('log', 1)
+        del missing['path']
+        res = self.client.post('/api/report/batch',
+                               json=[self._report('log', 1), bad, missing],
+                               headers={'X-API-Token': config.API_TOKEN})
+        data = res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([r['success'] for r in data['results']], [True, False, False])
+        self.assertEqual(data['results'][1]['error'], 'Invalid size_mb value')
+        self.assertEqual(data['results'][2]['error'], 'Missing field: path')
+        self.assertEqual(self._count(), 1)
+
+    def test_ndjson_with_per_item_tokens(self):
+        lines = [json.dumps(self._report('log', 1, token=config.API_TOKEN)),
+                 json.dumps(self._report('log', 2, token='wrong')),
+                 '{not json']
+        res = self.client.post('/api/report/batch', data='\n'.join(lines) + '\n',
+                               content_type='application/x-ndjson')
+        data = res.get_json()
+        self.assertEqual([r.get('error') for r in data['results']],
+                         [None, 'Invalid token', 'Invalid JSON'])
+        self.assertEqual(self._count(), 1)
+
+    def test_wrong_batch_token_returns_401(self):
+        res = self.client.post('/api/report/batch',
+                               json={'token': 'wrong', 'reports': [self._report('log', 1)]})
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(self._count(), 0)
+
+    def test_empty_batch_returns_400(self):
+        res = self.client.post('/api/report/batch', json={'token': config.API_TOKEN, 'reports': []})
+        self.assertEqual(res.status_code, 400)
+
+    def test_gzip_ndjson_body(self):
+        import gzip
+        lines = ''.join(json.dumps(self._report('log', i)) + '\n' for i in range(3))
+        res = self.client.post('/api/report/batch', data=gzip.compress(lines.encode()),
+                               content_type='application/x-ndjson',
+                               headers={'Content-Encoding': 'gzip', 'X-API-Token': config.API_TOKEN})
+        self.assertEqual(res.get_json()['accepted'], 3)
+        self.assertEqual(self._count(), 3)
+        res = self.client.post('/api/report/batch', data=b'not gzip', content_type='application/x-ndjson',
+                               headers={'Content-Encoding': 'gzip', 'X-API-Token': config.API_TOKEN})
+        self.assertEqual(res.status_code, 400)
+
+    def test_resent_reports_with_recorded_at_are_stored_once(self):
+        import time
+        base = int(time.time()) - 3 * 3600
+        body = {'token': config.API_TOKEN,
+                'reports': [self._report('log', size, recorded_at=base + i * 3600)
+                            for i, size in enumerate((10, 25, 40))]}
+        self.assertEqual(self.client.post('/api/report/batch', json=body).get_json()['duplicates'], 0)
+        version = DiskUsage.get_version()[0]
+        growth = DiskUsage.get_30day_growth(self.SITE, 'S1', 'log')
+
+        res = self.client.post('/api/report/batch', json=body)
+        self.assertEqual((res.get_json()['accepted'], res.get_json()['duplicates']), (3, 3))
+        self.assertEqual(self._count(), 3)
+        self.assertEqual(DiskUsage.get_version()[0], version)
+        self.assertEqual(DiskUsage.get_30day_growth(self.SITE, 'S1', 'log'), growth)
+
+        single = dict(body['reports'][1], token=config.API_TOKEN)
+        self.assertTrue(self.client.post('/api/report', json=single).get_json()['duplicate'])
+        self.assertEqual(self._count(), 3)
+
+    def test_invalid_recorded_at(self):
+        import time
+        future = self._report('log', 1, recorded_at=int(time.time()) + 3600)
+        bad = self._report('log', 1, recorded_at='yesterday')
+        res = self.client.post('/api/report/batch', json=[future, bad],
+                               headers={'X-API-Token': config.API_TOKEN})
+        self.assertEqual([r['error'] for r in res.get_json()['results']],
+                         ['recorded_at is in the future', 'Invalid recorded_at value'])
+
+
+class TestIngestQueue(unittest.TestCase):
+    def _queue(self, **kwargs):
+        from ingest import IngestQueue
+        self.batches = []
+        q = IngestQueue(self.batches.append, **kwargs)
+        self.addCleanup(q.stop)
+        return q
+
+    def test_flushes_by_batch_size(self):
+        import time
+        q = self._queue(batch_size=3, interval_ms=5000)
+        q.submit_many([1, 2, 3, 4])
+        deadline = time.monotonic() + 2
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.batches[0], [1, 2, 3])
+
+    def test_flushes_by_interval(self):
+        import time
+        q = self._queue(batch_size=100, interval_ms=20)
+        q.submit('a')
+        deadline = time.monotonic() + 2
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.batches, [['a']])
+
+    def test_backpressure_when_full(self):
+        q = self._queue(maxsize=2, interval_ms=5000)
+        q._ensure_started = lambda: None  # no writer thread: keep the queue full
+        self.assertEqual(q.submit_many(['a', 'b', 'c']), 2)
+        self.assertFalse(q.submit('d'))
+
+    def test_stop_flushes_remaining(self):
+        q = self._queue(batch_size=2, interval_ms=5000)
+        q.submit_many(['a', 'b', 'c'])
+        q.stop()
+        self.assertEqual(sum(self.batches, []), ['a', 'b', 'c'])
+
+
+class TestQueuedReportAPI(unittest.TestCase):
+    SITE = 'QueuedSite'
+
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        cls.flask_app = flask_app
+        cls.client = flask_app.app.test_client()
+
+    def setUp(self):
+        _clear(self.SITE)
+        patcher = mock.patch.object(self.flask_app, 'INGEST_MODE', 'queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _report(self, size_mb):
+        return dict(token=config.API_TOKEN, site=self.SITE, sub_site='S1',
+                    server_type='log', path='/data', size_mb=size_mb)
+
+    def test_report_is_queued_then_written(self):
+        res = self.client.post('/api/report', json=self._report(5))
+        self.assertEqual(res.status_code, 202)
+        self.flask_app.ingest_queue.flush()
+        self.assertEqual(DiskUsage.get_latest(self.SITE, 'S1', 'log')['size_mb'], 5.0)
+
+    def test_queued_reports_are_batch_inserted(self):
+        before = int(time.time())
+        for size_mb in (1, 2, 3):
+            self.client.post('/api/report', json=self._report(size_mb))
+        with mock.patch.object(models_module, '_store_sample') as store_sample:
+            self.flask_app.ingest_queue.flush()
+        store_sample.assert_not_called()
+        history = DiskUsage.get_history(self.SITE, 'S1', 'log', days=1, columnar=True)
+        self.assertEqual(history['size_mb'], [1, 2, 3])
+        self.assertGreaterEqual(history['recorded_at'][0], before)
+
+    def test_full_queue_returns_503(self):
+        with mock.patch.object(self.flask_app.ingest_queue, 'submit_many', return_value=0):
+            res = self.client.post('/api/report', json=self._report(5))
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res.headers['Retry-After'], '1')
+            res = self.client.post('/api/report/batch',
+                                   json={'token': config.API_TOKEN, 'reports': [self._report(1)]})
+            self.assertEqual(res.status_code, 503)
+
+    def test_batch_partially_queued(self):
+        with mock.patch.object(self.flask_app.ingest_queue, 'submit_many', return_value=1):
+            res = self.client.post('/api/report/batch',
+                                   json={'token': config.API_TOKEN,
+                                         'reports': [self._report(1), self._report(2)]})
+        data = res.get_json()
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(data['results'][1]['error'], 'Ingest queue full')
+
+
+class TestConditionalResponses(unittest.TestCase):
+    SITE = 'EtagSite'
+
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        cls.client = flask_app.app.test_client()
+        cur = _real_conn.execute(
+            "INSERT INTO users (username, password_hash, environment) VALUES ('etag_user', 'x', 'production')")
+        _real_conn.commit()
+        models_module.user_registry.refresh()
+        with cls.client.session_transaction() as sess:
+            sess['_user_id'] = f'production:{cur.lastrowid}'
+            sess['_fresh'] = True
+
+    def setUp(self):
+        _clear(self.SITE)
+        _insert(self.SITE, 'S1', 'log', 10.0)
+        _insert(self.SITE, 'S2', 'log', 20.0)
+
+    def test_versions_increase_per_server_and_environment(self):
+        env_before = DiskUsage.get_version()[0]
+        s2_before = DiskUsage.get_version('production', self.SITE, 'S2', 'log')
+        _insert(self.SITE, 'S1', 'log', 11.0)
+        self.assertGreater(DiskUsage.get_version()[0], env_before)
+        self.assertEqual(DiskUsage.get_version('production', self.SITE, 'S1', 'log')[0],
+                         DiskUsage.get_version()[0])
+        self.assertEqual(DiskUsage.get_version('production', self.SITE, 'S2', 'log'), s2_before)
+
+    def test_summary_revalidates_until_new_report(self):
+        res = self.client.get('/api/summary')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Last-Modified', res.headers)
+        etag = res.headers['ETag']
+        res = self.client.get('/api/summary', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        _insert(self.SITE, 'S2', 'log', 25.0)
+        res = self.client.get('/api/summary', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_stream_endpoint_is_event_stream(self):
+        res = self.client.get('/api/stream', buffered=False)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        self.assertEqual(next(res.response), b'retry: 5000\n\n')
+        res.close()
+
+    def test_stream_refused_beyond_subscriber_cap(self):
+        import app as flask_app
+        feed = flask_app.change_feed
+        with mock.patch.object(feed, 'max_subscribers', 1):
+            first = self.client.get('/api/stream', buffered=False)
+            res = self.client.get('/api/stream')
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('Retry-After', res.headers)
+            # Closing the response frees the slot even if it was never read
+            first.close()
+            self.assertEqual(feed._subscribers, {})
+            res = self.client.get('/api/stream', buffered=False)
+            self.assertEqual(res.mimetype, 'text/event-stream')
+            res.close()
+
+    def test_server_endpoints_track_their_own_server(self):
+        # distinct sizes: the same sample recorded twice in one second is a no-op
+        for size_mb, path in enumerate(('history', 'monthly', 'month-production'), 30):
+            url = f'/api/{path}/{self.SITE}/S1/log'
+            etag = self.client.get(url).headers['ETag']
+            _insert(self.SITE, 'S2', 'log', size_mb)
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+            _insert(self.SITE, 'S1', 'log', size_mb)
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_columnar_format(self):
+        res = self.client.get('/api/summary?format=columnar')
+        columns = res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(sub for site, sub in zip(columns['site'], columns['sub_site'])
+                                if site == self.SITE), ['S1', 'S2'])
+        self.assertEqual(self.client.get('/api/summary?format=csv').status_code, 400)
+        res = self.client.get(f'/api/history/{self.SITE}/S1/log?format=columnar')
+        self.assertEqual(res.get_json()['size_mb'], [10.0])
+        self.assertEqual(self.client.get(f'/api/history/{self.SITE}/S1/log?format=x').status_code, 400)
+
+    def test_compressed_response_has_own_etag(self):
+        import gzip
+        url = f'/api/history/{self.SITE}/S1/log?format=columnar'
+        import time
+        now = int(time.time())
+        for i in range(200):
+            _insert(self.SITE, 'S1', 'log', 100.0 + i, now - 3600 + i)
+        plain = self.client.get(url)
+        res = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(res.data)), plain.get_json())
+        self.assertNotEqual(res.headers['ETag'], plain.headers['ETag'])
+        with mock.patch('time.time', return_value=now + 3600):
+            self.assertEqual(self.client.get(url, headers={'Accept-Encoding': 'gzip'}).data, res.data)
+        res = self.client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': res.headers['ETag']}).status_code, 200)
+        # Small bodies are not worth compressing
+        res = self.client.get(f'/api/history/{self.SITE}/S2/log', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_msgpack_response(self):
+        import serialize
+        if not serialize.HAVE_MSGPACK:
+            self.skipTest('msgpack not installed')
+        res = self.client.get('/api/summary', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(res.mimetype, 'application/msgpack')
+        self.assertEqual(serialize.msgpack.unpackb(res.data), self.client.get('/api/summary').get_json())
+
+
+class TestDemoSeedAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        cls.app_module = flask_app
+        cls.client = flask_app.app.test_client()
+        cur = _real_conn.execute(
+            "INSERT INTO users (username, password_hash, environment) VALUES ('seed_user', 'x', 'test')")
+        _real_conn.commit()
+        models_module.user_registry.refresh()
+        with cls.client.session_transaction() as sess:
+            sess['_user_id'] = f'test:{cur.lastrowid}'
+            sess['_fresh'] = True
+
+    def test_row_limit(self):
+        from bulkload import demo_row_count, DEMO_MAX_ROWS
+        with mock.patch.object(self.app_module, 'bulk_load', return_value=0) as load:
+            res = self.client.get('/api/demo/seed?servers=1000&days=366&interval=60')
+            self.assertEqual(res.status_code, 400)
+            self.assertIn('tools/bulk_load.py', res.get_json()['error'])
+            load.assert_not_called()
+            self.assertEqual(self.client.get('/api/demo/seed?servers=100&days=30&interval=300').status_code, 200)
+            load.assert_called_once()
+        self.assertGreater(demo_row_count(1000, 366, 60), DEMO_MAX_ROWS)
+        self.assertEqual(demo_row_count(2, 1, 3600), 2 * 25)
+
+
+class TestChangeStream(unittest.TestCase):
+    SITE = 'StreamSite'
+
+    def setUp(self):
+        _clear(self.SITE)
+        from stream import ChangeFeed, event_stream
+        self.feed = ChangeFeed(interval_ms=10)
+        self.event_stream = event_stream
+
+    def _data(self, event):
+        return json.loads(event.split('data: ', 1)[1])
+
+    def test_changes_since_lists_changed_servers_in_order(self):
+        since = DiskUsage.get_version()[0]
+        _insert(self.SITE, 'S2', 'log', 20.0)
+        _insert(self.SITE, 'S1', 'log', 10.0)
+        version, changes = DiskUsage.get_changes_since(since)
+        self.assertEqual(version, DiskUsage.get_version()[0])
+        self.assertEqual([c['sub_site'] for c in changes], ['S2', 'S1'])
+        self.assertEqual(changes[1]['size_mb'], 10.0)
+        self.assertEqual(DiskUsage.get_changes_since(version)[1], [])
+
+    def test_stream_pushes_report(self):
+        events = self.event_stream(self.feed, 'production', keepalive=1, max_seconds=5)
+        self.assertEqual(next(events), 'retry: 5000\n\n')
+        _insert(self.SITE, 'S1', 'log', 42.0)
+        event = next(events)
+        events.close()
+        data = self._data(event)
+        self.assertTrue(event.startswith(f"id: {data['version']}\nevent: update\n"))
+        self.assertEqual((data['environment'], data['site'], data['size_mb']), ('production', self.SITE, 42.0))
+        self.assertEqual(self.feed._subscribers, {})
+
+    def test_subscriber_cap(self):
+        from stream import StreamFull
+        self.feed.max_subscribers = 2
+        first, second = self.feed.subscribe('production'), self.feed.subscribe('test')
+        with self.assertRaises(StreamFull):
+            self.feed.subscribe('production')
+        self.feed.unsubscribe(first)
+        self.feed.unsubscribe(self.feed.subscribe('production'))
+        self.feed.unsubscribe(second)
+
+    def test_reconnect_replays_after_last_event_id(self):
+        _insert(self.SITE, 'S1', 'log', 1.0)
+        last_id = DiskUsage.get_version()[0]
+        _insert(self.SITE, 'S2', 'log', 2.0)
+        events = self.event_stream(self.feed, 'production', last_event_id=last_id, max_seconds=0)
+        replayed = [self._data(e) for e in events if e.startswith('id:')]
+        self.assertEqual([(e['sub_site'], e['size_mb']) for e in replayed], [('S2', 2.0)])
+
+
+
+class TestDiskAgent(unittest.TestCase):
+    """agent/disk_agent.py: incremental sizing must agree with du -sk"""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from agent import disk_agent
+        if not shutil.which('du'):
+            self.skipTest('du not available')
+        self.agent = disk_agent
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        patcher = mock.patch.object(disk_agent, 'RACY_NS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for sub in ('a', 'a/x', 'b'):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+            self._write(os.path.join(sub, 'old.log'), 20000, age=2 * 86400)
+
+    def _write(self, name, size, age=0, mode='wb'):
+        path = os.path.join(self.root, name)
+        with open(path, mode) as f:
+            f.write(b'x' * size)
+        if age:
+            past = os.stat(path).st_mtime - age
+            os.utime(path, (past, past))
+            os.utime(os.path.dirname(path), (past, past))
+
+    def _du(self):
+        import subprocess
+        return int(subprocess.check_output(['du', '-sk', self.root]).split()[0])
+
+    def test_incremental_matches_du(self):
+        cache = os.path.join(self.root + '-cache', 'sizes.json')
+        self.addCleanup(lambda: os.path.exists(cache) and os.remove(cache))
+        sizer = self.agent.DirSizer(self.root, cache, full_every=0)
+        self.assertEqual(sizer.size_kb(), self._du())
+        sizer.save()
+
+        sizer = self.agent.DirSizer(self.root, cache, full_every=0)
+        sizer.load()
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertEqual((sizer.stats['dirs_read'], sizer.stats['files_statted']), (0, 3))
+
+        self._write('a/x/new.log', 50000)
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertEqual(sizer.stats['dirs_read'], 1)
+
+        self._write('a/x/new.log', 50000, mode='ab')  # file grows, directory unchanged
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertEqual(sizer.stats['dirs_read'], 0)
+
+        self._write('b/old.log', 30000, mode='ab')  # old file written in place
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertEqual(sizer.stats['dirs_read'], 0)
+
+        # the other name of a new hard link was counted in a reused directory
+        os.link(os.path.join(self.root, 'a/old.log'), os.path.join(self.root, 'b/link.log'))
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertTrue(sizer.stats['full'])
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertFalse(sizer.stats['full'])
+
+    def test_without_stat_files_old_file_write_needs_invalidate(self):
+        # --watch with inotify: unchanged directories are not stat'ed at all
+        sizer = self.agent.DirSizer(self.root, stat_files=False, full_every=0)
+        sizer.size_kb()
+        sizer.size_kb()
+        self.assertEqual(sizer.stats['files_statted'], 0)
+        self._write('b/old.log', 30000, mode='ab')
+        stale = sizer.size_kb()
+        self.assertLess(stale, self._du())
+        sizer.invalidate(os.path.join(self.root, 'b'))
+        self.assertEqual(sizer.size_kb(), self._du())
+        self.assertEqual(sizer.stats['dirs_read'], 1)
+
+    def test_size_mb_truncates_like_bc(self):
+        self.assertEqual(self.agent.size_mb(1535), 1.49)
+        self.assertEqual(self.agent.size_mb(0), 0.0)
+
+
+
+class TestAgentSpool(unittest.TestCase):
+    """agent/spool.py against the batch endpoint, through the test client"""
+    SITE = 'SpoolSite'
+
+    @classmethod
+    def setUpClass(cls):
+        import app as flask_app
+        flask_app.app.config['TESTING'] = True
+        cls.client = flask_app.app.test_client()
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from agent import spool
+        self.module = spool
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        self.spool = spool.Spool(os.path.join(tmp, 'spool.ndjson'))
+        self.up = True
+        self.sent = []
+        _clear(self.SITE)
+
+    def _send(self, lines):
+        import gzip
+        self.sent.append(len(lines))
+        if not self.up:
+            return None
+        return self.client.post('/api/report/batch', data=gzip.compress(b''.join(lines)),
+                                content_type='application/x-ndjson',
+                                headers={'Content-Encoding': 'gzip', 'X-API-Token': config.API_TOKEN}).status_code
+
+    def _drain(self, **kwargs):
+        return self.spool.drain(self._send, sleep=lambda s: None, **kwargs)
+
+    def _append(self, count, start=0):
+        for i in range(start, start + count):
+            self.spool.append({'site': self.SITE, 'sub_site': 'S1', 'server_type': 'log', 'path': '/data',
+                               'size_mb': 10.0 + i, 'recorded_at': 1700000000 + i * 3600})
+
+    def _count(self):
+        return _real_conn.execute(
+            'SELECT COUNT(*) FROM disk_usage WHERE site = ?', (self.SITE,)).fetchone()[0]
+
+    def test_outage_then_catch_up_in_batches(self):
+        self._append(5)
+        self.up = False
+        self.assertEqual(self._drain(max_attempts=3), (0, 5))
+        self.assertEqual(self.sent, [5, 5, 5])
+        self._append(2, start=5)
+        self.up = True
+        self.sent = []
+        self.assertEqual(self._drain(batch_size=3), (7, 0))
+        self.assertEqual(self.sent, [3, 3, 1])
+        self.assertEqual(self._count(), 7)
+        self.assertEqual(os.path.getsize(self.spool.path), 0)
+
+    def test_resent_batch_is_not_duplicated(self):
+        self._append(3)
+        lines = self.spool.peek(10)
+        self.assertEqual(self._drain(), (3, 0))
+        self.assertEqual(self._send(lines), 200)
+        self.assertEqual(self._count(), 3)
+
+    def test_catch_up_rewrites_the_spool_a_few_times(self):
+        self.spool.compact_bytes = 0
+        self._append(64)
+        with mock.patch.object(self.spool, '_rewrite', wraps=self.spool._rewrite) as rewrite:
+            self.assertEqual(self._drain(batch_size=4), (64, 0))
+        self.assertLessEqual(rewrite.call_count, 5)  # at half, a quarter, ... left
+        self.assertEqual(os.path.getsize(self.spool.path), 0)
+        self.assertEqual(self._count(), 64)
+
+    def test_lost_offset_file_resends_delivered_lines(self):
+        self.spool.compact_bytes = 1 << 30
+        self._append(3)
+        self.assertEqual(self._send(self.spool.peek(2)), 200)
+        self.spool.remove(2)
+        self.assertEqual(len(self.spool), 1)
+        os.remove(self.spool.offset_path)
+        self.assertEqual(len(self.spool), 3)
+        self.assertEqual(self._drain(), (3, 0))
+        self.assertEqual(self._count(), 3)
+
+    def test_wrong_token_stops_retrying(self):
+        self._append(1)
+        self.assertEqual(self.spool.drain(lambda lines: 401, sleep=lambda s: None, max_attempts=5), (0, 1))
+
+    def test_size_cap_drops_oldest_and_partial_line_waits(self):
+        self.spool.max_bytes = 400
+        self._append(10)
+        lines = self.spool.peek(100)
+        self.assertGreater(self.spool.dropped, 0)
+        self.assertEqual(json.loads(lines[-1])['size_mb'], 19.0)
+        self.assertLessEqual(sum(map(len, lines)), 400)
+        self.assertLessEqual(os.path.getsize(self.spool.path), 800)
+        self.assertEqual(len(self.spool), len(lines))
+        with open(self.spool.path, 'ab') as f:
+            f.write(b'{"site": "Spo')
+        self.assertEqual(self.spool.peek(100), lines)
+
+
+
+class TestSiteRelay(unittest.TestCase):
+    """agent/relay.py: agents post to the relay, which forwards spooled batches"""
+    SITE = 'RelaySite'
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        import threading
+        from agent import relay
+        import app as flask_app
+        self.client = flask_app.app.test_client()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        token = mock.patch.object(relay, 'API_TOKEN', config.API_TOKEN)
+        token.start()
+        self.addCleanup(token.stop)
+        self.relay = relay.Relay(os.path.join(tmp, 'spool.ndjson'), 'http://127.0.0.1:9/api/report',
+                                 interval=3600, batch_size=100)
+        self.relay.forwarder.sleep = lambda seconds: None
+        server = self.relay.serve('127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(self.relay.shutdown)
+        self.port = server.server_address[1]
+        _clear(self.SITE)
+
+    def _post(self, path, body, headers=None):
+        import http.client
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request('POST', path, body, {'Content-Type': 'application/json', **(headers or {})})
+        response = conn.getresponse()
+        data = json.loads(response.read())
+        conn.close()
+        return response.status, data
+
+    def _forward(self, lines):
+        import gzip
+        return self.client.post('/api/report/batch', data=gzip.compress(b''.join(lines)),
+                                content_type='application/x-ndjson',
+                                headers={'Content-Encoding': 'gzip', 'X-API-Token': config.API_TOKEN}).status_code
+
+    def _report(self, server_type, size_mb, **extra):
+        return dict(site=self.SITE, sub_site='S1', server_type=server_type, path='/data', size_mb=size_mb, **extra)
+
+    def _count(self):
+        return _real_conn.execute(
+            'SELECT COUNT(*) FROM disk_usage WHERE site = ?', (self.SITE,)).fetchone()[0]
+
+    def test_reports_are_spooled_then_forwarded_in_one_batch(self):
+        for i in range(3):
+            status, _ = self._post('/api/report', json.dumps(self._report(f'srv{i}', i, token=config.API_TOKEN)))
+            self.assertEqual(status, 200)
+        status, data = self._post('/api/report/batch', json.dumps([self._report('bak', 1), {'site': 'x'}]),
+                                  {'X-API-Token': config.API_TOKEN})
+        self.assertEqual((data['accepted'], data['rejected']), (1, 1))
+        self.assertEqual(self._post('/api/report', json.dumps(self._report('log', 1, token='bad')))[0], 401)
+        self.assertEqual(len(self.relay.spool), 4)
+
+        # Upstream down: everything stays spooled
+        self.relay.forwarder.flush()
+        self.assertEqual(len(self.relay.spool), 4)
+        self.assertEqual(self._count(), 0)
+
+        sent = []
+        self.relay.upstream.send = lambda lines: sent.append(len(lines)) or self._forward(lines)
+        self.relay.forwarder.flush()
+        self.assertEqual(sent, [4])
+        self.assertEqual(self._count(), 4)
+        self.assertEqual(len(self.relay.spool), 0)
+
+        metrics = self.relay.metrics.render()
+        self.assertIn('loghive_relay_reports_received_total 4', metrics)
+        self.assertIn('loghive_relay_reports_rejected_total 2', metrics)
+        self.assertIn('loghive_relay_spool_reports 0', metrics)
+
+    def test_oversized_bodies_are_rejected(self):
+        import gzip
+        import http.client
+        from agent import relay
+        with mock.patch.object(relay, 'RELAY_MAX_BODY_BYTES', 100000):
+            # A gzip bomb is decoded only up to the limit
+            bomb = gzip.compress(b' ' * (10 * 1024 * 1024))
+            status, _ = self._post('/api/report/batch', bomb,
+                                   {'Content-Encoding': 'gzip', 'X-API-Token': config.API_TOKEN})
+            self.assertEqual(status, 413)
+
+            # A body left unread must not be parsed as the next request
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+            conn.request('POST', '/api/report', b'x' * 200000, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 413)
+            self.assertTrue(response.will_close)
+            conn.close()
+        self.assertEqual(len(self.relay.spool), 0)
+
+    def test_recorded_at_checked_like_the_server(self):
+        from agent import relay
+        import time
+        now = int(time.time())
+
+        def spooled(**extra):
+            return json.loads(relay.validate(self._report('log', 1, **extra), config.API_TOKEN))['recorded_at']
+        self.assertEqual(spooled(recorded_at='2026-01-01T00:00:00Z'), 1767225600)
+        self.assertEqual(spooled(recorded_at=1767225600.5), 1767225600)
+        self.assertGreaterEqual(spooled(recorded_at=None), now)
+        for bad, error in (('yesterday', 'Invalid recorded_at value'), ([1], 'Invalid recorded_at value'),
+                           (now + 3600, 'recorded_at is in the future')):
+            with self.assertRaisesRegex(ValueError, error):
+                spooled(recorded_at=bad)
+        status, data = self._post('/api/report/batch', json.dumps([self._report('log', 1, recorded_at='x')]),
+                                  {'X-API-Token': config.API_TOKEN})
+        self.assertEqual((data['accepted'], data['rejected']), (0, 1))
+        self.assertEqual(len(self.relay.spool), 0)
+
+    def test_notify_from_many_threads(self):
+        import threading
+        forwarder = self.relay.forwarder
+        forwarder.batch_size = 10 ** 9  # no drain while counting
+        threads = [threading.Thread(target=lambda: [forwarder.notify(1) for _ in range(1000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(forwarder.pending, 8000)
+
+
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity=2)
     suite = unittest.TestLoader().loadTestsFromModule(sys.modules[__name__])
@@ -0,0 +1,45 @@
+"""
+Bulk load samples into a database in one transaction
+Either a synthetic demo fleet or history exported from another system as CSV
+with the columns site,sub_site,server_type,path,recorded_at,size_mb
+(recorded_at as epoch seconds or 'YYYY-MM-DD HH:MM:SS' / ISO 8601, UTC).
+
+    python tools/bulk_load.py test --servers 100 --days 30 --interval 300 --replace
+    python tools/bulk_load.py production --csv history.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+# Add project root to path so 'models' can be imported from tools/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bulkload import bulk_load, demo_rows, DEMO_FLEET
+from models import init_db, to_epoch, close_db_connections
+
+
+def csv_rows(path):
+    """Yield bulk_load rows from a CSV file with a header line"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield (row['site'], row['sub_site'], row['server_type'], row['path'],
+                   to_epoch(row['recorded_at']), float(row['size_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk load LogHive samples')
+    parser.add_argument('environment', choices=['production', 'test'])
+    parser.add_argument('--csv', help='import this CSV file instead of generating demo data')
+    parser.add_argument('--servers', type=int, default=len(DEMO_FLEET), help='demo servers')
+    parser.add_argument('--days', type=float, default=60, help='days of demo history')
+    parser.add_argument('--interval', type=int, default=86400, help='seconds between demo samples')
+    parser.add_argument('--replace', action='store_true', help='delete all existing samples first')
+    args = parser.parse_args()
+
+    init_db()
+    rows = csv_rows(args.csv) if args.csv else demo_rows(args.servers, args.days, args.interval)
+    start = time.perf_counter()
+    inserted = bulk_load(rows, args.environment, replace=args.replace)
+    print(f"{args.environment}: loaded {inserted} samples in {time.perf_counter() - start:.2f}s")
+    close_db_connections()
@@ -4,11 +4,14 @@ This will remove existing databases and create fresh ones
 """
 import os
 from config import get_database_path
-from models import init_db
+from models import init_db, close_db_connections
 
 def clean_and_init():
     """Remove old databases and create fresh ones"""
     
+    # Pooled connections would keep writing to the removed files
+    close_db_connections()
+    
     # Remove old databases
     for env in ['production', 'test']:
         db_path = get_database_path(env)
@@ -17,6 +20,10 @@ def clean_and_init():
             os.remove(db_path)
         else:
             print(f"No existing {env} database found")
+        # WAL mode side files
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
     
     print("\nCreating fresh databases...")
     init_db()
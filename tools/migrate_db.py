@@ -1,11 +1,149 @@
 """
-Database migration script to add environment column to existing databases
+Database migration script for existing databases:
+- add environment column to users
+- convert disk_usage.recorded_at text timestamps to the integer ts column
+- move disk_usage rows into the series / samples tables
+- add the deadband run columns (last_seen, sample_count) to samples
+- backfill the hourly/daily/monthly growth rollups
 """
 import sqlite3
 import os
+import sys
+
+# Add project root to path so 'config' / 'models' can be imported from tools/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from config import get_database_path, USERS_CONFIG
+from models import create_tables, rebuild_rollups, ROLLUPS
 from werkzeug.security import generate_password_hash
 
+
+def migrate_epoch_timestamps(conn):
+    """Rebuild disk_usage with UTC epoch ts instead of mixed-format recorded_at text.
+    Both 'YYYY-MM-DD HH:MM:SS' (CURRENT_TIMESTAMP) and ISO 'T' strings are converted.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(disk_usage)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns or 'ts' in columns:
+        return False
+    
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute("DROP INDEX IF EXISTS idx_disk_usage_lookup")
+        cursor.execute("ALTER TABLE disk_usage RENAME TO disk_usage_old")
+        # Intermediate row-per-sample layout; migrate_series() converts it next
+        cursor.execute('''
+            CREATE TABLE disk_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                site TEXT NOT NULL,
+                sub_site TEXT NOT NULL,
+                server_type TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size_mb REAL NOT NULL,
+                ts INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO disk_usage (id, site, sub_site, server_type, path, size_mb, ts)
+            SELECT id, site, sub_site, server_type, path, size_mb,
+                   CAST(strftime('%s', recorded_at) AS INTEGER)
+            FROM disk_usage_old
+            WHERE strftime('%s', recorded_at) IS NOT NULL
+        ''')
+        converted = cursor.rowcount
+        cursor.execute("SELECT COUNT(*) FROM disk_usage_old")
+        skipped = cursor.fetchone()[0] - converted
+        cursor.execute("DROP TABLE disk_usage_old")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    print(f"Converted {converted} disk_usage rows to epoch timestamps"
+          + (f" ({skipped} unparseable rows skipped)" if skipped else ""))
+    return True
+
+
+def migrate_series(conn):
+    """Move a disk_usage table into series + samples; disk_usage becomes a view.
+    Exact duplicate samples (same server, second and size) are stored once."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'disk_usage'")
+    row = cursor.fetchone()
+    if not row or row[0] != 'table':
+        return False
+    
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute("DROP INDEX IF EXISTS idx_disk_usage_lookup")
+        cursor.execute("ALTER TABLE disk_usage RENAME TO disk_usage_old")
+        create_tables(cursor)
+        # Each server keeps the path of its newest row (bare column of MAX(ts))
+        cursor.execute('''
+            INSERT INTO series (site, sub_site, server_type, path)
+            SELECT site, sub_site, server_type, path FROM (
+                SELECT site, sub_site, server_type, path, MAX(ts) FROM disk_usage_old
+                GROUP BY site, sub_site, server_type
+            )
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO samples (series_id, ts, size_mb)
+            SELECT s.id, d.ts, d.size_mb FROM disk_usage_old d
+            JOIN series s ON s.site = d.site AND s.sub_site = d.sub_site AND s.server_type = d.server_type
+            ORDER BY s.id, d.ts, d.size_mb
+        ''')
+        converted = cursor.rowcount
+        cursor.execute("SELECT COUNT(*) FROM disk_usage_old")
+        duplicates = cursor.fetchone()[0] - converted
+        cursor.execute("DROP TABLE disk_usage_old")
+        if duplicates:
+            # Sample counts in existing rollups included the duplicates
+            rebuild_rollups(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    print(f"Moved {converted} disk_usage rows into series/samples"
+          + (f" ({duplicates} duplicate rows dropped)" if duplicates else ""))
+    return True
+
+
+def migrate_sample_runs(conn):
+    """Add last_seen / sample_count (deadband runs) to a samples table created
+    before they existed. Existing rows stay single samples."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(samples)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns or 'last_seen' in columns:
+        return False
+    cursor.execute("ALTER TABLE samples ADD COLUMN last_seen INTEGER")
+    cursor.execute("ALTER TABLE samples ADD COLUMN sample_count INTEGER NOT NULL DEFAULT 1")
+    conn.commit()
+    return True
+
+
+def migrate_rollups(conn):
+    """Create the rollup tables and fill them from existing disk_usage rows
+    (also when a rollup tier was added after the others were filled)"""
+    cursor = conn.cursor()
+    create_tables(cursor)
+    filled = []
+    for table in ROLLUPS:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+        filled.append(cursor.fetchone()[0])
+    if all(filled):
+        return False
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM disk_usage)")
+    if not cursor.fetchone()[0]:
+        conn.commit()
+        return False
+    
+    rebuild_rollups(cursor)
+    conn.commit()
+    return True
+
+
 def migrate_database(environment):
     """Add environment column to users table if it doesn't exist"""
     db_path = get_database_path(environment)
@@ -54,6 +192,18 @@ def migrate_database(environment):
                 conn.commit()
                 print(f"User {user_config['username']} created")
     
+    if migrate_epoch_timestamps(conn):
+        print(f"Timestamp migration complete for {environment} database")
+    
+    if migrate_series(conn):
+        print(f"Series migration complete for {environment} database")
+    
+    if migrate_sample_runs(conn):
+        print(f"Sample run columns added to {environment} database")
+    
+    if migrate_rollups(conn):
+        print(f"Rollup backfill complete for {environment} database")
+    
     conn.close()
 
 if __name__ == '__main__':
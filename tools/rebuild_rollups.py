@@ -0,0 +1,26 @@
+"""
+Rebuild the hourly/daily/monthly growth rollups from raw disk_usage rows
+Use after editing disk_usage by hand or restoring a backup
+"""
+import os
+import sys
+import time
+
+# Add project root to path so 'models' can be imported from tools/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import get_database_path
+from models import DiskUsage
+
+
+def rebuild(environments):
+    for env in environments:
+        if not os.path.exists(get_database_path(env)):
+            print(f"No {env} database found, skipping")
+            continue
+        start = time.perf_counter()
+        DiskUsage.rebuild_rollups(env)
+        print(f"Rebuilt {env} rollups in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    rebuild(sys.argv[1:] or ['production', 'test'])
@@ -0,0 +1,175 @@
+"""
+Apply the retention policy to the databases
+Raw samples -> hourly rollups -> daily rollups; monthly rollups are kept forever.
+Safe to run while the app is live (e.g. daily from cron): rows are deleted in
+small transactions, and growth numbers come from rollups that are not touched.
+
+    python tools/retention.py [production] [test] [--dry-run] [--vacuum]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path so 'models' can be imported from tools/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import (
+    get_database_path, RETENTION_RAW_DAYS, RETENTION_HOURLY_DAYS, RETENTION_DAILY_DAYS,
+    RETENTION_BATCH_SIZE, RETENTION_PAUSE_MS
+)
+from models import get_db_connection, compacted_before, month_range, close_db_connections
+
+VACUUM_STEP_PAGES = 1000
+
+
+def raw_cutoff(now, raw_days):
+    """Start of the month containing now - raw_days: every hourly, daily and
+    monthly bucket then lies entirely before or entirely after it"""
+    return month_range(time.strftime('%Y-%m', time.gmtime(now - raw_days * 86400)))[0]
+
+
+def _servers(cursor):
+    cursor.execute('SELECT DISTINCT site, sub_site, server_type FROM disk_usage_monthly')
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def _delete_batches(conn, table, primary_key, where, params, batch_size, pause):
+    """Delete the rows matching `where` (a primary key prefix range), at most
+    batch_size rows per transaction. Returns the number of rows deleted."""
+    pk = ', '.join(primary_key)
+    deleted = 0
+    while True:
+        cursor = conn.cursor()
+        cursor.execute(
+            f'DELETE FROM {table} WHERE ({pk}) IN (SELECT {pk} FROM {table} WHERE {where} LIMIT ?)',
+            (*params, batch_size)
+        )
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def compact_raw(conn, before, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_PAUSE_MS / 1000):
+    """Delete raw samples before `before` (the newest sample of every server
+    is kept so latest-value lookups still find it). Returns rows deleted."""
+    cursor = conn.cursor()
+    # Move the watermark first: from now on rollups before it are never
+    # recomputed from the (partially deleted) raw samples
+    before = max(before, compacted_before(cursor))
+    cursor.execute(
+        "INSERT OR REPLACE INTO retention_watermark (tier, before_ts) VALUES ('disk_usage', ?)",
+        (before,)
+    )
+    conn.commit()
+
+    deleted = 0
+    cursor.execute('SELECT id FROM series')
+    for (series_id,) in cursor.fetchall():
+        cursor.execute('SELECT MAX(ts) FROM samples WHERE series_id = ?', (series_id,))
+        latest = cursor.fetchone()[0]
+        if latest is not None:
+            deleted += _delete_batches(conn, 'samples', ('series_id', 'ts', 'size_mb'),
+                                       'series_id = ? AND ts < ?', (series_id, min(before, latest)),
+                                       batch_size, pause)
+    return deleted
+
+
+def trim_rollup(conn, table, before, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_PAUSE_MS / 1000):
+    """Delete rollup buckets starting before `before`. Returns rows deleted."""
+    cursor = conn.cursor()
+    return sum(_delete_batches(conn, table, ('site', 'sub_site', 'server_type', 'bucket_ts'),
+                               'site = ? AND sub_site = ? AND server_type = ? AND bucket_ts < ?',
+                               (*key, before), batch_size, pause)
+               for key in _servers(cursor))
+
+
+def incremental_vacuum(conn, pause=RETENTION_PAUSE_MS / 1000):
+    """Release free pages in steps; returns pages freed, or None when the
+    database is not in incremental auto_vacuum mode"""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        return None
+    freed = 0
+    while True:
+        cursor.execute('PRAGMA freelist_count')
+        free = cursor.fetchone()[0]
+        if not free:
+            return freed
+        # executescript steps the pragma to completion; execute() frees one page
+        conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});')
+        freed += min(free, VACUUM_STEP_PAGES)
+        time.sleep(pause)
+
+
+def full_vacuum(conn):
+    """Switch to incremental auto_vacuum and rewrite the file. Blocks writers
+    for the whole rewrite, so run it in a maintenance window."""
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+
+
+def apply_retention(environment, now=None, raw_days=RETENTION_RAW_DAYS, hourly_days=RETENTION_HOURLY_DAYS,
+                    daily_days=RETENTION_DAILY_DAYS, dry_run=False):
+    """Run every retention step on one environment; returns {step: rows}"""
+    now = int(time.time()) if now is None else now
+    before = raw_cutoff(now, raw_days)
+    hourly_before = now - now % 3600 - hourly_days * 86400
+    daily_before = now - now % 86400 - daily_days * 86400 if daily_days else None
+
+    conn = get_db_connection(environment)
+    cursor = conn.cursor()
+    if dry_run:
+        counts = {}
+        cursor.execute('SELECT COUNT(*) FROM samples WHERE ts < ?', (before,))
+        counts['samples'] = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM disk_usage_hourly WHERE bucket_ts < ?', (hourly_before,))
+        counts['disk_usage_hourly'] = cursor.fetchone()[0]
+        if daily_before is not None:
+            cursor.execute('SELECT COUNT(*) FROM disk_usage_daily WHERE bucket_ts < ?', (daily_before,))
+            counts['disk_usage_daily'] = cursor.fetchone()[0]
+        conn.close()
+        return counts
+
+    counts = {
+        'samples': compact_raw(conn, before),
+        'disk_usage_hourly': trim_rollup(conn, 'disk_usage_hourly', hourly_before),
+    }
+    if daily_before is not None:
+        counts['disk_usage_daily'] = trim_rollup(conn, 'disk_usage_daily', daily_before)
+    counts['vacuum_pages'] = incremental_vacuum(conn)
+    conn.close()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply the LogHive retention policy')
+    parser.add_argument('environments', nargs='*', default=['production', 'test'])
+    parser.add_argument('--dry-run', action='store_true', help='only count the rows that would be deleted')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='full VACUUM into incremental auto_vacuum mode (locks the database)')
+    args = parser.parse_args()
+
+    print(f"Policy: raw {RETENTION_RAW_DAYS}d, hourly {RETENTION_HOURLY_DAYS}d, "
+          f"daily {RETENTION_DAILY_DAYS or 'forever'}{'d' if RETENTION_DAILY_DAYS else ''}, monthly forever")
+    for env in args.environments:
+        if not os.path.exists(get_database_path(env)):
+            print(f"No {env} database found, skipping")
+            continue
+        start = time.perf_counter()
+        counts = apply_retention(env, dry_run=args.dry_run)
+        verb = 'Would delete' if args.dry_run else 'Deleted'
+        rows = ', '.join(f"{n} {table}" for table, n in counts.items() if table != 'vacuum_pages')
+        print(f"{env}: {verb} {rows} rows in {time.perf_counter() - start:.2f}s")
+        if counts.get('vacuum_pages') is None and not args.dry_run:
+            print(f"  {env} is not in incremental auto_vacuum mode; run once with --vacuum to enable it")
+        elif not args.dry_run:
+            print(f"  Released {counts['vacuum_pages']} free pages")
+        if args.vacuum and not args.dry_run:
+            conn = get_db_connection(env)
+            full_vacuum(conn)
+            conn.close()
+            print(f"  {env} vacuumed (auto_vacuum = INCREMENTAL)")
+    close_db_connections()
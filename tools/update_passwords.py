@@ -100,6 +100,7 @@ except Exception as e:
 
 print("\n" + "=" * 60)
 print("Password update complete!")
+print("Running LogHive workers reload users within USER_REGISTRY_CHECK_SECONDS (default 5s)")
 print("=" * 60)
 print("\nYou can now login with:")
 print(f"  Production: {admin_username} / (password from .env)")